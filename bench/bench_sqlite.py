@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Benchmark SQLite connection profiles
+====================================
+Compare write throughput and read concurrency of the SQLite pragma
+profiles that may be set in config.cfg.
+
+    python bench/bench_sqlite.py [--rows 500] [--seconds 3] [--readers 4]
+                                 [--backup-rows 20000]
+
+write:  rows/s inserting one Parent per transaction (every commit syncs)
+read:   searches/s completed by reader threads while a writer inserts,
+        and the number of reads that failed with "database is locked"
+backup: MB/s of database backed up and restored, for the SQLite copy
+        and for JSON lines of rows, and the size of each backup
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy.exc import OperationalError
+from skillsdb import (models, backup)
+
+PROFILES = [
+    ('default', {}),
+    ('wal', {'journal_mode':'wal'}),
+    ('wal+normal', {'journal_mode':'wal', 'synchronous':'normal'}),
+    ('config.cfg', {'journal_mode':'wal', 'synchronous':'normal', 'cache_size':'-16000',
+                    'mmap_size':'268435456', 'busy_timeout':'5000', 'temp_store':'memory'}),
+]
+
+def get_session(path, pragmas):
+    return models.init(uri='bench.sqlite', path=path, dbtype='sqlite', user='skills',
+                       passwd='skills', host='', pragmas=pragmas)
+
+def bench_write(path, pragmas, rows):
+    session = get_session(path, pragmas)
+    start = time.time()
+    for i in xrange(rows):
+        session.add(models.Parent(first_name='First%s' % i, second_name='Second%s' % (i % 50)))
+        session.commit()
+    elapsed = time.time() - start
+    session.close()
+    return rows / elapsed
+
+def bench_read(path, pragmas, seconds, readers):
+    stop = threading.Event()
+    counts = {'reads':0, 'locked':0, 'writes':0}
+    lock = threading.Lock()
+
+    def writer():
+        session = get_session(path, pragmas)
+        while not stop.is_set():
+            session.add(models.Parent(first_name='Writer', second_name='Writer'))
+            try:
+                session.commit()
+                counts['writes'] += 1
+            except OperationalError:
+                session.rollback()
+        session.close()
+
+    def reader():
+        session = get_session(path, pragmas)
+        while not stop.is_set():
+            try:
+                session.query(models.Parent).filter(
+                    models.Parent.second_name.like('%Second1%')).count()
+                session.commit()
+                with lock:
+                    counts['reads'] += 1
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    counts['locked'] += 1
+        session.close()
+
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=reader) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts['reads'] / float(seconds), counts['writes'] / float(seconds), counts['locked']
+
+def bench_backup(path, rows):
+    session = get_session(path, PROFILES[-1][1])
+    session.execute(models.Parent.__table__.insert(), [
+        {'first_name':'First%s' % i, 'second_name':'Second%s' % (i % 50)}
+        for i in xrange(rows)])
+    session.commit()
+    size = os.path.getsize(os.path.join(path, 'bench.sqlite')) / 1e6
+    results = []
+    for name, write in [('sqlite', backup.backup), ('rows', backup.backup_rows)]:
+        filename = os.path.join(path, 'bench_%s.gz' % name)
+        start = time.time()
+        write(session, filename)
+        backup_rate = size / (time.time() - start)
+        start = time.time()
+        backup.restore(session, filename)
+        restore_rate = size / (time.time() - start)
+        session = get_session(path, PROFILES[-1][1])
+        results.append((name, size, os.path.getsize(filename) / 1e6, backup_rate, restore_rate))
+    session.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500, help='rows written (500)')
+    parser.add_argument('--seconds', type=float, default=3, help='read test duration (3)')
+    parser.add_argument('--readers', type=int, default=4, help='reader threads (4)')
+    parser.add_argument('--backup-rows', dest='backup_rows', type=int, default=20000,
+                        help='parents in the backed up database (20000)')
+    args = parser.parse_args()
+
+    print '%-12s %12s %12s %12s %8s' % ('profile', 'write rows/s', 'reads/s', 'writes/s', 'locked')
+    for name, pragmas in PROFILES:
+        path = tempfile.mkdtemp(prefix='skillsdb_bench_')
+        try:
+            write_rate = bench_write(path, pragmas, args.rows)
+            read_rate, concurrent_writes, locked = bench_read(
+                path, pragmas, args.seconds, args.readers)
+        finally:
+            shutil.rmtree(path)
+        print '%-12s %12.1f %12.1f %12.1f %8d' % (
+            name, write_rate, read_rate, concurrent_writes, locked)
+
+    print
+    print '%-12s %12s %12s %12s %12s' % ('backup', 'database MB', 'backup MB',
+                                         'backup MB/s', 'restore MB/s')
+    path = tempfile.mkdtemp(prefix='skillsdb_bench_')
+    try:
+        for result in bench_backup(path, args.backup_rows):
+            print '%-12s %12.1f %12.1f %12.1f %12.1f' % result
+    finally:
+        models.dispose()
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
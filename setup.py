@@ -14,4 +14,8 @@ setup(
     requires=[
         "sqlalchemy",
     ],
+    # Faster matching of many requirements (skillsdb match)
+    extras_require={
+        "numpy": ["numpy"],
+    },
 )
@@ -0,0 +1,6 @@
+# Modules keeping derived data up to date through ORM session events
+import household
+import stats
+import changes
+import vocabulary
+import geo
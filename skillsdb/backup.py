@@ -0,0 +1,314 @@
+"""
+Backup and restore
+==================
+Write a consistent, gzip compressed copy of a database while it is in use.
+
+SQLite databases are copied page by page into a new database file, which
+is then compressed. The copy is made with, in order of preference:
+
+    backup API      --pages pages at a time, so writers wait at most for
+                    one step (Python 3.7+ sqlite3)
+    VACUUM INTO     one read transaction (SQLite 3.27+), which in WAL mode
+                    never blocks writers
+    iterdump        SQL statements replayed in a read transaction
+
+MySQL databases are written as JSON lines, one per row, read in a single
+START TRANSACTION WITH CONSISTENT SNAPSHOT, so InnoDB tables are copied
+as at one moment without locking them.
+
+Restore detects the kind of backup. A SQLite backup replaces the database
+file, or the rows of an in memory database, for what-if copies. A JSON
+lines backup replaces the rows of every table, in any type of database.
+"""
+import os
+import gzip
+import json
+import shutil
+import sqlite3
+import tempfile
+
+import sqlalchemy as sa
+
+import utils
+import models
+import changes
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Pages copied per step of the SQLite backup API
+PAGES = 1024
+# Rows inserted per statement when restoring JSON lines
+BATCH_SIZE = 1000
+SQLITE_HEADER = 'SQLite format 3\x00'
+CHUNK = 1024 * 1024
+
+class BackupError(Exception):pass
+
+def sqlite_copy(source, path, pages=PAGES):
+    """ Copy the database of DB-API connection source to a new file path
+        Returns the method used
+    """
+    if hasattr(source, 'backup'):
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+        return 'backup'
+    if sqlite3.sqlite_version_info >= (3, 27, 0):
+        source.execute('VACUUM INTO ?', (path,))
+        return 'vacuum'
+    target = sqlite3.connect(path)
+    try:
+        source.execute('BEGIN')
+        try:
+            for statement in source.iterdump():
+                target.execute(statement)
+        finally:
+            source.rollback()
+        target.commit()
+    finally:
+        target.close()
+    return 'iterdump'
+
+def compress(path, filename):
+    """ Write file path gzip compressed to filename
+    """
+    with open(path, 'rb') as src:
+        out = gzip.open(filename, 'wb')
+        try:
+            shutil.copyfileobj(src, out, CHUNK)
+        finally:
+            out.close()
+
+def backup_sqlite(session, filename, pages=PAGES):
+    """ Write a compressed copy of the SQLite database of session to filename
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, path = tempfile.mkstemp(prefix='skillsdb_backup_', dir=directory)
+    os.close(handle)
+    os.remove(path)
+    try:
+        # The raw connection, outside any transaction of the session
+        raw = session.bind.raw_connection()
+        try:
+            method = sqlite_copy(raw.connection, path, pages)
+        finally:
+            raw.close()
+        compress(path, filename)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    log.info('Backed up %s using %s' % (session.bind.url.database, method))
+
+def backup_rows(session, filename):
+    """ Write every row of every table to filename as compressed JSON lines,
+        read in one consistent snapshot
+    """
+    conn = session.bind.connect()
+    out = gzip.open(filename, 'wb')
+    try:
+        # The read transaction ends when the connection is closed
+        if conn.dialect.name == 'mysql':
+            conn.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            conn.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+        else:
+            conn.execute('BEGIN')
+        for table in models.metadata.sorted_tables:
+            keys = [col.name for col in table.columns]
+            result = conn.execution_options(stream_results=True).execute(
+                sa.select(list(table.columns)).order_by(table.c.id))
+            for row in result:
+                out.write(json.dumps({'table':table.name, 'row':dict(
+                    (key, formats.fmt_value(value)) for key, value in zip(keys, row))},
+                    sort_keys=True) + '\n')
+    finally:
+        out.close()
+        conn.close()
+    log.info('Backed up %s as JSON lines' % session.bind.url.database)
+
+def parse_value(column, value):
+    """ Convert a JSON value back to the type of column
+    """
+    if value is None:
+        return None
+    if isinstance(column.type, sa.DateTime):
+        return changes.parse_watermark(value)
+    return value
+
+def backup(session, filename, pages=PAGES):
+    """ Write a compressed backup of the database of session to filename
+    """
+    if session.bind.dialect.name == 'sqlite':
+        backup_sqlite(session, filename, pages)
+    else:
+        backup_rows(session, filename)
+
+def is_sqlite_backup(filename):
+    """ True if filename is a compressed SQLite database, rather than rows
+    """
+    stream = gzip.open(filename, 'rb')
+    try:
+        return stream.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    finally:
+        stream.close()
+
+def decompress(filename, directory=None):
+    """ Return the path of a checked, decompressed copy of a SQLite backup
+    """
+    handle, path = tempfile.mkstemp(prefix='skillsdb_restore_', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            stream = gzip.open(filename, 'rb')
+            try:
+                shutil.copyfileobj(stream, out, CHUNK)
+            finally:
+                stream.close()
+        conn = sqlite3.connect(path)
+        try:
+            check = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+        if check != 'ok':
+            raise BackupError, "%s is not a sound database: %s" % (filename, check)
+    except:
+        os.remove(path)
+        raise
+    return path
+
+def restore_memory(session, filename):
+    """ Replace the rows of an in memory database with those of a SQLite
+        backup, attached to its connection. Returns the number of rows
+    """
+    path = decompress(filename)
+    conn = session.connection()
+    try:
+        models.foreign_keys(conn, False)
+        conn.execute('ATTACH DATABASE ? AS backup', (path,))
+        try:
+            tables = set(row[0] for row in conn.execute(
+                "SELECT name FROM backup.sqlite_master WHERE type = 'table'"))
+            count = 0
+            for table in reversed(models.metadata.sorted_tables):
+                conn.execute(table.delete())
+            for table in models.metadata.sorted_tables:
+                if table.name not in tables:
+                    continue
+                # Backups of earlier versions lack newer columns
+                stored = set(row[1] for row in conn.execute(
+                    'PRAGMA backup.table_info(%s)' % table.name))
+                columns = ', '.join(c.name for c in table.columns if c.name in stored)
+                count += conn.execute('INSERT INTO main.%s (%s) SELECT %s FROM backup.%s' % (
+                    table.name, columns, columns, table.name)).rowcount
+            session.commit()
+        finally:
+            session.connection().execute('DETACH DATABASE backup')
+    finally:
+        os.remove(path)
+    log.info('Restored %s rows from %s' % (count, filename))
+    return count
+
+def restore_sqlite(session, filename):
+    """ Replace the SQLite database of session with a compressed copy
+        No other process may be using the database
+    """
+    if models.is_memory(session.bind):
+        return restore_memory(session, filename)
+    database = session.bind.url.database
+    session.close()
+    models.dispose()
+    path = decompress(filename, os.path.dirname(os.path.abspath(database)))
+    try:
+        # The log and index of the replaced database belong to its old pages
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+        os.rename(path, database)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    log.info('Restored %s from %s' % (database, filename))
+
+def restore_rows(session, filename, batch_size=BATCH_SIZE):
+    """ Replace the rows of every table with those of a JSON lines backup
+        Returns the number of rows restored
+    """
+    conn = session.connection()
+    # Partners may refer to parents restored after them, and deleting rows
+    # checked against unindexed foreign keys is slow
+    models.foreign_keys(conn, False)
+    for table in reversed(models.metadata.sorted_tables):
+        conn.execute(table.delete())
+
+    tables = dict((table.name, table) for table in models.metadata.sorted_tables)
+    batches = {}
+    count = 0
+
+    def flush(name):
+        table = tables[name]
+        conn.execute(table.insert(), [dict((key, parse_value(table.c[key], value))
+                                           for key, value in row.iteritems())
+                                      for row in batches.pop(name)])
+
+    stream = gzip.open(filename, 'rb')
+    try:
+        for line in stream:
+            record = json.loads(line)
+            if record['table'] not in tables:
+                raise BackupError, "%s is not a table of this version" % record['table']
+            batches.setdefault(record['table'], []).append(record['row'])
+            count += 1
+            if len(batches[record['table']]) >= batch_size:
+                flush(record['table'])
+    finally:
+        stream.close()
+    for table in models.metadata.sorted_tables:
+        if table.name in batches:
+            flush(table.name)
+    models.foreign_keys(conn, True)
+    session.commit()
+    log.info('Restored %s rows from %s' % (count, filename))
+    return count
+
+def restore(session, filename):
+    """ Replace the database of session with a backup
+    """
+    if not os.path.exists(filename):
+        raise BackupError, "%s backup file not found" % filename
+    if is_sqlite_backup(filename):
+        if session.bind.dialect.name != 'sqlite':
+            raise BackupError, "%s is a SQLite backup, restore it to a SQLite database" % filename
+        restore_sqlite(session, filename)
+    else:
+        restore_rows(session, filename)
+
+def main(args):
+    """
+Write a compressed backup of a database in use, or restore one.
+
+  SQLite databases are copied page by page to a new database file, so the
+  backup is consistent even while other commands write.  MySQL databases are
+  written as JSON lines read in one consistent snapshot.  Add --rows to write
+  JSON lines from SQLite too, for restoring to another type of database.
+
+  --restore replaces the database with the backup.  Stop other commands using
+  the database first.
+
+  skillsdb backup skillsdb-2014-03-29.gz
+  skillsdb backup --tenant st_marys st_marys.gz
+  skillsdb backup --restore skillsdb-2014-03-29.gz
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    session = session_config.get_session()
+    try:
+        if args.restore:
+            restore(session, args.filename)
+        elif args.rows:
+            backup_rows(session, args.filename)
+        else:
+            backup(session, args.filename, args.pages)
+    finally:
+        session.close()
+    return 0
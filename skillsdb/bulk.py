@@ -0,0 +1,186 @@
+"""
+Bulk changes
+============
+Update or delete records matching a search with set-based statements.
+
+Updates are a single UPDATE ... WHERE. When the columns changed decide
+statistic counts or households, the stored values of matching records
+are read first, so they can be adjusted.
+
+Records owned by a deleted parent (skills, freetimes and address) are
+deleted with it, and links to deleted records are removed. The database
+does this itself through ON DELETE CASCADE foreign keys, but databases
+created by earlier versions lack them, so dependent rows are deleted
+explicitly too.
+
+Bulk changes are Core statements, so flush events do not see them.
+Statistic counts, households and tombstones are written here instead.
+Skill counts are recounted for the skill names whose links change, and
+addresses whose postcodes change are located again.
+"""
+import collections
+
+import sqlalchemy as sa
+
+import models
+import stats
+import changes
+import formats
+import household
+import geo
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Records deleted with the parent that owns them
+OWNED = [models.Skill, models.Freetime, models.Address]
+# Association tables and the column referring to each class
+LINKS = {models.Parent:[(models.parent_skill, 'parent_id'),
+                        (models.parent_freetime, 'parent_id'),
+                        (models.parent_child, 'parent_id')],
+         models.Skill:[(models.parent_skill, 'skill_id')],
+         models.Freetime:[(models.parent_freetime, 'freetime_id')],
+         models.Child:[(models.parent_child, 'child_id')],
+         models.Address:[]}
+
+class BulkError(Exception):pass
+
+def count(session, table, criterion):
+    """ Return the number of records of table matching criterion
+    """
+    return session.query(sa.func.count(table.id)).filter(criterion).scalar()
+
+def matching_ids(conn, table, criterion):
+    """ Return IDs of records of table matching criterion
+    """
+    return [row[0] for row in conn.execute(
+        sa.select([table.__table__.c.id]).where(criterion))]
+
+def count_deleted(conn, table, column, ids, deltas):
+    """ Take records of table whose column is in ids from statistic deltas
+    """
+    keys = stats.COUNTED.get(table)
+    if keys is None:
+        return
+    t = table.__table__
+    for chunk in household.chunks(ids):
+        for row in conn.execute(sa.select([t.c.id] + [t.c[key] for key in keys]).where(
+                t.c[column].in_(chunk))):
+            deltas[stats.statistic_key(table, dict(zip(keys, row[1:])))] -= 1
+
+def delete_links(conn, table, ids):
+    """ Delete association rows referring to records of table
+    """
+    for link, column in LINKS[table]:
+        conn.execute(link.delete().where(link.c[column].in_(ids)))
+
+def delete(session, table, criterion):
+    """ Delete records of mapped class table matching criterion, in the
+        session's transaction. Returns the number of records deleted
+    """
+    conn = session.connection()
+    t = table.__table__
+    ids = matching_ids(conn, table, criterion)
+    if not ids:
+        return 0
+
+    # Households change for everyone connected to deleted parents and children
+    parent_ids, child_ids = set(), set()
+    pc = models.parent_child
+    for chunk in household.chunks(ids):
+        if table == models.Parent:
+            parent_ids.update(household.neighbours(conn, chunk))
+            child_ids.update(row[0] for row in conn.execute(
+                sa.select([pc.c.child_id]).where(pc.c.parent_id.in_(chunk))))
+        elif table == models.Child:
+            parent_ids.update(row[0] for row in conn.execute(
+                sa.select([pc.c.parent_id]).where(pc.c.child_id.in_(chunk))))
+
+    skill_keys = set()
+    if table == models.Parent:
+        skill_keys = stats.skill_keys(conn, parent_ids=ids)
+    elif table == models.Skill:
+        skill_keys = stats.skill_keys(conn, skill_ids=ids)
+
+    deltas = collections.Counter()
+    count_deleted(conn, table, 'id', ids, deltas)
+    if table == models.Parent:
+        for owned in OWNED:
+            count_deleted(conn, owned, 'parent_id', ids, deltas)
+
+    for chunk in household.chunks(ids):
+        if table == models.Parent:
+            for owned in OWNED:
+                o = owned.__table__
+                owned_ids = [row[0] for row in conn.execute(
+                    sa.select([o.c.id]).where(o.c.parent_id.in_(chunk)))]
+                if owned_ids:
+                    delete_links(conn, owned, owned_ids)
+                    conn.execute(o.delete().where(o.c.id.in_(owned_ids)))
+                    changes.record_deletes(conn, owned, owned_ids)
+            for kept in [models.Parent, models.Child]:
+                k = kept.__table__
+                conn.execute(k.update().where(k.c.parent_id.in_(chunk)).values(parent_id=None))
+        delete_links(conn, table, chunk)
+        conn.execute(t.delete().where(t.c.id.in_(chunk)))
+        changes.record_deletes(conn, table, chunk)
+
+    stats.adjust(conn, deltas)
+    if skill_keys:
+        stats.recount_skills(conn, skill_keys)
+    if parent_ids or child_ids:
+        household.relabel(conn, parent_ids - set(ids), child_ids)
+    log.info('Deleted %s %s records' % (len(ids), table.classname))
+    return len(ids)
+
+def update(session, table, criterion, values):
+    """ Set column values of records of mapped class table matching
+        criterion, in the session's transaction. Returns the number of
+        records updated
+    """
+    columns = formats.columns(table)
+    for key in values:
+        if key not in columns or key in ['id', 'created', 'updated', 'name_key']:
+            raise BulkError, "%s is not a column of table %s that can be set" % (
+                key, table.classname)
+        if key == 'parent_id' and table != models.Parent:
+            raise BulkError, "Parents of %s records can not be changed by a bulk update" % (
+                table.classname)
+    if not values:
+        raise BulkError, "No values to set"
+
+    conn = session.connection()
+    t = table.__table__
+    keys = [key for key in stats.COUNTED.get(table, []) if key in values]
+    relink = table == models.Parent and 'parent_id' in values
+    skill_keys = set()
+    if table == models.Skill and 'name' in values:
+        skill_keys = stats.skill_keys(conn, skill_ids=matching_ids(conn, table, criterion))
+        skill_keys.add(stats.skill_key(values['name']))
+        values = dict(values, **table.derived(values))
+    located = []
+    if table == models.Address and 'postcode' in values:
+        located = matching_ids(conn, table, criterion)
+    previous = {}
+    if keys or relink:
+        # Statistics depend on every key column, not only those being set
+        read = stats.COUNTED[table] + (['parent_id'] if relink else [])
+        for row in conn.execute(sa.select([t.c.id] + [t.c[key] for key in read]).where(
+                criterion)):
+            previous[row[0]] = dict(zip(read, row[1:]))
+
+    result = conn.execute(t.update().where(criterion).values(values))
+    if keys:
+        stats.adjust(conn, stats.row_deltas(table, dict(previous), [
+            dict(values, id=id) for id in previous]))
+    if skill_keys:
+        stats.recount_skills(conn, skill_keys)
+    if located:
+        geo.geocode(conn, located)
+    if relink:
+        ids = set(previous) | set(row['parent_id'] for row in previous.itervalues())
+        ids.add(values['parent_id'])
+        ids.discard(None)
+        household.relabel(conn, ids)
+    log.info('Updated %s %s records' % (result.rowcount, table.classname))
+    return result.rowcount
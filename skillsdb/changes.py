@@ -0,0 +1,172 @@
+"""
+Change feed
+===========
+Stream records changed since a watermark, for incremental sync of
+downstream systems.
+
+Every record carries created and updated times, set as it is written.
+Deleted records leave a tombstone, written by the session on flush and
+by the bulk delete and merge commands, which do not flush.
+
+Changes are read from the indexed updated columns and merged into one
+stream in time order. The last line of the feed holds the watermark to
+pass as --since next time.
+
+Times are the local wall clock time of the machine writing the record,
+taken when the session flushes, before the transaction has the database
+lock. A writer waiting for the lock, or retrying, can commit a change
+stamped earlier than changes already read. So the watermark is held
+back OVERLAP behind the time the feed is read, and changes of that
+window are sent again: consumers should apply changes as upserts. When
+the clocks go back an hour, changes of the repeated hour carry times
+before the watermark; pass a --since an hour earlier once after the
+change, or run every writer with TZ=UTC.
+"""
+import heapq
+import datetime
+
+import sqlalchemy as sa
+
+import utils
+import models
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Tables of the change feed
+TRACKED = [models.Parent, models.Child, models.Skill, models.Freetime, models.Address]
+KEYS = ['changed', 'op', 'table', 'id', 'record']
+FEED_FORMATS = ['jsonl', 'json']
+WATERMARK_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+# Longest a change may commit after the time it is stamped with: the lock
+# wait (busy_timeout) and write retries, with a margin
+OVERLAP = datetime.timedelta(seconds=60)
+
+class ChangesError(Exception):pass
+
+def parse_watermark(text):
+    """ Return the datetime of an ISO format watermark
+    """
+    for fmt in WATERMARK_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ChangesError, "%s is not a valid watermark. Use YYYY-MM-DDTHH:MM:SS" % text
+
+def record_deletes(conn, table, ids):
+    """ Write tombstones of deleted records of mapped class table
+    """
+    if table not in TRACKED:
+        return
+    rows = [{'tablename':table.classname, 'record_id':id} for id in ids]
+    if rows:
+        conn.execute(models.Tombstone.__table__.insert(), rows)
+
+def tombstone_deletes(session, flush_context):
+    """ Write tombstones of records deleted by a flush
+    """
+    deleted = {}
+    for obj in session.deleted:
+        if type(obj) in TRACKED:
+            deleted.setdefault(type(obj), []).append(sa.inspect(obj).identity[0])
+    for table, ids in deleted.iteritems():
+        record_deletes(session.connection(), table, ids)
+
+sa.event.listen(sa.orm.Session, 'after_flush', tombstone_deletes)
+
+def updates(session, table, since=None):
+    """ Yield (updated, 'upsert', table name, id, record) of records of
+        table updated at or after since, oldest first
+    """
+    t = table.__table__
+    keys = formats.columns(table)
+    query = sa.select([t.c[key] for key in keys]).where(t.c.updated != None)
+    if since:
+        query = query.where(t.c.updated >= since)
+    for row in session.execute(query.order_by(t.c.updated, t.c.id)):
+        record = dict((key, formats.fmt_value(value)) for key, value in zip(keys, row))
+        yield row[t.c.updated], 'upsert', table.classname, row[t.c.id], record
+
+def deletes(session, since=None, tables=None):
+    """ Yield (deleted, 'delete', table name, id, None) of tombstones
+        written at or after since, oldest first
+    """
+    t = models.Tombstone.__table__
+    query = sa.select([t.c.updated, t.c.tablename, t.c.record_id]).where(t.c.updated != None)
+    if tables:
+        query = query.where(t.c.tablename.in_([table.classname for table in tables]))
+    if since:
+        query = query.where(t.c.updated >= since)
+    for updated, tablename, record_id in session.execute(query.order_by(t.c.updated, t.c.id)):
+        yield updated, 'delete', tablename, record_id, None
+
+def feed(session, since=None, tables=None):
+    """ Yield changes of every tracked table, oldest first
+    """
+    streams = [updates(session, table, since) for table in tables or TRACKED]
+    streams.append(deletes(session, since, tables))
+    return heapq.merge(*streams)
+
+def watermark(since, newest, now):
+    """ Return the watermark of a feed read at now: its newest change, or
+        since if none, held back to OVERLAP before now
+    """
+    last = newest or since
+    if last is None:
+        return None
+    return min(last, now - OVERLAP)
+
+def prune(session, before):
+    """ Delete tombstones written before a watermark consumers have passed
+    """
+    t = models.Tombstone.__table__
+    count = session.execute(t.delete().where(t.c.updated < before)).rowcount
+    session.commit()
+    return count
+
+def main(args):
+    """
+Stream records changed since a watermark, oldest first.
+
+  Each line gives the time of the change, the operation (upsert or delete),
+  the table and record ID, and for upserts the record.  The final line is a
+  watermark; pass it to --since to receive only later changes.  Times are the
+  local time of the machine writing each change.  The watermark is held back a
+  minute, as changes waiting for the database lock may commit with earlier
+  times, so recent changes are sent again: apply changes as upserts.  After the
+  clocks go back, pass a --since an hour earlier once.
+
+  Without --since every record is sent.  Deleted records are kept as tombstones
+  until --prune removes those written before a watermark.
+
+  skillsdb changes > full.jsonl
+  skillsdb changes --since 2014-03-29T09:44:19.271803
+  skillsdb changes --since 2014-03-29 --parent
+  skillsdb changes --prune 2014-03-01
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.prune:
+        session = session_config.get_session()
+        count = prune(session, parse_watermark(args.prune))
+        session.close()
+        log.info('Pruned %s tombstones' % count)
+        return 0
+
+    since = parse_watermark(args.since) if args.since else None
+    tables = [table for table in TRACKED if getattr(args, table.classname)]
+
+    newest = None
+    now = datetime.datetime.now()
+    session = session_config.get_session(readonly=True)
+    writer = formats.RecordWriter(args.format, KEYS)
+    for change in feed(session, since, tables):
+        newest = change[0]
+        writer.write(zip(KEYS, change))
+    session.close()
+    mark = watermark(since, newest, now)
+    writer.write([('changed', mark), ('op', 'watermark')])
+    writer.close()
+    log.info('%s changes, watermark %s' % (writer.count - 1, formats.fmt_value(mark)))
+    return 0
@@ -9,14 +9,20 @@ import base64
 import logutils
 import models
 
-from sqlalchemy.orm.exc import NoResultFound
 
-KNOWN_DBTYPES = ['sqlite', 'mysql']
+KNOWN_DBTYPES = ['sqlite', 'mysql', 'memory']
 FNAME = 'config.cfg'
 
 DEFAULTS = {'filename':FNAME, 'dbtype':'sqlite', 'force':'',
             'user':'skills', 'passwd':'skills',
-            'host':'', 'dbname':'skillsdb.sqlite'}
+            'host':'', 'read_host':'', 'dbname':'skillsdb.sqlite', 'tenants':'',
+            'journal_mode':'wal', 'synchronous':'normal', 'cache_size':'-16000',
+            'mmap_size':'268435456', 'busy_timeout':'5000', 'temp_store':'memory',
+            'write_retries':'5', 'write_backoff':'0.05'}
+
+# SQLite connection pragmas, applied to every new connection (blank to leave as default)
+SQLITE_KEYS = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+               'busy_timeout', 'temp_store']
 
 log = logutils.setup_log(__name__)
 class ConfigException(Exception):
@@ -36,11 +42,49 @@ class ConfigOptions(object):
                            help='database passwd (skills)', default=DEFAULTS['passwd'])
         group.add_argument('--host', '-o', type=str,
                            help='database host (blank for local)', default=DEFAULTS['host'])
+        group.add_argument('--read-host', dest='read_host', type=str,
+                           help='read replica host for searches (blank for --host)',
+                           default=DEFAULTS['read_host'])
         group.add_argument('--dbtype', '-d', type=str,
-                           help='database type (sqlite)', default=DEFAULTS['dbtype'])
+                           help='database type, sqlite, mysql or memory (sqlite)', default=DEFAULTS['dbtype'])
         group.add_argument('--dbname', '-n', type=str,
                            help='database name (blank)', default=DEFAULTS['dbname'])
-        
+        group.add_argument('--tenants', type=str,
+                           help='comma separated tenants allowed (blank for any)',
+                           default=DEFAULTS['tenants'])
+
+        group = parser.add_argument_group('optional sqlite arguments',
+                                          'Connection pragmas, blank leaves the SQLite default')
+        group.add_argument('--journal-mode', dest='journal_mode', type=str,
+                           help='journal mode (wal)', default=DEFAULTS['journal_mode'])
+        group.add_argument('--synchronous', type=str,
+                           help='sync on commit (normal)', default=DEFAULTS['synchronous'])
+        group.add_argument('--cache-size', dest='cache_size', type=str,
+                           help='page cache, pages or -KiB (-16000)', default=DEFAULTS['cache_size'])
+        group.add_argument('--mmap-size', dest='mmap_size', type=str,
+                           help='memory mapped I/O bytes (268435456)', default=DEFAULTS['mmap_size'])
+        group.add_argument('--busy-timeout', dest='busy_timeout', type=str,
+                           help='lock wait in ms (5000)', default=DEFAULTS['busy_timeout'])
+        group.add_argument('--temp-store', dest='temp_store', type=str,
+                           help='temporary tables (memory)', default=DEFAULTS['temp_store'])
+
+        group = parser.add_argument_group('optional write arguments',
+                                          'Transactions finding the database busy are retried')
+        group.add_argument('--write-retries', dest='write_retries', type=str,
+                           help='retries of a busy transaction (5)',
+                           default=DEFAULTS['write_retries'])
+        group.add_argument('--write-backoff', dest='write_backoff', type=str,
+                           help='seconds before the first retry, doubling (0.05)',
+                           default=DEFAULTS['write_backoff'])
+
+class TenantOptions(object):
+    """Each tenant (school) has its own database, named after the
+    configured database: skillsdb.sqlite -> skillsdb_<tenant>.sqlite"""
+    @classmethod
+    def customize_parser(cls, parser):
+        parser.add_argument('--tenant', '-t', type=str, default=None,
+                            help='tenant (school) to work on (blank for the default database)')
+
 class Config(object):
     """ Configure program session
         Load config from filename or from CLI.
@@ -55,6 +99,7 @@ class Config(object):
         args.dname, args.bname = get_file_paths(args.filename)
         args.filename = os.path.join(args.dname, args.bname)
         self.args = args
+        self.tenant = getattr(args, 'tenant', None)
         self.settings = {}
         self.validate_args()
 
@@ -75,16 +120,16 @@ class Config(object):
             log.info("Attempt to update database credentials")
             return
             
-        session = self.get_session()
+        self.validate_tenant()
+
+        # Credentials are held by the default database for all tenants
+        session = self.get_session(tenant='')
         log.info("Database session to <%s> established" % self['dbname'])
 
         # Simple database authentication (simply check current user / passwd hash
         # against stored credentials)
-        try:
-            params = session.query(models.Params).one()
-        except NoResultFound:
-            params =None
-            
+        params = models.Params.load(session)
+
         if not params:
             param = models.Params(user=self.user, passwd=self.passwd_hash)
             session.add(param)
@@ -126,10 +171,22 @@ class Config(object):
             return self.settings.get(key, None)
         raise ConfigException, "% is not a known parameter key" % key
         
-    def get_session(self):
+    def get_session(self, readonly=False, tenant=None):
         """ Return a database session according to config values
+
+            Read only sessions are for searches and exports. They connect to
+            the read replica host if one is configured (mysql), or open
+            query only connections that never take the write lock (sqlite)
+
+            Sessions are routed to the selected tenant's database, unless
+            another tenant is given ('' for the default database)
         """
-        return models.init(uri=self['dbname'], host=self['host'], user=self.user, passwd=self.passwd_hash, dbtype=self['dbtype'], path=self.args.dname)
+        if tenant is None:
+            tenant = self.tenant
+        host = self['host']
+        if readonly and self['read_host']:
+            host = self['read_host']
+        return models.init(uri=self['dbname'], host=host, user=self.user, passwd=self.passwd_hash, dbtype=self['dbtype'], path=self.args.dname, pragmas=self.pragmas, readonly=readonly, tenant=tenant)
 
     def load_config(self):
         """ Initialise database from config file.
@@ -140,7 +197,8 @@ class Config(object):
             local_defaults = self.create_default_config()
             self.save_config(local_defaults)
             
-        local_defaults = DEFAULTS
+        # A copy, so each Config keeps its own settings
+        local_defaults = dict(DEFAULTS)
         with open(self.args.filename, 'r') as fh:
             for line in fh:
                 src = '<%s> file' % self.args.bname
@@ -218,6 +276,24 @@ class Config(object):
                 self.args.dbtype, ', '.join(KNOWN_DBTYPES)
                 )
             
+    def validate_tenant(self):
+        """ Ensure the selected tenant is a valid name and is allowed
+        """
+        if not self.tenant:
+            return
+        if not models.TENANT_NAME.match(self.tenant):
+            raise ConfigException, "%s is not a valid tenant name. Use letters, digits and _" % (
+                self.tenant)
+        if self.tenants and self.tenant not in self.tenants:
+            raise ConfigException, "%s is not a configured tenant. Choose from %s" % (
+                self.tenant, ', '.join(self.tenants))
+
+    @property
+    def tenants(self):
+        """ Return the list of allowed tenants, empty if any are allowed
+        """
+        return [t.strip() for t in (self['tenants'] or '').split(',') if t.strip()]
+
     def parse_arg(self, key):
         """ Accessor to return argparse arg via dictionary keyword
         """
@@ -253,6 +329,24 @@ class Config(object):
         """
         return base64.decodestring(self['passwd'])
 
+    @property
+    def pragmas(self):
+        """ Return SQLite connection pragmas that have been set
+        """
+        return dict((key, self[key]) for key in SQLITE_KEYS if self[key])
+
+    @property
+    def write_retries(self):
+        """ Return the retries of a transaction finding the database busy
+        """
+        return int(self['write_retries'] or 0)
+
+    @property
+    def write_backoff(self):
+        """ Return the seconds to wait before the first retry
+        """
+        return float(self['write_backoff'] or 0)
+
     @property
     def user(self):
         """ Return current user
@@ -289,12 +383,16 @@ def setuser(args):
     args.host = None
     args.user = None
     args.dbname = None
+    args.read_host = None
+    args.tenants = None
+    for key in SQLITE_KEYS:
+        setattr(args, key, None)
     config = Config(args, True)
 
     if args.update_user:
         if config['user'] == args.oldvalue:
             session = config.get_session()
-            params = session.query(models.Params).one()
+            params = models.Params.load(session)
             params.user = args.newvalue
             session.commit()
             session.close()
@@ -312,7 +410,7 @@ def setuser(args):
 
         if existing_pass == old_pass:
             session = config.get_session()
-            params = session.query(models.Params).one()
+            params = models.Params.load(session)
             params.passwd = new_pass
             session.commit()
             session.close()
@@ -337,8 +435,15 @@ def main(args):
   Action choices:   
   Load program settings from a configuration file ... fileaname
   Save program settings to a configiration file ... filename
+
+  A tenant (school) database is created when first selected with --tenant (on
+  MySQL, the database user needs the CREATE privilege).
+  Restrict tenants to a known list with --tenants school_a,school_b
     """
-    Config(args)
+    config = Config(args)
+    if config.tenant:
+        config.get_session().close()
+        log.info('Tenant <%s> database ready' % config.tenant)
     
 
         
@@ -0,0 +1,267 @@
+"""
+Write coordination
+==================
+Staff entering records at once share one SQLite file, and SQLite lets
+one connection write at a time. A writer waits up to busy_timeout (ms)
+for the lock, but a transaction that read before it wrote can not wait:
+once another writer commits its snapshot is stale, and SQLite fails it
+at once with "database is locked".
+
+transaction() runs a unit of work and commits. While the database is
+busy it rolls back and runs the work again, waiting write_backoff
+seconds, doubled for each retry and jittered, up to write_retries times.
+
+For heavy concurrent entry, skillsdb writer runs a single writer process
+for the databases of a config file. manage --queue submits its command
+to the writer, through a socket beside the config file, and prints its
+output, so writes queue instead of contending for the lock. Commands run
+directly when no writer is running.
+
+Only the command line is sent. The writer parses it again and runs only
+manage commands, against its own config file. The socket, and a random
+key written beside it that clients must prove they hold, can be opened
+only by the user running the writer.
+"""
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import StringIO
+import binascii
+from multiprocessing import connection
+
+import sqlalchemy as sa
+
+import utils
+import logutils
+
+log = logutils.setup_log(__name__)
+
+RETRIES = 5
+# Seconds before the first retry, and the most between any two
+BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+# MySQL lock wait timeout and deadlock errors
+MYSQL_BUSY = [1205, 1213]
+SOCKET = 'skillsdb_writer.sock'
+KEY = 'skillsdb_writer.key'
+KEY_BYTES = 32
+
+class WriterError(Exception):pass
+
+def is_busy(error):
+    """ True if a database error is a lock held by another writer
+    """
+    orig = getattr(error, 'orig', error)
+    args = getattr(orig, 'args', ())
+    if args and args[0] in MYSQL_BUSY:
+        return True
+    message = str(orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def backoff(attempt, base=BACKOFF):
+    """ Seconds to wait before retry attempt 1, 2, ...
+    """
+    return min(MAX_BACKOFF, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+def transaction(session, work, retries=RETRIES, base=BACKOFF):
+    """ Run work(session) and commit, running the whole transaction again
+        while the database is busy. Returns the result of work
+    """
+    attempt = 0
+    while True:
+        try:
+            result = work(session)
+            session.commit()
+            return result
+        except sa.exc.OperationalError, e:
+            exc_info = sys.exc_info()
+            session.rollback()
+            if not is_busy(e) or attempt >= retries:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            attempt += 1
+            wait = backoff(attempt, base)
+            log.warning('Database busy, retry %s of %s in %.2fs' % (attempt, retries, wait))
+            time.sleep(wait)
+
+def address(config_file, name=SOCKET):
+    """ Return the socket, or key file, of the writer of a config file's
+        databases
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(config_file)), name)
+
+def write_key(path):
+    """ Write a new random key to path, readable only by this user.
+        Returns the key
+    """
+    key = binascii.hexlify(os.urandom(KEY_BYTES))
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+def read_key(path):
+    """ Return the key of a running writer, or None if it can not be read
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+def parse(argv, config_file):
+    """ Return the parsed arguments of a manage command line, run against
+        config_file
+    """
+    # manage imports this module
+    import manage
+    import views
+    try:
+        args = manage.parser.parse_args(argv)
+    except SystemExit:
+        raise WriterError, "Invalid command: %s" % ' '.join(argv)
+    if args.func is not views.main:
+        raise WriterError, "Only manage commands may be queued"
+    args.config = config_file
+    args.queue = False
+    return args
+
+def run(args):
+    """ Run a command, its parsed arguments, capturing its output.
+        Returns (exit status, output, error message)
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    status, error = 0, None
+    try:
+        status = args.func(args)
+    except SystemExit, e:
+        status = e.code if isinstance(e.code, int) else 0
+    except Exception, e:
+        log.exception('Queued command failed')
+        status, error = 1, '%s: %s' % (e.__class__.__name__, e)
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return status, output, error
+
+def receive(command, config_file):
+    """ Run a command sent by a client, {'argv':[...], 'config':path},
+        if it is a manage command of config_file
+    """
+    try:
+        argv, config = command['argv'], command['config']
+        if config != os.path.abspath(config_file):
+            raise WriterError, "The writer runs commands of %s only, not %s" % (
+                config_file, config)
+        args = parse(list(argv), os.path.abspath(config_file))
+    except (WriterError, KeyError, TypeError), e:
+        log.warning('Rejected a command: %s' % e)
+        return 1, '', 'WriterError: %s' % e
+    log.info('Running %s' % ' '.join(argv))
+    return run(args)
+
+def serve(config_file, count=None):
+    """ Run commands submitted for the databases of config_file one at a
+        time, until interrupted or count commands have run
+    """
+    path = address(config_file)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except socket.error:
+            # Left by a writer that stopped
+            os.remove(path)
+        else:
+            raise WriterError, "A writer is already running on %s" % path
+        finally:
+            probe.close()
+
+    key_path = address(config_file, KEY)
+    authkey = write_key(key_path)
+    # The socket is created readable and writable by this user only
+    umask = os.umask(0077)
+    try:
+        listener = connection.Listener(path, 'AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0600)
+    log.info('Writer listening on %s' % path)
+    served = 0
+    try:
+        while count is None or served < count:
+            try:
+                conn = listener.accept()
+            except connection.AuthenticationError, e:
+                log.warning('Rejected a command: %s' % e)
+                continue
+            try:
+                conn.send(receive(conn.recv(), config_file))
+            except EOFError:
+                log.warning('Command connection closed early')
+            finally:
+                conn.close()
+            served += 1
+    finally:
+        listener.close()
+        os.remove(key_path)
+    return served
+
+def submit(argv, config_file):
+    """ Run a manage command line, against config_file, by its writer,
+        printing its output. Returns the exit status, or None if no
+        writer is running
+    """
+    authkey = read_key(address(config_file, KEY))
+    if authkey is None:
+        log.info('No writer running, writing directly')
+        return None
+    command = {'argv':list(argv), 'config':os.path.abspath(config_file)}
+    try:
+        conn = connection.Client(address(config_file), 'AF_UNIX', authkey=authkey)
+    except socket.error, e:
+        log.info('No writer running (%s), writing directly' % e)
+        return None
+    try:
+        conn.send(command)
+        status, output, error = conn.recv()
+    finally:
+        conn.close()
+    sys.stdout.write(output)
+    if error:
+        raise WriterError, error
+    return status
+
+def main(args):
+    """
+Run a single writer for manage commands, one at a time.
+
+  SQLite lets one connection write at a time.  Commands run with manage --queue
+  are sent to this writer, through a socket beside the config file, and run in
+  turn, instead of contending for the database lock.  Only manage commands of
+  the writer's own config file are run, for the user running the writer.  Stop it with Ctrl-C or
+  SIGTERM.  Without a writer, --queue commands run directly.
+
+  Commands that find the database busy are run again after a short wait, up to
+  write_retries times (config), the wait starting at write_backoff seconds and
+  doubling.
+
+  skillsdb writer
+  skillsdb manage --add --queue --parent first_name=Ian second_name=Roberts
+    """
+    # Check the config loads before listening
+    utils.load_config(args.config)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        serve(args.config)
+    except KeyboardInterrupt:
+        log.info('Writer stopped')
+    return 0
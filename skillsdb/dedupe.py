@@ -0,0 +1,309 @@
+"""
+Duplicate detection
+===================
+Find and merge duplicate parent and child records.
+
+People are grouped into blocks that share a cheap key (normalised surname
+and first initial, postcode, email address, or for children a parent).
+Only pairs within a block are scored, so the work grows with the number
+of people rather than with the number of pairs of people.
+"""
+import re
+import difflib
+import collections
+
+import sqlalchemy as sa
+
+import utils
+import models
+import formats
+import household
+import stats
+import bulk
+import changes
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Blocks larger than this are too common a key to be useful
+MAX_BLOCK = 500
+# Score weights of matching evidence
+WEIGHTS = {'first_name':0.4, 'second_name':0.3, 'postcode':0.15,
+           'email':0.3, 'family':0.15}
+EMAIL_KEYS = ['home_email', 'work_email', 'other_email']
+KEYS = ['score', 'keep', 'drop', 'keep_name', 'drop_name']
+
+class DedupeError(Exception):pass
+
+def normalise(text):
+    """ Lower case letters and digits only
+    """
+    return re.sub(r'[^a-z0-9]', '', (text or '').lower())
+
+def similarity(a, b, cache=None, minimum=0.0):
+    """ Ratio of matching characters of two normalised strings
+        Ratios are remembered in cache, as names repeat
+
+        Returns 0 without comparing the strings when their lengths alone
+        rule out a ratio of at least minimum
+    """
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    if 2.0 * min(len(a), len(b)) / (len(a) + len(b)) < minimum:
+        return 0.0
+    if cache is None:
+        return difflib.SequenceMatcher(None, a, b).ratio()
+    key = (a, b) if a < b else (b, a)
+    if key not in cache:
+        cache[key] = difflib.SequenceMatcher(None, a, b).ratio()
+    return cache[key]
+
+class Person(object):
+    """ Blocking and scoring details of a parent or child
+    """
+    __slots__ = ['id', 'first_name', 'second_name', 'name', 'partner_id',
+                 'postcode', 'emails', 'family']
+
+    def __init__(self, id, first_name, second_name, partner_id=None):
+        self.id = id
+        self.name = '%s %s' % (first_name, second_name)
+        self.first_name = normalise(first_name)
+        self.second_name = normalise(second_name)
+        self.partner_id = partner_id
+        self.postcode = ''
+        self.emails = set()
+        self.family = set()
+
+    def blocking_keys(self):
+        keys = []
+        if self.second_name:
+            keys.append('name:%s:%s' % (self.second_name, self.first_name[:1]))
+        if self.postcode:
+            keys.append('postcode:%s' % self.postcode)
+        keys.extend('email:%s' % email for email in self.emails)
+        keys.extend('family:%s' % member for member in self.family)
+        return keys
+
+def load_people(session, table):
+    """ Return Person details of every parent or child, by record ID
+    """
+    people = {}
+    if table == models.Parent:
+        for id, first_name, second_name, partner_id in session.query(
+                models.Parent.id, models.Parent.first_name, models.Parent.second_name,
+                models.Parent.parent_id):
+            people[id] = Person(id, first_name, second_name, partner_id)
+
+        columns = [getattr(models.Address, key) for key in EMAIL_KEYS]
+        for row in session.query(models.Address.parent_id, models.Address.postcode, *columns):
+            person = people.get(row[0])
+            if person:
+                person.postcode = normalise(row[1])
+                person.emails.update(e.strip().lower() for e in row[2:] if e and e.strip())
+
+        # Parents sharing a child are family, not necessarily duplicates
+        for parent_id, child_id in session.query(models.parent_child.c.parent_id,
+                                                 models.parent_child.c.child_id):
+            if parent_id in people:
+                people[parent_id].family.add(child_id)
+    else:
+        for id, first_name, second_name in session.query(
+                models.Child.id, models.Child.first_name, models.Child.second_name):
+            people[id] = Person(id, first_name, second_name)
+        for parent_id, child_id in session.query(models.parent_child.c.parent_id,
+                                                 models.parent_child.c.child_id):
+            if child_id in people:
+                people[child_id].family.add(parent_id)
+    return people
+
+def score(a, b, threshold=0.0, cache=None):
+    """ Return a score of 0 to 1 that a and b are the same person
+        Returns 0 early once the score can not reach threshold
+    """
+    total = 0.0
+    if a.postcode and a.postcode == b.postcode:
+        total += WEIGHTS['postcode']
+    if a.emails & b.emails:
+        total += WEIGHTS['email']
+    if a.family & b.family:
+        total += WEIGHTS['family']
+    if total + WEIGHTS['first_name'] + WEIGHTS['second_name'] < threshold:
+        return 0.0
+    minimum = (threshold - total - WEIGHTS['first_name']) / WEIGHTS['second_name']
+    total += WEIGHTS['second_name'] * similarity(a.second_name, b.second_name, cache, minimum)
+    if total + WEIGHTS['first_name'] < threshold:
+        return 0.0
+    minimum = (threshold - total) / WEIGHTS['first_name']
+    total += WEIGHTS['first_name'] * similarity(a.first_name, b.first_name, cache, minimum)
+    return min(total, 1.0)
+
+def candidates(people, threshold=0.7, max_block=MAX_BLOCK):
+    """ Yield (score, keep, drop) likely duplicate pairs, best first
+        The lowest record ID of each pair is kept
+    """
+    blocks = collections.defaultdict(list)
+    for person in people.itervalues():
+        for key in person.blocking_keys():
+            blocks[key].append(person)
+
+    seen = set()
+    pairs = []
+    cache = {}
+    for key, block in blocks.iteritems():
+        if len(block) > max_block:
+            log.warning('Skipped block %s of %s people' % (key, len(block)))
+            continue
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                pair = (min(a.id, b.id), max(a.id, b.id))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                # Partners share a surname, address and children
+                if a.partner_id == b.id or b.partner_id == a.id:
+                    continue
+                value = score(a, b, threshold, cache)
+                if value >= threshold:
+                    pairs.append((round(value, 3), pair[0], pair[1]))
+
+    pairs.sort(key=lambda p: (-p[0], p[1], p[2]))
+    return pairs
+
+def move_links(session, table, column, keep, drop, other):
+    """ Point association rows of drop at keep, dropping any keep already has
+    """
+    existing = [row[0] for row in session.execute(
+        sa.select([table.c[other]]).where(table.c[column] == keep))]
+    if existing:
+        session.execute(table.delete().where(sa.and_(
+            table.c[column] == drop, table.c[other].in_(existing))))
+    session.execute(table.update().where(table.c[column] == drop).values({column:keep}))
+
+def merge_parents(session, keep, drop):
+    """ Merge parent drop into keep, moving skills, freetimes, children
+        and address, then delete drop. Statistic counts are adjusted in
+        the same transaction
+    """
+    conn = session.connection()
+    skill_keys = stats.skill_keys(conn, parent_ids=[keep, drop])
+    deltas = collections.Counter()
+    bulk.count_deleted(conn, models.Parent, 'id', [drop], deltas)
+
+    move_links(session, models.parent_skill, 'parent_id', keep, drop, 'skill_id')
+    move_links(session, models.parent_freetime, 'parent_id', keep, drop, 'freetime_id')
+    move_links(session, models.parent_child, 'parent_id', keep, drop, 'child_id')
+
+    # A parent has one address, keep the address of keep if it has one
+    address = models.Address.__table__
+    if session.execute(sa.select([sa.func.count()]).where(
+            address.c.parent_id == keep)).scalar():
+        bulk.count_deleted(conn, models.Address, 'parent_id', [drop], deltas)
+        dropped = [row[0] for row in session.execute(
+            sa.select([address.c.id]).where(address.c.parent_id == drop))]
+        session.execute(address.delete().where(address.c.parent_id == drop))
+        changes.record_deletes(session.connection(), models.Address, dropped)
+
+    parent = models.Parent.__table__
+    kept_partner, dropped_partner = [session.execute(sa.select([parent.c.parent_id]).where(
+        parent.c.id == id)).scalar() for id in (keep, drop)]
+    kept_other = session.execute(sa.select([sa.func.count()]).where(
+        parent.c.parent_id == keep)).scalar()
+    if kept_partner or kept_other:
+        # keep has a partner already, so drop's partners are not given to keep
+        session.execute(parent.update().where(parent.c.parent_id == drop).values(
+            parent_id=None))
+    elif dropped_partner and dropped_partner != keep:
+        session.execute(parent.update().where(parent.c.id == keep).values(
+            parent_id=dropped_partner))
+
+    for table in [models.Skill, models.Freetime, models.Child, models.Address, models.Parent]:
+        t = table.__table__
+        session.execute(t.update().where(t.c.parent_id == drop).values(parent_id=keep))
+    session.execute(parent.update().where(parent.c.id == keep).where(
+        parent.c.parent_id == keep).values(parent_id=None))
+    session.execute(parent.delete().where(parent.c.id == drop))
+    changes.record_deletes(session.connection(), models.Parent, [drop])
+    stats.adjust(conn, deltas)
+    stats.recount_skills(conn, skill_keys)
+
+def merge_children(session, keep, drop):
+    """ Merge child drop into keep, moving parent links, then delete drop
+    """
+    move_links(session, models.parent_child, 'child_id', keep, drop, 'parent_id')
+    child = models.Child.__table__
+    session.execute(child.delete().where(child.c.id == drop))
+    changes.record_deletes(session.connection(), models.Child, [drop])
+
+def merge(session, table, pairs):
+    """ Merge confirmed (keep, drop) pairs in one transaction
+    """
+    ids = set(id for pair in pairs for id in pair)
+    found = set(row[0] for row in session.query(table.id).filter(table.id.in_(ids)))
+    if ids - found:
+        raise DedupeError, "No %s records with IDs %s" % (
+            table.classname, ', '.join(map(str, sorted(ids - found))))
+
+    # Into the record each dropped record is merged with
+    merged = {}
+    for keep, drop in pairs:
+        if keep == drop:
+            raise DedupeError, "Can not merge %s record %s with itself" % (table.classname, keep)
+        if keep in merged:
+            raise DedupeError, "%s record %s is merged into %s first, merge %s into %s" % (
+                table.classname, keep, merged[keep], drop, merged[keep])
+        if drop in merged:
+            raise DedupeError, "%s record %s is merged twice" % (table.classname, drop)
+        merged[drop] = keep
+
+    merge_record = merge_parents if table == models.Parent else merge_children
+    for keep, drop in pairs:
+        merge_record(session, keep, drop)
+        log.info('Merged %s record %s into %s' % (table.classname, drop, keep))
+
+    keeps = [keep for keep, drop in pairs]
+    if table == models.Parent:
+        household.relabel(session.connection(), keeps)
+    else:
+        household.relabel(session.connection(), child_ids=keeps)
+    session.commit()
+
+def main(args):
+    """
+Find and merge duplicate parent or child records.
+
+  Candidate duplicates are found within blocks of people sharing a normalised
+  surname and first initial, postcode, email address or (children) a parent,
+  and are scored on name similarity and shared details.  Pairs scoring at
+  least --threshold are listed, best first, with the record to keep.
+
+  Review candidates, then merge confirmed pairs with --merge KEEP DROP.  Merging
+  moves the skills, freetimes, children and address of DROP to KEEP.
+
+  skillsdb dedupe --parent
+  skillsdb dedupe --child --threshold 0.9 --format csv
+  skillsdb dedupe --parent --merge 12 40 --merge 7 52
+    """
+    if not (args.parent or args.child):
+        raise DedupeError, "Select --parent or --child records to dedupe"
+    table = models.Parent if args.parent else models.Child
+
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.merge:
+        session = session_config.get_session()
+        merge(session, table, [tuple(pair) for pair in args.merge])
+        session.close()
+        return 0
+
+    session = session_config.get_session(readonly=True)
+    people = load_people(session, table)
+    session.close()
+
+    writer = formats.RecordWriter(args.format, KEYS)
+    for value, keep, drop in candidates(people, args.threshold):
+        writer.write(zip(KEYS, [value, keep, drop, people[keep].name, people[drop].name]))
+    writer.close()
+    log.info('%s candidate duplicates among %s %s records' % (
+        writer.count, len(people), table.classname))
+    return 0
@@ -0,0 +1,169 @@
+"""
+Query plans
+===========
+--explain, of manage --search and of match, runs the command's queries
+and prints, instead of its results, each query's SQL with its bound
+parameters and the database's plan of it: EXPLAIN QUERY PLAN on SQLite,
+EXPLAIN on MySQL.
+
+Full scans are flagged when the query filters or joins on columns of the
+scanned table. A column with an index the plan does not use points at
+the search (LIKE '%text%', != and OR of different columns can not use an
+index). A column without one is a candidate for an index, if searches on
+it are common.
+"""
+import re
+
+import sqlalchemy as sa
+
+import models
+import logutils
+
+log = logutils.setup_log(__name__)
+
+INDENT = '    '
+
+class ExplainError(Exception):pass
+
+class Recorder(object):
+    """ Record the SELECT statements, and their parameters, executed
+        through engine while in a with block, if enabled
+    """
+    def __init__(self, engine, enabled=True):
+        self.engine = engine
+        self.enabled = enabled
+        self.statements = []
+
+    def __enter__(self):
+        if self.enabled:
+            sa.event.listen(self.engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            sa.event.remove(self.engine, 'before_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+def plan(conn, statement, parameters):
+    """ Return the rows, as dicts, of the database's plan of statement
+    """
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif conn.dialect.name == 'mysql':
+        prefix = 'EXPLAIN '
+    else:
+        raise ExplainError, "Query plans of %s databases are not supported" % conn.dialect.name
+    # The statement as executed, bypassing the compiler
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        keys = [column[0] for column in cursor.description]
+        return [dict(zip(keys, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def steps(dialect, rows):
+    """ Return lines describing each step of a plan
+    """
+    if dialect == 'sqlite':
+        # Steps are nested under their parent step
+        depth = {0:-1}
+        lines = []
+        for row in rows:
+            depth[row.get('id')] = depth.get(row.get('parent'), -1) + 1
+            lines.append(INDENT * depth[row.get('id')] + row['detail'])
+        return lines
+    return ['%s: %s, key %s of %s, %s rows %s' % (
+        row.get('table'), row.get('type'), row.get('key'), row.get('possible_keys'),
+        row.get('rows'), row.get('Extra') or '') for row in rows]
+
+def aliases(statement):
+    """ Return tables of the statement by the names, or aliases, it
+        gives them
+    """
+    tables = dict(models.metadata.tables)
+    for name, alias in re.findall(r'\b(\w+) AS ["`]?(\w+)', statement):
+        if name in models.metadata.tables:
+            tables[alias] = models.metadata.tables[name]
+    return tables
+
+def scanned(dialect, rows, statement):
+    """ Return [(name in statement, table)] of tables a plan scans in full
+    """
+    tables = aliases(statement)
+    names = []
+    for row in rows:
+        if dialect == 'sqlite':
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', row['detail'])
+            name = match and match.group(1)
+        else:
+            name = row.get('table') if row.get('type') == 'ALL' else None
+        if name in tables and name not in [n for n, table in names]:
+            names.append((name, tables[name]))
+    return names
+
+def indexed(table):
+    """ Return the names of indexes of table, by their leading column
+    """
+    indexes = {}
+    for column in table.primary_key:
+        indexes[column.name] = 'primary key'
+    for constraint in table.constraints:
+        if isinstance(constraint, sa.UniqueConstraint) and constraint.columns:
+            indexes.setdefault(list(constraint.columns)[0].name, constraint.name or 'unique')
+    for index in table.indexes:
+        indexes.setdefault(list(index.columns)[0].name, index.name)
+    return indexes
+
+def referenced(statement, name, table):
+    """ Return the columns of table, named name in statement, that it
+        filters or joins on
+    """
+    # Sorting every row of a table is not a search
+    text = re.split(r'\b(?:ORDER|GROUP) BY\b', statement.split('FROM', 1)[-1])[0]
+    return [column.name for column in table.columns if re.search(
+        r'\b%s\.["`]?%s\b' % (re.escape(name), re.escape(column.name)), text)]
+
+def advise(dialect, rows, statement):
+    """ Return lines of advice on the full scans of a plan
+    """
+    lines = []
+    for name, table in scanned(dialect, rows, statement):
+        indexes = indexed(table)
+        for column in referenced(statement, name, table):
+            if column in indexes:
+                lines.append("Full scan of %s: %s.%s has index %s, which this search can not "
+                             "use" % (table.name, table.name, column, indexes[column]))
+            else:
+                lines.append("Full scan of %s: %s.%s has no index, a candidate if searches "
+                             "on it are common" % (table.name, table.name, column))
+    return lines
+
+def explain(conn, statements):
+    """ Return [(statement, parameters, plan steps, advice)] of
+        statements recorded by a Recorder
+    """
+    dialect = conn.dialect.name
+    explained = []
+    for statement, parameters in statements:
+        rows = plan(conn, statement, parameters)
+        explained.append((statement, parameters, steps(dialect, rows),
+                          advise(dialect, rows, statement)))
+    return explained
+
+def write(conn, statements):
+    """ Print the SQL, parameters, plan and advice of statements
+    """
+    for i, (statement, parameters, lines, advice) in enumerate(explain(conn, statements)):
+        print 'Query %s:' % (i + 1)
+        print INDENT + statement.strip().replace('\n', '\n' + INDENT)
+        print '%sParameters: %r' % (INDENT, parameters)
+        print INDENT + 'Plan:'
+        for line in lines:
+            print INDENT * 2 + line
+        for line in advice:
+            print INDENT + 'Advice: ' + line
+        print
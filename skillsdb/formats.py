@@ -0,0 +1,128 @@
+"""
+Output formats
+==============
+Serialise records for display or for consumption by downstream scripts.
+
+Records are serialised from their mapped column values only, so no
+relationship is ever loaded while writing output.
+"""
+import sys
+import csv
+import json
+import datetime
+
+import sqlalchemy as sa
+
+FORMATS = ['text', 'json', 'jsonl', 'csv', 'table']
+
+class FormatOptions(object):
+    """ Options to select how records are written to standard output
+    """
+    @classmethod
+    def customize_parser(cls, parser):
+        parser.add_argument('--format', '-f', type=str, choices=FORMATS, default='text',
+                            help='output format (text)')
+
+class FormatError(Exception):pass
+
+def columns(table):
+    """ Return the column attribute names of a mapped class,
+        primary key first
+    """
+    mapper = sa.inspect(table)
+    keys = [mapper.get_property_by_column(col).key for col in mapper.primary_key]
+    return keys + [attr.key for attr in mapper.column_attrs if attr.key not in keys]
+
+def record_to_dict(record, keys=None):
+    """ Return an ordered list of (key, value) for a record's column values
+    """
+    if keys is None:
+        keys = columns(type(record))
+    return [(key, getattr(record, key)) for key in keys]
+
+def fmt_value(value):
+    """ Convert a column value to a JSON / CSV friendly scalar
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+def fmt_text(value):
+    """ Convert a column value to a byte string
+    """
+    value = fmt_value(value)
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class RecordWriter(object):
+    """ Write a stream of records in the requested format
+
+        Records are written as they are received, except for table
+        output, which must see every row to size its columns.
+    """
+    def __init__(self, fmt, keys, stream=None):
+        if fmt not in FORMATS:
+            raise FormatError, "%s is not a known format. Choose from %s" % (
+                fmt, ', '.join(FORMATS))
+        self.fmt = fmt
+        self.keys = keys
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.rows = []
+        self.csv_writer = None
+
+    def write(self, items):
+        """ Write one record given as a list of (key, value) pairs
+        """
+        self.count += 1
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(
+                dict((k, fmt_value(v)) for k, v in items), sort_keys=True) + '\n')
+        elif self.fmt == 'json':
+            self.stream.write('[\n' if self.count == 1 else ',\n')
+            self.stream.write(json.dumps(
+                dict((k, fmt_value(v)) for k, v in items), sort_keys=True))
+        elif self.fmt == 'csv':
+            if not self.csv_writer:
+                self.csv_writer = csv.writer(self.stream)
+                self.csv_writer.writerow(self.keys)
+            self.csv_writer.writerow([fmt_text(v) for k, v in items])
+        elif self.fmt == 'table':
+            self.rows.append([fmt_text(v) for k, v in items])
+        else:
+            self.stream.write('Result:%s\n' % self.count)
+            for key, value in items:
+                self.stream.write('\t%s:%s\n' % (key, fmt_text(value)))
+            self.stream.write('\n')
+
+    def close(self):
+        """ Flush buffered output
+        """
+        if self.fmt == 'json':
+            self.stream.write('\n]\n' if self.count else '[]\n')
+        elif self.fmt == 'csv' and not self.csv_writer:
+            csv.writer(self.stream).writerow(self.keys)
+        elif self.fmt == 'table':
+            widths = [len(key) for key in self.keys]
+            for row in self.rows:
+                widths = [max(w, len(v)) for w, v in zip(widths, row)]
+            line = '  '.join(['%-*s'] * len(widths))
+            self.stream.write(line % sum(zip(widths, self.keys), ()) + '\n')
+            self.stream.write('  '.join('-' * w for w in widths) + '\n')
+            for row in self.rows:
+                self.stream.write(line % sum(zip(widths, row), ()) + '\n')
+            self.rows = []
+        self.stream.flush()
+
+def write_records(records, fmt, table, stream=None):
+    """ Write mapped records of class table and return the number written
+    """
+    keys = columns(table)
+    writer = RecordWriter(fmt, keys, stream)
+    for record in records:
+        writer.write(record_to_dict(record, keys))
+    writer.close()
+    return writer.count
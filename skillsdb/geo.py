@@ -0,0 +1,348 @@
+"""
+Proximity
+=========
+Find parents living near a place, from postcode centroids, offline.
+
+A postcode directory (such as the ONS Postcode Directory or Code-Point
+Open, converted to CSV with postcode, latitude and longitude columns) is
+loaded into the postcode table. Addresses are given the latitude and
+longitude of their postcode, and its geohash (grid), as they are written.
+
+Geohashes of nearby points share a prefix, so the addresses within a
+radius are read from the few cells covering the bounding circle, each
+an indexed range of grid values, and only those are measured exactly.
+Nearest searches widen the radius until enough addresses are found.
+
+    skillsdb near --load postcodes.csv
+    skillsdb near "CB21 4EE" --miles 2
+"""
+import csv
+import math
+import collections
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes
+
+import utils
+import models
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Characters of stored geohashes, about 5 metres
+PRECISION = 9
+EARTH_MILES = 3958.8
+# Most cells read for a radius search
+MAX_CELLS = 16
+MILES = 2.0
+NEAREST = 10
+BATCH_SIZE = 1000
+CHUNK = 500
+KEYS = ['id', 'first_name', 'second_name', 'postcode', 'miles']
+COLUMNS = {'postcode':['postcode', 'pcds', 'pcd', 'pcd2'], 'latitude':['latitude', 'lat'],
+           'longitude':['longitude', 'long', 'lng', 'lon']}
+
+class GeoError(Exception):pass
+
+def postcode_key(postcode):
+    """ CB21 4EE, cb214ee -> CB214EE
+    """
+    return ''.join((postcode or '').split()).upper()
+
+def geohash(latitude, longitude, precision=PRECISION):
+    """ Return the geohash of a point, alternate bits halving longitude
+        and latitude ranges
+    """
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    values = [longitude, latitude]
+    chars = []
+    bits = 0
+    for i in xrange(precision * 5):
+        low, high = ranges[i % 2]
+        middle = (low + high) / 2
+        bits <<= 1
+        if values[i % 2] >= middle:
+            bits |= 1
+            ranges[i % 2][0] = middle
+        else:
+            ranges[i % 2][1] = middle
+        if i % 5 == 4:
+            chars.append(BASE32[bits])
+            bits = 0
+    return ''.join(chars)
+
+def cell_size(precision):
+    """ Return (latitude, longitude) degrees spanned by a geohash cell
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+def miles(lat1, lon1, lat2, lon2):
+    """ Great circle (haversine) distance between two points
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+def covering_cells(latitude, longitude, radius):
+    """ Return geohash prefixes of the fewest, smallest cells covering the
+        box around a circle of radius miles
+    """
+    dlat = math.degrees(radius / EARTH_MILES)
+    dlon = dlat / max(math.cos(math.radians(latitude)), 0.01)
+    box = (latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon)
+    for precision in xrange(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = int((box[1] - box[0]) / height) + 2
+        columns = int((box[3] - box[2]) / width) + 2
+        if rows * columns <= MAX_CELLS or precision == 1:
+            break
+    cells = set()
+    for i in xrange(rows):
+        lat = min(box[0] + i * height, box[1])
+        for j in xrange(columns):
+            lon = min(box[2] + j * width, box[3])
+            cells.add(geohash(max(-90.0, min(90.0, lat)),
+                              (lon + 180.0) % 360.0 - 180.0, precision))
+    return sorted(cells)
+
+def centroid(conn, postcode):
+    """ Return (latitude, longitude) of a postcode, or None
+    """
+    p = models.Postcode.__table__
+    return conn.execute(sa.select([p.c.latitude, p.c.longitude]).where(
+        p.c.key == postcode_key(postcode))).first()
+
+def locate(conn, place):
+    """ Return (latitude, longitude) of a postcode, or of 'latitude,longitude'
+    """
+    parts = place.split(',')
+    if len(parts) == 2:
+        try:
+            return float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+    found = centroid(conn, place)
+    if found is None:
+        raise GeoError, "%s is not a known postcode. Load a postcode directory first" % place
+    return tuple(found)
+
+def grid_ranges(latitude, longitude, radius):
+    """ Return a criterion of addresses in the cells covering a circle of
+        radius miles around a point
+    """
+    a = models.Address.__table__
+    cells = covering_cells(latitude, longitude, radius)
+    # '{' follows every geohash character, so each cell is a range of the index
+    return sa.or_(*[sa.and_(a.c.grid >= cell, a.c.grid < cell + '{') for cell in cells])
+
+def distance_criterion(latitude, longitude, radius):
+    """ Return a criterion of addresses within radius miles of a point,
+        in arithmetic every database has: distances on a plane of degrees
+        scaled to the point's latitude, within a few yards of great circle
+        distances at county scale
+    """
+    a = models.Address.__table__
+    degrees = math.degrees(radius / EARTH_MILES)
+    scale = math.cos(math.radians(latitude))
+    dlat = a.c.latitude - latitude
+    dlon = (a.c.longitude - longitude) * scale
+    return dlat * dlat + dlon * dlon <= degrees * degrees
+
+def within(conn, latitude, longitude, radius):
+    """ Return [(miles, address ID, parent ID)] of addresses within radius
+        miles of a point, nearest first
+    """
+    a = models.Address.__table__
+    found = []
+    for id, parent_id, lat, lon in conn.execute(sa.select(
+            [a.c.id, a.c.parent_id, a.c.latitude, a.c.longitude]).where(
+            grid_ranges(latitude, longitude, radius))):
+        distance = miles(latitude, longitude, lat, lon)
+        if distance <= radius:
+            found.append((distance, id, parent_id))
+    return sorted(found)
+
+def nearest(conn, latitude, longitude, k=NEAREST, start=1.0):
+    """ Return the k addresses nearest a point, as within does
+    """
+    radius = start
+    while True:
+        found = within(conn, latitude, longitude, radius)
+        # Half the earth's circumference reaches everywhere
+        if len(found) >= k or radius > math.pi * EARTH_MILES:
+            return found[:k]
+        radius *= 2
+
+def parents_near(conn, place, radius):
+    """ Return IDs of parents living within radius miles of a place
+    """
+    latitude, longitude = locate(conn, place)
+    return set(parent_id for distance, id, parent_id in within(conn, latitude, longitude, radius)
+               if parent_id is not None)
+
+def near_criterion(conn, value):
+    """ Return a criterion of Address matching addresses within a radius,
+        of a search value 'CB21 4EE' or 'CB21 4EE:5' (miles): the grid
+        cells covering it, ranges of the index, and the distance
+    """
+    place, sep, radius = value.rpartition(':')
+    if not sep:
+        place, radius = value, MILES
+    try:
+        radius = float(radius)
+    except ValueError:
+        raise GeoError, "%s is not a radius in miles" % radius
+    latitude, longitude = locate(conn, place)
+    return sa.and_(grid_ranges(latitude, longitude, radius),
+                   distance_criterion(latitude, longitude, radius))
+
+def geocode(conn, address_ids=None):
+    """ Set the coordinates and grid of addresses, or of every address,
+        from their postcodes, leaving updated times as they were
+    """
+    a = models.Address.__table__
+    p = models.Postcode.__table__
+    query = sa.select([a.c.id, a.c.postcode])
+    if address_ids is None:
+        queries = [query]
+    else:
+        address_ids = list(address_ids)
+        queries = [query.where(a.c.id.in_(address_ids[i:i + CHUNK]))
+                   for i in xrange(0, len(address_ids), CHUNK)]
+    rows = []
+    for query in queries:
+        addresses = conn.execute(query).fetchall()
+        keys = set(postcode_key(postcode) for id, postcode in addresses)
+        centroids = dict((key, (lat, lon)) for key, lat, lon in conn.execute(
+            sa.select([p.c.key, p.c.latitude, p.c.longitude]).where(p.c.key.in_(keys))))
+        for id, postcode in addresses:
+            lat, lon = centroids.get(postcode_key(postcode), (None, None))
+            rows.append({'_id':id, 'latitude':lat, 'longitude':lon,
+                         'grid':geohash(lat, lon) if lat is not None else None})
+    statement = a.update().where(a.c.id == sa.bindparam('_id')).values(
+        latitude=sa.bindparam('latitude'), longitude=sa.bindparam('longitude'),
+        grid=sa.bindparam('grid'), updated=a.c.updated)
+    for i in xrange(0, len(rows), BATCH_SIZE):
+        conn.execute(statement, rows[i:i + BATCH_SIZE])
+    return len(rows)
+
+def read_centroids(fh):
+    """ Yield (key, latitude, longitude) of a CSV postcode directory,
+        skipping postcodes without coordinates
+    """
+    reader = csv.DictReader(fh)
+    names = dict((name.strip().lower(), name) for name in reader.fieldnames or [])
+    columns = {}
+    for key, choices in COLUMNS.iteritems():
+        found = [names[choice] for choice in choices if choice in names]
+        if not found:
+            raise GeoError, "Postcode directory needs a %s column (one of %s)" % (
+                key, ', '.join(choices))
+        columns[key] = found[0]
+    for row in reader:
+        try:
+            latitude = float(row[columns['latitude']])
+            longitude = float(row[columns['longitude']])
+        except (TypeError, ValueError):
+            continue
+        # The ONS directory gives terminated postcodes no location as 99.999999
+        if abs(latitude) <= 90 and abs(longitude) <= 180 and row[columns['postcode']]:
+            yield postcode_key(row[columns['postcode']]), latitude, longitude
+
+def load(session, fh):
+    """ Load postcode centroids from a CSV file handle, replacing any
+        already loaded, then geocode every address. Returns the number
+        of postcodes loaded
+    """
+    conn = session.connection()
+    p = models.Postcode.__table__
+    count = 0
+    batch = collections.OrderedDict()
+
+    def write(batch):
+        keys = list(batch)
+        conn.execute(p.delete().where(p.c.key.in_(keys)))
+        conn.execute(p.insert(), [{'key':key, 'latitude':lat, 'longitude':lon}
+                                  for key, (lat, lon) in batch.iteritems()])
+
+    for key, latitude, longitude in read_centroids(fh):
+        batch[key] = (latitude, longitude)
+        if len(batch) >= CHUNK:
+            write(batch)
+            count += len(batch)
+            batch.clear()
+    if batch:
+        write(batch)
+        count += len(batch)
+    geocode(conn)
+    session.commit()
+    return count
+
+@sa.event.listens_for(models.Address, 'before_insert')
+@sa.event.listens_for(models.Address, 'before_update')
+def set_location(mapper, connection, target):
+    """ Locate addresses as their postcodes are written
+    """
+    state = sa.inspect(target)
+    if state.has_identity and not attributes.get_history(target, 'postcode').has_changes():
+        return
+    found = centroid(connection, target.postcode) if target.postcode else None
+    target.latitude, target.longitude = found if found else (None, None)
+    target.grid = geohash(*found) if found else None
+
+def main(args):
+    """
+Find parents living near a postcode, and load postcode locations.
+
+  Load a postcode directory with --load, a CSV file of postcode, latitude and
+  longitude columns (the ONS Postcode Directory pcds, lat and long columns are
+  recognised).  Addresses are located from their postcodes as they are saved,
+  and every address is located again when a directory is loaded.
+
+  PLACE is a postcode, or latitude,longitude.  Parents within --miles of it
+  are listed nearest first, or the --nearest N parents however far.
+
+  Address searches take the same radius, as postcode=PLACE:MILES,near, and
+  skillsdb match limits matches to parents --near a place.
+
+  skillsdb near --load postcodes.csv
+  skillsdb near "CB21 4EE" --miles 2
+  skillsdb near 52.2053,0.1218 --nearest 5 --format csv
+  skillsdb manage --search --address "postcode=CB21 4EE:2,near"
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.load:
+        session = session_config.get_session()
+        with open(args.load, 'rb') as fh:
+            count = load(session, fh)
+        session.close()
+        log.info('Loaded %s postcodes' % count)
+        return 0
+    if not args.place:
+        raise GeoError, "Give a PLACE to search near, or --load a postcode directory"
+
+    session = session_config.get_session(readonly=True)
+    conn = session.connection()
+    latitude, longitude = locate(conn, args.place)
+    if args.nearest:
+        found = nearest(conn, latitude, longitude, args.nearest)
+    else:
+        found = within(conn, latitude, longitude, args.miles)
+    parents = models.Parent.get_many(session, [parent_id for d, id, parent_id in found])
+    addresses = models.Address.get_many(session, [id for d, id, parent_id in found])
+
+    writer = formats.RecordWriter(args.format, KEYS)
+    for distance, id, parent_id in found:
+        parent = parents.get(parent_id)
+        if parent is not None:
+            writer.write(zip(KEYS, [parent.id, parent.first_name, parent.second_name,
+                                    addresses[id].postcode, round(distance, 2)]))
+    writer.close()
+    session.close()
+    log.info('%s results' % writer.count)
+    return 0
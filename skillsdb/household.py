@@ -0,0 +1,223 @@
+"""
+Households
+==========
+Group parents and children into households.
+
+A household is every parent connected by a partner link or a shared
+child, together with their children. Each member carries the household
+ID, the lowest parent ID of the household, so a family or all families
+with children in a school year are single indexed lookups.
+
+Household IDs are maintained on flush whenever parents, children or
+their links change, and may be rebuilt in full with a recursive query.
+"""
+import itertools
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes
+
+import utils
+import models
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+KEYS = ['household_id', 'member', 'id', 'first_name', 'second_name', 'year']
+# Relationships of parents and children that join households
+RELATED = {models.Parent:['partner', 'other', 'children', 'parent_id'],
+           models.Child:['parents']}
+SEEDS = 'household_seeds'
+CHUNK = 500
+
+class HouseholdError(Exception):pass
+
+def chunks(ids, size=CHUNK):
+    ids = list(ids)
+    for i in xrange(0, len(ids), size):
+        yield ids[i:i + size]
+
+def neighbours(conn, ids):
+    """ Return IDs of partners and co-parents of parents ids
+    """
+    parent = models.Parent.__table__
+    pc = models.parent_child
+    found = set()
+    for chunk in chunks(ids):
+        found.update(row[0] for row in conn.execute(sa.select([parent.c.parent_id]).where(
+            parent.c.id.in_(chunk)).where(parent.c.parent_id != None)))
+        found.update(row[0] for row in conn.execute(sa.select([parent.c.id]).where(
+            parent.c.parent_id.in_(chunk))))
+        children = sa.select([pc.c.child_id]).where(pc.c.parent_id.in_(chunk))
+        found.update(row[0] for row in conn.execute(sa.select([pc.c.parent_id]).where(
+            pc.c.child_id.in_(children))))
+    return found
+
+def relabel(conn, parent_ids=(), child_ids=()):
+    """ Recompute households of the given parents and children, and of
+        everyone now or previously connected to them
+    """
+    parent = models.Parent.__table__
+    child = models.Child.__table__
+    pc = models.parent_child
+
+    labels = {}
+    seeds = set(parent_ids)
+    while seeds:
+        component = frontier = set([seeds.pop()])
+        while frontier:
+            frontier = neighbours(conn, frontier) - component
+            component = component | frontier
+        seeds -= component
+        existing = set()
+        for chunk in chunks(component):
+            existing.update(row[0] for row in conn.execute(
+                sa.select([parent.c.id]).where(parent.c.id.in_(chunk))))
+        for id in existing:
+            labels[id] = min(existing)
+
+    if labels:
+        conn.execute(parent.update().where(parent.c.id == sa.bindparam('pid')).values(
+            household_id=sa.bindparam('hid')),
+            [{'pid':pid, 'hid':hid} for pid, hid in labels.iteritems()])
+
+    child_ids = set(child_ids)
+    for chunk in chunks(labels):
+        child_ids.update(row[0] for row in conn.execute(
+            sa.select([pc.c.child_id]).where(pc.c.parent_id.in_(chunk))))
+    for chunk in chunks(child_ids):
+        conn.execute(child.update().where(child.c.id.in_(chunk)).values(
+            household_id=child_household()))
+
+def child_household():
+    """ Correlated subquery of the household of a child's parents
+    """
+    parent = models.Parent.__table__
+    child = models.Child.__table__
+    pc = models.parent_child
+    return sa.select([sa.func.min(parent.c.household_id)]).where(
+        pc.c.parent_id == parent.c.id).where(pc.c.child_id == child.c.id).as_scalar()
+
+def rebuild(session):
+    """ Recompute every household with a recursive query over partner
+        and shared child links
+    """
+    parent = models.Parent.__table__
+    pc = models.parent_child
+    other = pc.alias('other')
+
+    edges = sa.union(
+        sa.select([parent.c.id.label('a'), parent.c.parent_id.label('b')]).where(
+            parent.c.parent_id != None),
+        sa.select([parent.c.parent_id, parent.c.id]).where(parent.c.parent_id != None),
+        sa.select([pc.c.parent_id, other.c.parent_id]).where(
+            pc.c.child_id == other.c.child_id).where(pc.c.parent_id != other.c.parent_id),
+    ).cte('edges')
+    reach = sa.select([parent.c.id.label('id'), parent.c.id.label('root')]).cte(
+        'reach', recursive=True)
+    reach = reach.union(sa.select([edges.c.b, reach.c.root]).where(edges.c.a == reach.c.id))
+    query = sa.select([reach.c.id, sa.func.min(reach.c.root)]).group_by(reach.c.id)
+
+    labels = [{'pid':pid, 'hid':hid} for pid, hid in session.execute(query)]
+    if labels:
+        session.execute(parent.update().where(parent.c.id == sa.bindparam('pid')).values(
+            household_id=sa.bindparam('hid')), labels)
+    session.execute(models.Child.__table__.update().values(household_id=child_household()))
+    session.commit()
+    return len(set(label['hid'] for label in labels))
+
+def members(session, household_ids):
+    """ Yield member rows of the given households, parents first
+    """
+    for table, member in [(models.Parent, 'parent'), (models.Child, 'child')]:
+        year = table.year if table == models.Child else sa.null()
+        for row in session.query(table.household_id, table.id, table.first_name,
+                                 table.second_name, year).filter(
+                table.household_id.in_(household_ids)).order_by(
+                table.household_id, table.id):
+            yield [row[0], member] + list(row[1:])
+
+def collect_seeds(session, flush_context, instances):
+    """ Remember parents and children whose household may change
+    """
+    seeds = session.info.setdefault(SEEDS, set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if type(obj) not in RELATED:
+            continue
+        # Deleted records take their related records' households with them
+        passive = attributes.PASSIVE_OFF if obj in session.deleted else attributes.PASSIVE_NO_INITIALIZE
+        changed = obj in session.new or obj in session.deleted
+        related = set()
+        for key in RELATED[type(obj)]:
+            history = attributes.get_history(obj, key, passive=passive)
+            changed = changed or history.has_changes()
+            related.update(item for item in history.sum() if item is not None)
+        if changed:
+            seeds.add(obj)
+            seeds.update(related)
+
+def update_households(session, flush_context):
+    """ Relabel households of records collected before the flush
+    """
+    seeds = session.info.pop(SEEDS, None)
+    if not seeds:
+        return
+    parent_ids, child_ids = set(), set()
+    for seed in seeds:
+        if isinstance(seed, (int, long)):
+            parent_ids.add(seed)
+            continue
+        # New records are not yet in the identity map after the flush
+        id = sa.inspect(seed).dict.get('id')
+        if id is not None:
+            (parent_ids if type(seed) == models.Parent else child_ids).add(id)
+    if child_ids:
+        pc = models.parent_child
+        for chunk in chunks(child_ids):
+            parent_ids.update(row[0] for row in session.connection().execute(
+                sa.select([pc.c.parent_id]).where(pc.c.child_id.in_(chunk))))
+    relabel(session.connection(), parent_ids, child_ids)
+
+sa.event.listen(sa.orm.Session, 'before_flush', collect_seeds)
+sa.event.listen(sa.orm.Session, 'after_flush', update_households)
+
+def main(args):
+    """
+Show and maintain households: parents linked as partners or through a
+shared child, with their children.
+
+  Households are kept up to date as records change.  Rebuild every household
+  (after upgrading a database, for example) with --rebuild.
+
+  skillsdb household --pid 12          everyone in the family of parent 12
+  skillsdb household --cid 40          everyone in the family of child 40
+  skillsdb household --year 3          all families with children in year 3
+  skillsdb household --rebuild
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.rebuild:
+        session = session_config.get_session()
+        count = rebuild(session)
+        session.close()
+        log.info('Rebuilt %s households' % count)
+        return 0
+
+    session = session_config.get_session(readonly=True)
+    if args.pid is not None:
+        household_ids = session.query(models.Parent.household_id).filter(
+            models.Parent.id == args.pid)
+    elif args.cid is not None:
+        household_ids = session.query(models.Child.household_id).filter(
+            models.Child.id == args.cid)
+    elif args.year is not None:
+        household_ids = session.query(models.Child.household_id).filter(
+            models.Child.year == args.year).distinct()
+    else:
+        raise HouseholdError, "Select households with --pid, --cid or --year"
+
+    writer = formats.RecordWriter(args.format, KEYS)
+    for row in members(session, household_ids.subquery()):
+        writer.write(zip(KEYS, row))
+    writer.close()
+    session.close()
+    return 0
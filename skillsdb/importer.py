@@ -0,0 +1,286 @@
+"""
+Bulk import
+===========
+Import records of one table from a CSV file.
+
+Parsing and validation are fanned out in chunks to a pool of worker
+processes. Validated chunks are collected in input order by the importing
+process, which is the only one to write to the database. At most a few
+chunks per worker are in flight at any time, so a slow database holds
+back reading of the input instead of filling memory.
+"""
+import os
+import csv
+import collections
+import multiprocessing
+
+import utils
+import models
+import views
+import schema
+import upsert
+import vocabulary
+import coordinator
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Column holding the parent record ID, resolved as for --pid
+PID_KEY = 'pid'
+# Column holding the ID of a record to update, when upserting
+ID_KEY = 'id'
+
+class ImporterError(Exception):pass
+
+def read_chunks(fh, chunk_size):
+    """ Yield (first line number, rows) chunks of a CSV file
+        Rows are lists of (key, value) pairs, blank values are skipped.
+        Values are bytes, decoded as they are validated
+    """
+    reader = csv.reader(fh)
+    try:
+        header = [key.strip() for key in reader.next()]
+    except StopIteration:
+        return
+
+    rows = []
+    first_line = 2
+    for row in reader:
+        if not any(row):
+            row = []
+        rows.append([(key, value) for key, value in zip(header, row) if value])
+        if len(rows) == chunk_size:
+            yield first_line, rows
+            first_line = reader.line_num + 1
+            rows = []
+    if rows:
+        yield first_line, rows
+
+def decode(pairs):
+    """ Return (key, value) pairs with UTF-8 values decoded
+    """
+    decoded = []
+    for key, value in pairs:
+        try:
+            decoded.append((key, value.decode('utf-8')))
+        except UnicodeDecodeError, e:
+            raise ValueError, "%s is not UTF-8 text: %r at byte %s" % (
+                key, value[e.start:e.end], e.start)
+    return decoded
+
+def validate_chunk(table_name, first_line, rows, upserts=False):
+    """ Parse and validate a chunk of rows
+        With upserts, rows may give the id of a record to update
+
+        Returns (valid rows, errors) as lists of (line number, values)
+        and (line number, message). Runs in a worker process.
+    """
+    table = views.TABLES[table_name]
+    fields = schema.for_table(table)
+
+    valid, errors = [], []
+    for line_no, pairs in enumerate(rows, first_line):
+        if not pairs:
+            continue
+        try:
+            pairs = dict(decode(pairs))
+            pid = pairs.pop(PID_KEY, None)
+            id = pairs.pop(ID_KEY, None) if upserts else None
+            values = fields.values(pairs.iteritems(), fields.writable)
+            if pid is not None:
+                try:
+                    values[PID_KEY] = int(pid)
+                except ValueError:
+                    raise ValueError, "%s is an invalid parent ID" % pid
+            if id is not None:
+                try:
+                    values[ID_KEY] = int(id)
+                except ValueError:
+                    raise ValueError, "%s is an invalid record ID" % id
+                if table != models.Parent and PID_KEY in values:
+                    raise ValueError, "Parents of %s records can not be changed by an upsert" % (
+                        table.classname)
+            elif table != models.Parent and PID_KEY not in values:
+                raise ValueError, "Parent ID (pid) is required for %s records" % table.classname
+            valid.append((line_no, values))
+        except (ValueError, schema.SchemaError), e:
+            errors.append((line_no, str(e)))
+
+    return valid, errors
+
+class ImportWriter(object):
+    """ Write validated rows in batches, one transaction per batch
+
+        Parent IDs are resolved as the manage command does: parents are
+        linked to the vocabulary skill of a skill row's name, freetimes are
+        owned by the parent, children belong to the parent and partner, and
+        a parent given a pid is partnered with them.
+
+        Rows giving a record ID are written with one upsert statement
+        per batch, updating the record or creating it with that ID.
+    """
+    def __init__(self, session, table, batch_size):
+        self.session = session
+        self.table = table
+        self.batch_size = batch_size
+        self.batch = []
+        self.written = 0
+        self.errors = []
+        # Vocabulary skills by normalised name
+        self.skills = {}
+
+    def add(self, line_no, values):
+        self.batch.append((line_no, values))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        written, errors = coordinator.transaction(self.session, self.write_batch)
+        for line_no, message in errors:
+            log.error('Line %s: %s' % (line_no, message))
+        self.errors.extend(errors)
+        self.written += written
+        log.info('Imported %s %s records' % (self.written, self.table.classname))
+        self.batch = []
+
+    def write_batch(self, session):
+        """ Add the records of the batch, returning (records written,
+            errors). Run again if the database was busy
+        """
+        pids = set(values[PID_KEY] for line_no, values in self.batch if PID_KEY in values)
+        parents = models.Parent.get_many(session, pids)
+
+        records = []
+        rows = []
+        errors = []
+        linked = 0
+        # Skills added by an attempt rolled back were never written
+        for key, skill in self.skills.items():
+            if models.sa.inspect(skill).transient:
+                del self.skills[key]
+        for line_no, values in self.batch:
+            values = dict(values)
+            pid = values.pop(PID_KEY, None)
+            parent = parents.get(pid)
+            if pid is not None and not parent:
+                errors.append((line_no, "No parent record with ID %s" % pid))
+                continue
+            if ID_KEY in values:
+                if parent:
+                    values['parent_id'] = parent.id
+                rows.append(values)
+                continue
+            if self.table == models.Skill:
+                try:
+                    skill = vocabulary.canonical(session, values.get('name'), self.skills)
+                except vocabulary.VocabularyError, e:
+                    errors.append((line_no, str(e)))
+                    continue
+                if parent and skill not in parent.skills:
+                    parent.skills.append(skill)
+                linked += 1
+                continue
+            record = self.table(**values)
+            if parent:
+                self.relate(record, parent)
+            records.append(record)
+
+        session.add_all(records)
+        if rows:
+            upsert.upsert(session, self.table, rows)
+        return len(records) + len(rows) + linked, errors
+
+    def relate(self, record, parent):
+        """ Attach the parent (and partner) to a new record
+        """
+        if self.table == models.Parent:
+            record.partner = parent
+        elif self.table == models.Child:
+            partner = parent.partner or parent.other
+            record.parents = [parent, partner] if partner else [parent]
+        elif self.table in [models.Skill, models.Freetime]:
+            record.parents = [parent]
+        record.parent_id = parent.id
+
+def run(fh, table, session, workers=None, chunk_size=1000, batch_size=5000, upserts=False):
+    """ Import a CSV file handle into table
+        With upserts, rows with an id column update or create that record
+
+        Returns (rows written, errors), errors in line order
+    """
+    workers = workers or multiprocessing.cpu_count()
+    writer = ImportWriter(session, table, batch_size)
+    errors = []
+
+    def collect(result):
+        valid, invalid = result
+        for line_no, message in invalid:
+            log.error('Line %s: %s' % (line_no, message))
+        errors.extend(invalid)
+        for line_no, values in valid:
+            writer.add(line_no, values)
+
+    chunks = read_chunks(fh, chunk_size)
+    if workers == 1:
+        for first_line, rows in chunks:
+            collect(validate_chunk(table.classname, first_line, rows, upserts))
+    else:
+        pool = multiprocessing.Pool(workers)
+        pending = collections.deque()
+        try:
+            for first_line, rows in chunks:
+                pending.append(pool.apply_async(
+                    validate_chunk, (table.classname, first_line, rows, upserts)))
+                # Back pressure, wait for the oldest chunk once enough are queued
+                if len(pending) >= 2 * workers:
+                    collect(pending.popleft().get())
+            while pending:
+                collect(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+
+    writer.flush()
+    errors = sorted(errors + writer.errors)
+    return writer.written, errors
+
+def main(args):
+    """
+Import records into the skills database from a CSV file.
+
+  Select one of parent, child, skill, freetime or address tables.
+  The first row of the file names the columns, e.g. first_name,second_name.
+  Non parent records require a pid column, the ID of an existing parent.
+  Times are given as hh:mm.
+
+  Rows are validated in parallel (--workers, default one per core) and written
+  in batches (--batch-size) by a single writer. Invalid rows are reported by
+  line number and skipped.
+
+  With --upsert, rows may give the id of a record to update.  Updates are
+  written with one statement per batch, and missing IDs are created.  Rows
+  without an id are added as usual.
+
+  skillsdb import --parent parents.csv
+  skillsdb import --skill --workers 4 skills.csv
+  skillsdb import --address --upsert addresses.csv
+    """
+    table = None
+    for name in views.TABLES:
+        if getattr(args, name):
+            table = views.TABLES[name]
+    if not table:
+        raise ImporterError, "Select a table to import into"
+    if not os.path.exists(args.filename):
+        raise ImporterError, "%s import file not found" % args.filename
+
+    session = utils.load_config(args.config, args.tenant).get_session()
+    with open(args.filename, 'rb') as fh:
+        written, errors = run(fh, table, session, args.workers,
+                              args.chunk_size, args.batch_size, args.upsert)
+    session.close()
+
+    log.info('Import complete: %s records written, %s rows rejected' % (written, len(errors)))
+    return 1 if errors else 0
@@ -19,6 +19,20 @@ import textwrap
 
 import config
 import views
+import formats
+import importer
+import dedupe
+import household
+import stats
+import changes
+import sync
+import backup
+import match
+import vocabulary
+import similar
+import geo
+import coordinator
+import saved
 
 parser = argparse.ArgumentParser(prog='skillsdb', description=textwrap.dedent(sys.modules[__name__].__doc__), formatter_class=RawDescriptionHelpFormatter)
 parser.add_argument('--verbose', '-v', action='count', help='verbosity (use -vv for debug)')
@@ -38,6 +52,7 @@ parser_group.add_argument('filename', nargs="?", type=str, help="Configuration f
                           default=config.FNAME)
 
 config.ConfigOptions.customize_parser(parser_group)
+config.TenantOptions.customize_parser(parser_group)
 
 # views
 parser_group = subparsers.add_parser('manage', description=views.main.__doc__, help="Manage database", formatter_class=RawDescriptionHelpFormatter)
@@ -52,10 +67,152 @@ group.add_argument('--add','-A', action='store_true', help="Add a record")
 group.add_argument('--delete','-D', action='store_true', help="Delete a record")
 group.add_argument('--modify','-M', action='store_true', help="Modify a record")
 group.add_argument('--search', '-S', action='store_true', help="Search for a record")
+parser_group.add_argument('--upsert', '-U', action='store_true', help="Modify columns in one statement, creating the record if missing")
+parser_group.add_argument('--dry-run', '-n', dest='dry_run', action='store_true', help="Count records matched by a search, without changing them")
+parser_group.add_argument('--explain', action='store_true', help="Print the SQL and query plan of a search instead of its results")
+parser_group.add_argument('--queue', '-Q', action='store_true', help="Run by the writer process, if running (skillsdb writer)")
 
 views.ViewOptions.customize_parser(parser_group)
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
 
 
+# import
+parser_group = subparsers.add_parser('import', description=importer.main.__doc__, help="Import records from a CSV file", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=importer.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--workers', '-w', type=int, help="validation processes (one per core)", default=None)
+parser_group.add_argument('--chunk-size', dest='chunk_size', type=int, help="rows per validation chunk (1000)", default=1000)
+parser_group.add_argument('--batch-size', dest='batch_size', type=int, help="rows per write transaction (5000)", default=5000)
+parser_group.add_argument('--upsert', '-U', action='store_true', help="Update rows with an id column, inserting missing IDs")
+parser_group.add_argument('filename', type=str, help="CSV file to import")
+views.ViewOptions.customize_parser(parser_group)
+config.TenantOptions.customize_parser(parser_group)
+
+# dedupe
+parser_group = subparsers.add_parser('dedupe', description=dedupe.main.__doc__, help="Find and merge duplicate people", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=dedupe.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--threshold', type=float, help="lowest score listed (0.7)", default=0.7)
+parser_group.add_argument('--merge', type=int, nargs=2, action='append', metavar=('KEEP', 'DROP'), help="merge record DROP into KEEP")
+group = parser_group.add_mutually_exclusive_group(required=True)
+group.add_argument('--parent', action='store_true', help='Work on parent table')
+group.add_argument('--child', action='store_true', help='Work on child table')
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# household
+parser_group = subparsers.add_parser('household', description=household.main.__doc__, help="Show families and rebuild households", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=household.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+group = parser_group.add_mutually_exclusive_group(required=True)
+group.add_argument('--pid', type=int, help="Household of parent record ID")
+group.add_argument('--cid', type=int, help="Household of child record ID")
+group.add_argument('--year', type=int, help="Households with children in school year")
+group.add_argument('--rebuild', action='store_true', help="Recompute all households")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# stats
+parser_group = subparsers.add_parser('stats', description=stats.main.__doc__, help="Show counts of skills, free times and areas", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=stats.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--kind', '-k', type=str, choices=stats.KINDS, help="kind of statistic")
+parser_group.add_argument('--key', type=str, help="statistic key, e.g. skill name", default=None)
+parser_group.add_argument('--rebuild', action='store_true', help="Recount all statistics")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# changes
+parser_group = subparsers.add_parser('changes', description=changes.main.__doc__, help="Stream records changed since a watermark", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=changes.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--since', '-s', type=str, help="watermark of the last changes received", default=None)
+parser_group.add_argument('--prune', type=str, help="delete tombstones written before a watermark", default=None)
+parser_group.add_argument('--format', '-f', type=str, choices=changes.FEED_FORMATS, default='jsonl', help='output format (jsonl)')
+views.ViewOptions.customize_parser(parser_group)
+config.TenantOptions.customize_parser(parser_group)
+
+# sync
+parser_group = subparsers.add_parser('sync', description=sync.main.__doc__, help="Copy records that differ to another database", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=sync.main)
+parser_group.add_argument('src', type=str, help="config filename of the source database")
+parser_group.add_argument('dst', type=str, help="config filename of the destination database")
+parser_group.add_argument('--src-tenant', dest='src_tenant', type=str, default=None, help="tenant (school) of the source database")
+parser_group.add_argument('--bucket-size', dest='bucket_size', type=int, help="record IDs per compared bucket (%s)" % sync.BUCKET_SIZE, default=sync.BUCKET_SIZE)
+parser_group.add_argument('--batch-size', dest='batch_size', type=int, help="rows per write statement (%s)" % sync.BATCH_SIZE, default=sync.BATCH_SIZE)
+parser_group.add_argument('--delete', action='store_true', help="Delete records missing from the source")
+parser_group.add_argument('--dry-run', '-n', dest='dry_run', action='store_true', help="Report differences without writing")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# backup
+parser_group = subparsers.add_parser('backup', description=backup.main.__doc__, help="Back up or restore a database", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=backup.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--restore', '-r', action='store_true', help="Replace the database with the backup")
+parser_group.add_argument('--rows', action='store_true', help="Write JSON lines of rows, from any type of database")
+parser_group.add_argument('--pages', type=int, help="SQLite pages copied per backup step (%s)" % backup.PAGES, default=backup.PAGES)
+parser_group.add_argument('filename', type=str, help="compressed backup file")
+config.TenantOptions.customize_parser(parser_group)
+
+# match
+parser_group = subparsers.add_parser('match', description=match.main.__doc__, help="Find parents with the skills and free time an activity needs", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=match.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--skill', '-s', type=str, action='append', help="required skill (repeat for more)")
+parser_group.add_argument('--slot', type=str, action='append', help="required time slot, e.g. \"Friday PM\" (repeat for more)")
+parser_group.add_argument('--coverage', type=str, help="CSV file of requirements to count matching parents for", default=None)
+parser_group.add_argument('--engine', type=str, choices=match.ENGINES, help="matrix engine (auto uses NumPy if installed)", default='auto')
+parser_group.add_argument('--near', type=str, help="only parents living near a postcode", default=None)
+parser_group.add_argument('--miles', type=float, help="distance from --near (2)", default=geo.MILES)
+parser_group.add_argument('--explain', action='store_true', help="Print the SQL and query plans of the match instead of its results")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# skills
+parser_group = subparsers.add_parser('skills', description=vocabulary.main.__doc__, help="List skills, add aliases and merge duplicate skills", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=vocabulary.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--alias', type=str, nargs=2, action='append', metavar=('ALIAS', 'NAME'), help="make ALIAS another name of skill NAME")
+parser_group.add_argument('--migrate', action='store_true', help="merge skills of the same name into one record per skill")
+parser_group.add_argument('--similar', type=str, help="list skills spelt like SIMILAR", default=None)
+parser_group.add_argument('--top', type=int, help="similar skills listed (10)", default=similar.TOP_K)
+parser_group.add_argument('--reindex', action='store_true', help="rebuild the index of similar skills")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# near
+parser_group = subparsers.add_parser('near', description=geo.main.__doc__, help="Find parents living near a postcode", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=geo.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('--load', type=str, help="CSV postcode directory to load", default=None)
+parser_group.add_argument('--miles', type=float, help="distance from PLACE (2)", default=geo.MILES)
+parser_group.add_argument('--nearest', type=int, help="list the N nearest parents instead", default=None)
+parser_group.add_argument('place', nargs='?', type=str, help="postcode, or latitude,longitude")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# saved
+parser_group = subparsers.add_parser('saved', description=saved.main.__doc__, help="Save searches and list their new matches", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=saved.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+parser_group.add_argument('name', nargs='?', type=str, help="name of a saved search", default=None)
+group = parser_group.add_mutually_exclusive_group()
+group.add_argument('--add', action='store_true', help="save a search of --skill and --slot as NAME")
+group.add_argument('--delete', action='store_true', help="delete the saved search NAME")
+group.add_argument('--new', action='store_true', help="list matches since new matches were last listed")
+parser_group.add_argument('--skill', '-s', type=str, action='append', help="required skill (repeat for more)")
+parser_group.add_argument('--slot', type=str, action='append', help="required time slot, e.g. \"Friday PM\" (repeat for more)")
+parser_group.add_argument('--rebuild', action='store_true', help="match every search against every parent again")
+config.TenantOptions.customize_parser(parser_group)
+formats.FormatOptions.customize_parser(parser_group)
+
+# writer
+parser_group = subparsers.add_parser('writer', description=coordinator.main.__doc__, help="Run queued manage commands one at a time", formatter_class=RawDescriptionHelpFormatter)
+parser_group.set_defaults(func=coordinator.main)
+parser_group.add_argument('--config', '-C', type=str, help="config filename (config.cfg)", default=config.FNAME)
+
 # setuser
 parser_group = subparsers.add_parser('setuser', description=config.setuser.__doc__, help="Change databse user or reset password")
 parser_group.set_defaults(func=config.setuser)
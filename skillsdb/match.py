@@ -0,0 +1,281 @@
+"""
+Matching helpers
+================
+Find parents with every skill, and free in every time slot, that an
+activity needs, and report how many parents could cover each of many
+activities.
+
+Parents' skills (owned skills and parent_skill links, by normalised name)
+and time slots (day AM and day PM, from freetimes) are loaded once into
+an incidence matrix of skills and slots by parents, one bit per parent.
+The parents meeting a requirement are the AND of its columns.
+
+With NumPy the matrix is packed into bytes, and a batch of requirements
+is matched at once, each step ANDing one column of every requirement.
+Counts come from a table of bits set per byte. Without NumPy each column
+is a Python integer used as a bit set. Few parents have any one skill, so
+bit sets beat multiplying 0/1 matrices, which costs parents x
+requirements x columns.
+"""
+import csv
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import utils
+import models
+import stats
+import formats
+import geo
+import explain
+import logutils
+
+log = logutils.setup_log(__name__)
+
+ENGINES = ['auto', 'numpy', 'python']
+PERIODS = ['AM', 'PM']
+KEYS = ['id', 'first_name', 'second_name']
+COVERAGE_KEYS = ['name', 'skills', 'slots', 'matches']
+# Requirements matched per batch
+CHUNK = 4096
+# Bits set in each byte value
+POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)]) if numpy else None
+
+class MatchError(Exception):pass
+
+def slot_keys(text):
+    """ Return the (day, period) slots of 'Friday PM', 'Friday AM' or
+        'Friday' (all day)
+    """
+    parts = text.split()
+    if not parts or len(parts) > 2:
+        raise MatchError, "%s is not a time slot. Use a day and AM or PM" % text
+    day = parts[0].capitalize()
+    period = parts[1].upper() if len(parts) == 2 else 'DAY'
+    if period == 'DAY':
+        return [(day, p) for p in PERIODS]
+    if period not in PERIODS:
+        raise MatchError, "%s is not a period. Use AM, PM or Day" % parts[1]
+    return [(day, period)]
+
+def freetime_slots(day, am_start, am_end, pm_start, pm_end):
+    """ Return the (day, period) slots of a freetime
+    """
+    day, period = stats.freetime_key(day, am_start, am_end, pm_start, pm_end).rsplit(' ', 1)
+    return [(day, p) for p in PERIODS if period in (p, 'Day')]
+
+def load(session):
+    """ Return (parent IDs, skills by parent ID, slots by parent ID)
+    """
+    parent_ids = [row[0] for row in session.query(models.Parent.id).order_by(models.Parent.id)]
+    skills = collections.defaultdict(set)
+    names = {}
+    for id, parent_id, name in session.query(models.Skill.id, models.Skill.parent_id,
+                                             models.Skill.name):
+        names[id] = stats.skill_key(name)
+        if parent_id is not None:
+            skills[parent_id].add(names[id])
+    for parent_id, skill_id in session.query(models.parent_skill.c.parent_id,
+                                             models.parent_skill.c.skill_id):
+        if skill_id in names:
+            skills[parent_id].add(names[skill_id])
+
+    slots = collections.defaultdict(set)
+    periods = {}
+    for row in session.query(models.Freetime.id, models.Freetime.parent_id,
+                             *[getattr(models.Freetime, key) for key in stats.FREETIME_KEYS]):
+        periods[row[0]] = freetime_slots(*row[2:])
+        if row[1] is not None:
+            slots[row[1]].update(periods[row[0]])
+    for parent_id, freetime_id in session.query(models.parent_freetime.c.parent_id,
+                                                models.parent_freetime.c.freetime_id):
+        slots[parent_id].update(periods.get(freetime_id, []))
+    return parent_ids, skills, slots
+
+class Matcher(object):
+    """ Incidence of parents by skills and by time slots
+
+        Columns are ('skill', key) and ('slot', (day, period)). Each column
+        is a bit set of parent rows: a Python integer, or with NumPy a row
+        of a packed bit matrix of columns x parents.
+    """
+    def __init__(self, parent_ids, skills, slots, engine='auto'):
+        if engine not in ENGINES:
+            raise MatchError, "%s is not a matching engine. Choose from %s" % (
+                engine, ', '.join(ENGINES))
+        if engine == 'numpy' and numpy is None:
+            raise MatchError, "The numpy engine requires NumPy to be installed"
+        self.use_numpy = numpy is not None and engine != 'python'
+        self.parent_ids = list(parent_ids)
+        row = dict((id, i) for i, id in enumerate(self.parent_ids))
+
+        cells = []
+        for kind, held in [('skill', skills), ('slot', slots)]:
+            for parent_id, values in held.iteritems():
+                if parent_id in row:
+                    cells.extend(((kind, value), row[parent_id]) for value in values)
+        self.columns = dict((key, i) for i, key in enumerate(sorted(set(
+            key for key, i in cells))))
+        if self.use_numpy:
+            self.packed = self.pack(cells)
+        else:
+            self.bits = [0] * len(self.columns)
+            for key, i in cells:
+                self.bits[self.columns[key]] |= 1 << i
+
+    def pack(self, cells):
+        """ Return a columns x parents packed bit matrix, with two more rows:
+            every parent, and no parent
+        """
+        count = len(self.parent_ids)
+        packed = numpy.zeros((len(self.columns) + 2, (count + 7) // 8), dtype=numpy.uint8)
+        if cells:
+            columns = numpy.array([self.columns[key] for key, i in cells])
+            rows = numpy.array([i for key, i in cells])
+            numpy.bitwise_or.at(packed, (columns, rows >> 3),
+                                (0x80 >> (rows & 7)).astype(numpy.uint8))
+        packed[-2] = numpy.packbits(numpy.ones(count, dtype=bool))
+        return packed
+
+    def keys(self, skills, slots):
+        return [('skill', key) for key in skills] + [('slot', key) for key in slots]
+
+    def packed_matches(self, requirements):
+        """ Return a requirements x parents packed bit matrix of which parents
+            meet each requirement
+        """
+        everyone, nobody = len(self.columns), len(self.columns) + 1
+        keys = [self.keys(*requirement) for requirement in requirements]
+        width = max([len(k) for k in keys] + [1])
+        # Requirements needing fewer columns are padded with every parent
+        index = numpy.full((len(keys), width), everyone, dtype=numpy.intp)
+        for j, k in enumerate(keys):
+            index[j, :len(k)] = [self.columns.get(key, nobody) for key in k]
+        found = self.packed[index[:, 0]]
+        for i in xrange(1, width):
+            found &= self.packed[index[:, i]]
+        return found
+
+    def bit_matches(self, skills, slots):
+        """ Return the bit set of parents meeting one requirement
+        """
+        found = (1 << len(self.parent_ids)) - 1
+        for key in self.keys(skills, slots):
+            if key not in self.columns:
+                return 0
+            found &= self.bits[self.columns[key]]
+        return found
+
+    def match(self, skills=(), slots=()):
+        """ Return IDs of parents with every skill key, free in every slot
+        """
+        if self.use_numpy:
+            found = numpy.unpackbits(self.packed_matches([(skills, slots)])[0])
+            rows = numpy.flatnonzero(found[:len(self.parent_ids)])
+        else:
+            found = self.bit_matches(skills, slots)
+            rows = [i for i in xrange(len(self.parent_ids)) if found >> i & 1]
+        return [self.parent_ids[i] for i in rows]
+
+    def coverage(self, requirements):
+        """ Return the number of parents meeting each (skill keys, slot keys)
+            requirement
+        """
+        if not self.use_numpy:
+            return [bin(self.bit_matches(skills, slots)).count('1')
+                    for skills, slots in requirements]
+        counts = []
+        for i in xrange(0, len(requirements), CHUNK):
+            found = self.packed_matches(requirements[i:i + CHUNK])
+            counts.extend(int(count) for count in POPCOUNT[found].sum(axis=1))
+        return counts
+
+def aliases(session):
+    """ Return the normalised names of skills by their aliases
+    """
+    return dict((alias, stats.skill_key(name)) for alias, name in session.query(
+        models.SkillAlias.name_key, models.Skill.name).filter(
+        models.SkillAlias.skill_id == models.Skill.id))
+
+def parse_requirement(skills, slots, aliases=None):
+    """ Return (skill keys, slot keys) of skill names and slot texts,
+        aliases, from aliases(), given as the names of their skills
+    """
+    keys = [stats.skill_key(skill) for skill in skills]
+    return ([(aliases or {}).get(key, key) for key in keys],
+            [key for slot in slots for key in slot_keys(slot)])
+
+def read_requirements(fh):
+    """ Yield (name, skills, slots) of CSV rows with name, skills and slots
+        columns, skills and slots separated by ;
+    """
+    for row in csv.DictReader(fh):
+        missing = [key for key in COVERAGE_KEYS[:3] if key not in row]
+        if missing:
+            raise MatchError, "Requirements need %s columns" % ', '.join(missing)
+        split = lambda text: [part.strip() for part in (text or '').split(';') if part.strip()]
+        yield row['name'], split(row['skills']), split(row['slots'])
+
+def main(args):
+    """
+Find parents with every skill, free in every time slot, an activity needs.
+
+  Skills are found by normalised name or alias (see skillsdb skills).  Slots
+  are a day and AM or PM, or a day alone for all day.  List parents
+  meeting one requirement with --skill and --slot, or count parents meeting
+  each requirement of a CSV file (name, skills and slots columns, with skills
+  and slots separated by ;) with --coverage.
+
+  --near limits matches to parents living within --miles of a postcode (see
+  skillsdb near).
+
+  NumPy, when installed, matches many requirements at once.
+
+  --explain prints the SQL and query plans of the queries loading the match,
+  instead of its results (see skillsdb manage).
+
+  skillsdb match --skill "first aid" --slot "Friday PM"
+  skillsdb match --skill woodwork --near "CB21 4EE" --miles 3
+  skillsdb match --skill woodwork --skill painting --slot Saturday --format csv
+  skillsdb match --coverage activities.csv --format table
+  skillsdb match --skill woodwork --near "CB21 4EE" --explain
+    """
+    if not (args.skill or args.slot or args.coverage):
+        raise MatchError, "Give --skill, --slot or --coverage requirements"
+    session_config = utils.load_config(args.config, args.tenant)
+    session = session_config.get_session(readonly=True)
+    recorder = explain.Recorder(session.get_bind(), args.explain)
+    with recorder:
+        parent_ids, skills, slots = load(session)
+        if args.near:
+            near = geo.parents_near(session.connection(), args.near, args.miles)
+            parent_ids = [id for id in parent_ids if id in near]
+        matcher = Matcher(parent_ids, skills, slots, engine=args.engine)
+        names = aliases(session)
+        if not args.coverage:
+            ids = matcher.match(*parse_requirement(args.skill or [], args.slot or [], names))
+            parents = models.Parent.get_many(session, ids)
+    if recorder.enabled:
+        explain.write(session.connection(), recorder.statements)
+        session.close()
+        return 0
+
+    if args.coverage:
+        with open(args.coverage, 'rb') as fh:
+            rows = list(read_requirements(fh))
+        counts = matcher.coverage([parse_requirement(skills, slots, names)
+                                   for name, skills, slots in rows])
+        writer = formats.RecordWriter(args.format, COVERAGE_KEYS)
+        for (name, skills, slots), count in zip(rows, counts):
+            writer.write(zip(COVERAGE_KEYS, [name, '; '.join(skills), '; '.join(slots), count]))
+    else:
+        writer = formats.RecordWriter(args.format, KEYS)
+        for id in ids:
+            writer.write(formats.record_to_dict(parents[id], KEYS))
+    writer.close()
+    session.close()
+    log.info('%s results' % writer.count)
+    return 0
@@ -2,6 +2,8 @@
 Object relational mapping configuration - Declarative
 =====================================================
 """
+import os
+import re
 import base64
 import datetime
 
@@ -10,11 +12,16 @@ from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import sessionmaker, relationship, backref
 from sqlalchemy import (Table, Column, Integer, String, ForeignKey,
                         DateTime, Time)
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, StaticPool
+from sqlalchemy.ext import baked
 import sqlalchemy as sa
 
 metadata = sa.MetaData()
 Base = declarative_base(metadata=metadata)
+# Compiled lookup queries, shared by every session of the process
+bakery = baked.bakery()
+# IN lists of get_many are split into chunks of this many IDs
+CHUNK = 500
 TODAY = datetime.datetime.today().date()
 TIME_AM_START = datetime.datetime.combine(TODAY, datetime.time(9, 0))
 TIME_AM_END = datetime.datetime.combine(TODAY, datetime.time(12, 0))
@@ -24,22 +31,22 @@ TIME_PM_END = datetime.datetime.combine(TODAY, datetime.time(17, 0))
 # parent <--> skill :: many to many relationship  interim table
 parent_skill = Table('parent_skill', Base.metadata,
         Column('id', Integer, primary_key=True),
-        Column('parent_id', Integer, ForeignKey('parent.id')),
-        Column('skill_id', Integer, ForeignKey('skill.id'))
+        Column('parent_id', Integer, ForeignKey('parent.id', ondelete='CASCADE'), index=True),
+        Column('skill_id', Integer, ForeignKey('skill.id', ondelete='CASCADE'), index=True)
 )
 
 # parent <--> freetime :: many to many relationship  interim table
 parent_freetime = Table('parent_freetime', Base.metadata,
         Column('id', Integer, primary_key=True),               
-        Column('parent_id', Integer, ForeignKey('parent.id')),
-        Column('freetime_id', Integer, ForeignKey('freetime.id'))
+        Column('parent_id', Integer, ForeignKey('parent.id', ondelete='CASCADE')),
+        Column('freetime_id', Integer, ForeignKey('freetime.id', ondelete='CASCADE'))
 )
 
 # parent <--> child :: many to many relationship  interim table
 parent_child = Table('parent_child', Base.metadata,
         Column('id', Integer, primary_key=True),            
-        Column('parent_id', Integer, ForeignKey('parent.id')),
-        Column('child_id', Integer, ForeignKey('child.id'))
+        Column('parent_id', Integer, ForeignKey('parent.id', ondelete='CASCADE')),
+        Column('child_id', Integer, ForeignKey('child.id', ondelete='CASCADE'))
 )
 
 # Generic objects
@@ -56,7 +63,10 @@ class DbMixin(object):
     __table_args__ = {'mysql_engine': 'InnoDB'}
     __mapper_args__= {'always_refresh': True}
 
-    created = Column(DateTime, default=datetime.datetime.now())
+    # Defaults are called as each record is written
+    created = Column(DateTime, default=datetime.datetime.now)
+    updated = Column(DateTime, default=datetime.datetime.now,
+                     onupdate=datetime.datetime.now, index=True)
 
     def __repr__(self):
         return "%s" % self.__class__
@@ -72,6 +82,34 @@ class DbMixin(object):
     def classname(cls):
         return cls.__name__.lower()
 
+    @classmethod
+    def get(cls, session, id):
+        """ Return the record with primary key id, or None
+            Records already in the session are returned without a query
+        """
+        return bakery(lambda s: s.query(cls), cls)(session).get(id)
+
+    @classmethod
+    def get_many(cls, session, ids):
+        """ Return a dict of the records with primary keys ids, by ID
+            IDs without a record are left out
+        """
+        records = {}
+        missing = []
+        for id in set(ids):
+            key = sa.orm.util.identity_key(cls, id)
+            if key in session.identity_map:
+                records[id] = session.identity_map[key]
+            else:
+                missing.append(id)
+
+        query = bakery(lambda s: s.query(cls), cls)
+        query += lambda q: q.filter(cls.id.in_(sa.bindparam('ids', expanding=True)))
+        for i in xrange(0, len(missing), CHUNK):
+            for record in query(session).params(ids=missing[i:i + CHUNK]):
+                records[record.id] = record
+        return records
+
 class PersonMixin(object):
     """ Attributes for a generic person object (parent / child)
     """
@@ -87,10 +125,22 @@ class PersonMixin(object):
 
 class RefParentMixin(object):
     """ All classes need a parent ID for relationship refs.
+        Records owned by a parent are deleted with it, unless the class
+        sets parent_ondelete to keep them.
     """
+    parent_ondelete = 'CASCADE'
+
     @declared_attr
     def parent_id(cls):
-        return Column('parent_id', ForeignKey('parent.id'))
+        return Column('parent_id', ForeignKey('parent.id', ondelete=cls.parent_ondelete))
+
+    @classmethod
+    def get_by_parent_id(cls, session, parent_id):
+        """ Return the record referring to parent parent_id, or None
+        """
+        query = bakery(lambda s: s.query(cls), cls)
+        query += lambda q: q.filter(cls.parent_id == sa.bindparam('parent_id'))
+        return query(session).params(parent_id=parent_id).one_or_none()
 
    
 #===========================
@@ -103,12 +153,58 @@ class Params(DbMixin, Base):
     user = Column(String(50))
     passwd = Column(String(50))
 
+    @classmethod
+    def load(cls, session):
+        """ Return the stored database parameters, or None
+        """
+        return bakery(lambda s: s.query(cls), cls)(session).one_or_none()
+
+def skill_key(name):
+    """ Normalised skill name, lower case words of letters and digits
+        ' First-Aid' -> 'first aid'
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', (name or '').lower()))[:100]
+
 class Skill(DbMixin, RefParentMixin, Base):
-    """ Skill of parent
+    """ Skill of the vocabulary, linked to parents through parent_skill
+        Skills of earlier versions were each owned by a parent (parent_id)
+        name_key is the normalised name, kept up to date as names change
     """
     id =  Column(Integer, primary_key=True)
     name = Column(String(100))
+    name_key = Column(String(100), index=True)
     parents = relationship('Parent', secondary=parent_skill, backref='skills')
+
+    @staticmethod
+    def derived(values):
+        """ Return columns derived from column values being written
+        """
+        if 'name' in values:
+            return {'name_key':skill_key(values['name'])}
+        return {}
+
+@sa.event.listens_for(Skill, 'before_insert')
+@sa.event.listens_for(Skill, 'before_update')
+def set_name_key(mapper, connection, target):
+    target.name_key = skill_key(target.name)
+
+class SkillAlias(DbMixin, Base):
+    """ Another name of a skill of the vocabulary, by normalised name
+    """
+    id = Column(Integer, primary_key=True)
+    name_key = Column(String(100), nullable=False, unique=True)
+    skill_id = Column(Integer, ForeignKey('skill.id', ondelete='CASCADE'), nullable=False)
+    skill = relationship('Skill', backref=backref('aliases', passive_deletes=True))
+
+class SkillGram(DbMixin, Base):
+    """ Weight of a character n-gram of a skill's name and aliases, in
+        the similar skills index. updated is when the skill was indexed
+    """
+    id = Column(Integer, primary_key=True)
+    gram = Column(String(10), nullable=False, index=True)
+    skill_id = Column(Integer, ForeignKey('skill.id', ondelete='CASCADE'), nullable=False,
+                      index=True)
+    weight = Column(sa.Float, nullable=False)
     
 class Freetime(DbMixin, RefParentMixin, Base):
     """ Time when parent is available
@@ -146,6 +242,9 @@ class Parent(PersonMixin, RefParentMixin, DbMixin, Base):
     """ Parent object
     """
     id =  Column(Integer, primary_key=True)
+    household_id = Column(Integer, index=True)
+    # parent_id is the partner
+    parent_ondelete = 'SET NULL'
     partner = relationship('Parent', uselist=False, remote_side=[id],
                            backref=backref('other', uselist=False))
 
@@ -159,6 +258,10 @@ class Address(DbMixin, RefParentMixin, Base):
     city = Column(String(50))
     postcode = Column(String(50))
     country = Column(String(50), default='UK')
+    # Centroid of the postcode, and its geohash cell, set by geo
+    latitude = Column(sa.Float)
+    longitude = Column(sa.Float)
+    grid = Column(String(12), index=True)
 
     home_telephone = Column(String(50))
     mobile_telephone = Column(String(50))
@@ -173,22 +276,173 @@ class Address(DbMixin, RefParentMixin, Base):
         return '\n'.join(map(str,[self.line01, self.line02, self.village,
                           self.city, self.postcode, self.country]))
 
+class Postcode(DbMixin, Base):
+    """ Centroid of a postcode, loaded from a postcode directory
+        key is the postcode in upper case without spaces
+    """
+    id = Column(Integer, primary_key=True)
+    key = Column(String(10), nullable=False, unique=True)
+    latitude = Column(sa.Float, nullable=False)
+    longitude = Column(sa.Float, nullable=False)
+
 class Child(PersonMixin, RefParentMixin, DbMixin, Base):
     """ Child object
     """
     id =  Column(Integer, primary_key=True)
+    year = Column(Integer, index=True)
+    household_id = Column(Integer, index=True)
+    # Children belong to both parents through parent_child
+    parent_ondelete = 'SET NULL'
     
     parents = relationship('Parent', secondary=parent_child, backref='children')
     
+class SavedSearch(DbMixin, Base):
+    """ Search for parents with skills, free in time slots (each ; separated)
+        Its matches are kept in SavedMatch. refreshed is when they were
+        brought up to date, checked when new matches were last listed
+    """
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+    skills = Column(String(200))
+    slots = Column(String(200))
+    refreshed = Column(DateTime)
+    checked = Column(DateTime)
+
+class SavedMatch(DbMixin, Base):
+    """ Parent matching a saved search, since created
+    """
+    id = Column(Integer, primary_key=True)
+    search_id = Column(Integer, ForeignKey('savedsearch.id', ondelete='CASCADE'),
+                       nullable=False, index=True)
+    parent_id = Column(Integer, ForeignKey('parent.id', ondelete='CASCADE'), nullable=False,
+                       index=True)
+
+    __table_args__ = (sa.UniqueConstraint('search_id', 'parent_id'),
+                      DbMixin.__table_args__)
+
+class Statistic(DbMixin, Base):
+    """ Count of records by kind (skill, freetime, postcode, parent) and key
+        Kept up to date as records are flushed
+    """
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)
+    key = Column(String(100), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (sa.UniqueConstraint('kind', 'key'),
+                      DbMixin.__table_args__)
+
+class Tombstone(DbMixin, Base):
+    """ Record of a deleted record, for change feeds
+        updated is the time of deletion
+    """
+    id = Column(Integer, primary_key=True)
+    tablename = Column(String(50), nullable=False)
+    record_id = Column(Integer, nullable=False)
+
 ##===================
 ## Database functions
 ##===================
-CONNECTORS = {'mysql':'mysql://', 'sqlite':'sqlite:///'}
+CONNECTORS = {'mysql':'mysql://', 'sqlite':'sqlite:///', 'memory':'sqlite://'}
+
+TENANT_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+# Session factories of engines opened by this process, by connection settings
+ENGINES = {}
+# Databases whose schema this process has created or upgraded, by URL
+UPGRADED = set()
+
+class UpgradeError(Exception):pass
+
+# Allowed values of SQLite pragmas set on connect, int for numeric pragmas
+SQLITE_PRAGMAS = {'journal_mode':['delete', 'truncate', 'persist', 'memory', 'wal', 'off'],
+                  'synchronous':['off', 'normal', 'full', 'extra'],
+                  'temp_store':['default', 'file', 'memory'],
+                  'query_only':['on', 'off'], 'foreign_keys':['on', 'off'],
+                  'cache_size':int, 'mmap_size':int, 'busy_timeout':int}
+
+def sqlite_pragmas(**pragmas):
+    """ Return a connect event listener setting the given SQLite pragmas
+    """
+    statements = []
+    for key, value in sorted(pragmas.iteritems()):
+        allowed = SQLITE_PRAGMAS.get(key)
+        if allowed is None:
+            raise ValueError, "%s is not a supported SQLite pragma" % key
+        if allowed is int:
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError, "%s pragma must be an integer, not %s" % (key, value)
+        else:
+            value = str(value).lower()
+            if value not in allowed:
+                raise ValueError, "%s is not a valid %s. Choose from %s" % (
+                    value, key, ', '.join(allowed))
+        statements.append('PRAGMA %s = %s' % (key, value))
+
+    def set_pragmas(dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    return set_pragmas
+
+def foreign_keys(conn, enforce):
+    """ Turn enforcing foreign keys, and their ON DELETE actions, on or off
+        SQLite ignores the pragma inside a transaction, so call it first.
+        SQLite connections are not pooled, so they are not turned back on
+    """
+    if conn.dialect.name == 'sqlite' and not enforce:
+        conn.execute('PRAGMA foreign_keys = OFF')
+    elif conn.dialect.name == 'mysql':
+        conn.execute('SET FOREIGN_KEY_CHECKS = %s' % int(enforce))
+
+def is_memory(engine):
+    """ True if engine is of an in memory SQLite database
+    """
+    return engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:')
+
+def same_database(a, b):
+    """ True if engines a and b are of the same database. Every memory
+        database has the same URL, and only its own engine
+    """
+    if is_memory(a) or is_memory(b):
+        return a is b
+    return a.url == b.url
+
+def enforce_foreign_keys(conn):
+    conn.execute('PRAGMA foreign_keys = ON')
+
 def init(uri, **kwargs):
     """ Initialize connection to database or create new
         Determine appropriate interpreters given input
         Defaults to local sqlite database
+
+        SQLite pragmas (journal_mode, synchronous, cache_size, mmap_size,
+        busy_timeout, temp_store) given as pragmas={} are set on every connection.
+        SQLite foreign keys are enforced unless pragmas sets foreign_keys off.
+
+        readonly=True returns a session for searches. SQLite connections are
+        opened query only, so with a WAL journal they never wait on writers.
+        The first read only session of a database in a process creates or
+        upgrades its schema through a separate, writable connection.
+
+        tenant='name' routes the session to that tenant's own database,
+        created on MySQL servers if it does not exist yet.
+
+        dbtype='memory' keeps the database in memory for the life of the
+        process (or until dispose), one database per path and uri. Its
+        sessions, read only or not, share a single connection, so use it
+        from one thread, for tests and throwaway what-if copies.
+
+        Engines are kept for the life of the process, so a process serving
+        many tenants reuses one pool per database.
     """
+    readonly = kwargs.get('readonly', False)
+    tenant = kwargs.get('tenant')
+    if tenant:
+        uri = tenant_dbname(uri, tenant)
     path = kwargs['path']
     dbtype = kwargs['dbtype']
     user = kwargs['user']
@@ -211,14 +465,129 @@ def init(uri, **kwargs):
         
         if dbtype == 'sqlite':
             dburl = begstring + path + '/' + uri
+        elif dbtype == 'memory':
+            dburl = begstring
         else:
             dburl = dburl + '/' + uri
 
-    engine = sa.create_engine(dburl, echo=False, poolclass=NullPool)
-    metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
+    pragmas = dict(kwargs.get('pragmas') or {})
+    if dbtype in ['sqlite', 'memory']:
+        # Enforce foreign keys, and their ON DELETE actions
+        pragmas.setdefault('foreign_keys', 'on')
+    if dbtype == 'sqlite' and readonly:
+        pragmas['query_only'] = 'on'
+
+    key = (dburl, readonly, tuple(sorted(pragmas.iteritems())))
+    if dbtype == 'memory':
+        # A memory database lives in its one connection, shared by every session
+        key = (dburl, path, uri, tuple(sorted(pragmas.iteritems())))
+        readonly = False
+    if key not in ENGINES:
+        if dbtype == 'memory':
+            engine = sa.create_engine(dburl, echo=False, poolclass=StaticPool,
+                                      connect_args={'check_same_thread':False})
+            sa.event.listen(engine, 'connect', sqlite_pragmas(**pragmas))
+            # Turned off by bulk loads, and not reset by opening a connection
+            if pragmas['foreign_keys'] == 'on':
+                sa.event.listen(engine, 'begin', enforce_foreign_keys)
+        elif dbtype == 'sqlite':
+            engine = sa.create_engine(dburl, echo=False, poolclass=NullPool)
+            if pragmas:
+                sa.event.listen(engine, 'connect', sqlite_pragmas(**pragmas))
+        else:
+            if dbtype == 'mysql' and tenant and not readonly:
+                create_database(begstring + midstring, uri)
+            engine = sa.create_engine(dburl, echo=False, pool_recycle=3600)
+        if not readonly:
+            metadata.create_all(engine)
+            upgrade(engine)
+        elif dburl not in UPGRADED:
+            upgrade_readonly(dburl, dbtype, pragmas)
+        UPGRADED.add(dburl)
+        ENGINES[key] = sessionmaker(bind=engine)
+    Session = ENGINES[key]
     return Session()
 
+def upgrade_readonly(dburl, dbtype, pragmas):
+    """ Create or upgrade the schema of a database opened read only,
+        through a writable connection
+    """
+    engine = sa.create_engine(dburl, echo=False, poolclass=NullPool)
+    if dbtype == 'sqlite':
+        pragmas = dict((key, value) for key, value in pragmas.iteritems()
+                       if key != 'query_only')
+        sa.event.listen(engine, 'connect', sqlite_pragmas(**pragmas))
+    try:
+        metadata.create_all(engine)
+        upgrade(engine)
+    except sa.exc.OperationalError, e:
+        raise UpgradeError, ("The database schema is from an earlier version and could not "
+                             "be upgraded (%s). Run a write command, such as skillsdb "
+                             "manage --add, with write access first" % e.orig)
+    finally:
+        engine.dispose()
+
+def upgrade(engine):
+    """ Add columns and indexes missing from tables created by an
+        earlier version. New columns are nullable, so existing rows are
+        left with NULL values, except updated, which is set to created.
+    """
+    inspector = sa.inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = [col['name'] for col in inspector.get_columns(table.name)]
+        backfill = False
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table.name, column.name, column.type.compile(dialect=engine.dialect)))
+            # Records not updated since they were created
+            if column.name == 'updated' and 'created' in columns:
+                engine.execute(table.update().values(updated=table.c.created))
+            # Normalised names of existing skills, leaving updated as it was
+            if column.name == 'name_key' and table.name == 'skill':
+                backfill = True
+        if backfill:
+            rows = [{'_id':id, 'key':skill_key(name)} for id, name in
+                    engine.execute(sa.select([table.c.id, table.c.name]))]
+            if rows:
+                engine.execute(table.update().where(table.c.id == sa.bindparam('_id')).values(
+                    name_key=sa.bindparam('key'), updated=table.c.updated), rows)
+        indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+
+def create_database(server_url, name):
+    """ Create the MySQL database name, if it does not exist, through a
+        connection to the server
+    """
+    engine = sa.create_engine(server_url, echo=False, poolclass=NullPool)
+    try:
+        engine.execute('CREATE DATABASE IF NOT EXISTS `%s`' % name.replace('`', '``'))
+    finally:
+        engine.dispose()
+
+def tenant_dbname(uri, tenant):
+    """ Return the database name of a tenant, derived from the base
+        database name: skillsdb.sqlite -> skillsdb_tenant.sqlite
+    """
+    if not TENANT_NAME.match(tenant):
+        raise ValueError, "%s is not a valid tenant name. Use letters, digits and _" % tenant
+    base, ext = os.path.splitext(uri)
+    return base + '_' + tenant + ext
+
+def dispose():
+    """ Close all engines opened by this process
+    """
+    for Session in ENGINES.values():
+        Session.kw['bind'].dispose()
+    ENGINES.clear()
+    UPGRADED.clear()
+
 def drop_db(x, host='beast', user='ir210', passwd='', dbtype='mysql', echo=False):
     """ Drop the database and start again
     """
@@ -0,0 +1,269 @@
+"""
+Saved searches
+==============
+Searches asked every week ("parents with cooking, free on Friday") are
+saved by name, with the parents they match kept in the savedmatch table,
+each from the time it began to match.
+
+Matches are brought up to date before saved searches are read, from the
+records changed since they last were: parents updated since then
+(including links to skills and freetimes, which stamp the parent), and
+parents owning or linked to skills and freetimes updated since then.
+Only those parents are evaluated against each saved search. Skills and
+freetimes deleted, or moving to another parent, can only take matches
+away, so then the parents already matched are evaluated too. A search
+new or rebuilt is matched against every parent, as by skillsdb match.
+
+Requirements are as skillsdb match: skills by normalised name or alias,
+and slots of a day and AM or PM, or a day alone for all day. Searches are
+matched against every parent again when aliases change.
+"""
+import datetime
+import collections
+
+import sqlalchemy as sa
+
+import utils
+import models
+import stats
+import match
+import changes
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+KEYS = ['name', 'skills', 'slots', 'matches', 'new', 'checked']
+MATCH_KEYS = ['search', 'matched', 'id', 'first_name', 'second_name']
+# Changes written by transactions committing after a refresh may carry
+# earlier times, so parents changed this long before it are evaluated again
+SKEW = changes.OVERLAP
+BATCH_SIZE = 1000
+
+class SavedError(Exception):pass
+
+def split(text):
+    """ Return the parts of a ; separated list
+    """
+    return [part.strip() for part in (text or '').split(';') if part.strip()]
+
+def requirement(search, aliases=None):
+    """ Return (skill keys, slot keys) of a saved search
+    """
+    return match.parse_requirement(split(search.skills), split(search.slots), aliases)
+
+def get(session, name):
+    """ Return the saved search named name
+    """
+    search = session.query(models.SavedSearch).filter_by(name=name).one_or_none()
+    if search is None:
+        raise SavedError, "No saved search named %s" % name
+    return search
+
+def add(session, name, skills, slots):
+    """ Save a search of parents with every one of skills, free in every
+        one of slots, and match it. Returns the search
+    """
+    if not (skills or slots):
+        raise SavedError, "Give skills or slots to search for"
+    if session.query(models.SavedSearch).filter_by(name=name).count():
+        raise SavedError, "A search named %s is already saved" % name
+    search = models.SavedSearch(name=name, skills='; '.join(skills), slots='; '.join(slots))
+    try:
+        requirement(search)
+    except match.MatchError, e:
+        raise SavedError, str(e)
+    session.add(search)
+    session.commit()
+    refresh(session)
+    return search
+
+def changed_parents(conn, since):
+    """ Return (IDs of parents changed at or after since, True if skills
+        or freetimes changed or were deleted)
+    """
+    p = models.Parent.__table__
+    s = models.Skill.__table__
+    f = models.Freetime.__table__
+    ps = models.parent_skill
+    pf = models.parent_freetime
+    t = models.Tombstone.__table__
+    ids = set(row[0] for row in conn.execute(sa.select([p.c.id]).where(p.c.updated >= since)))
+    records = False
+    for table, link, column in [(s, ps, ps.c.skill_id), (f, pf, pf.c.freetime_id)]:
+        owners = conn.execute(sa.select([table.c.parent_id]).where(
+            table.c.updated >= since)).fetchall()
+        records = records or bool(owners)
+        ids.update(row[0] for row in owners)
+        ids.update(row[0] for row in conn.execute(sa.select([link.c.parent_id]).where(
+            column == table.c.id).where(table.c.updated >= since)))
+    tombstones = set(tuple(row) for row in conn.execute(
+        sa.select([t.c.tablename, t.c.record_id]).where(t.c.updated >= since)))
+    ids.update(id for name, id in tombstones if name == models.Parent.classname)
+    records = records or any(name in [models.Skill.classname, models.Freetime.classname]
+                             for name, id in tombstones)
+    ids.discard(None)
+    return ids, records
+
+def profiles(conn, parent_ids):
+    """ Return (skill keys by parent ID, slots by parent ID) of parents
+    """
+    s = models.Skill.__table__
+    f = models.Freetime.__table__
+    ps = models.parent_skill
+    pf = models.parent_freetime
+    times = [f.c[key] for key in stats.FREETIME_KEYS]
+    skills = collections.defaultdict(set)
+    slots = collections.defaultdict(set)
+    for chunk in stats.chunks(sorted(parent_ids)):
+        for query in [sa.select([s.c.parent_id, s.c.name]).where(s.c.parent_id.in_(chunk)),
+                      sa.select([ps.c.parent_id, s.c.name]).where(
+                          ps.c.skill_id == s.c.id).where(ps.c.parent_id.in_(chunk))]:
+            for parent_id, name in conn.execute(query):
+                skills[parent_id].add(stats.skill_key(name))
+        for query in [sa.select([f.c.parent_id] + times).where(f.c.parent_id.in_(chunk)),
+                      sa.select([pf.c.parent_id] + times).where(
+                          pf.c.freetime_id == f.c.id).where(pf.c.parent_id.in_(chunk))]:
+            for row in conn.execute(query):
+                slots[row[0]].update(match.freetime_slots(*row[1:]))
+    return skills, slots
+
+def store(conn, search_id, matching, scope=None):
+    """ Record parents matching a search, of parents scope (every parent
+        if None). Returns (matches added, matches removed)
+    """
+    m = models.SavedMatch.__table__
+    current = set(row[0] for row in conn.execute(
+        sa.select([m.c.parent_id]).where(m.c.search_id == search_id)))
+    if scope is not None:
+        current &= scope
+    added = sorted(matching - current)
+    removed = sorted(current - matching)
+    now = datetime.datetime.now()
+    rows = [{'search_id':search_id, 'parent_id':id, 'created':now, 'updated':now}
+            for id in added]
+    for i in xrange(0, len(rows), BATCH_SIZE):
+        conn.execute(m.insert(), rows[i:i + BATCH_SIZE])
+    for chunk in stats.chunks(removed):
+        conn.execute(m.delete().where(m.c.search_id == search_id).where(
+            m.c.parent_id.in_(chunk)))
+    return len(added), len(removed)
+
+def refresh(session, rebuild=False):
+    """ Bring the matches of saved searches up to date, evaluating
+        parents changed since they last were, or every parent for new
+        searches and with rebuild, and commit. Returns the number of
+        matches added and removed
+    """
+    conn = session.connection()
+    now = datetime.datetime.now()
+    searches = session.query(models.SavedSearch).order_by(models.SavedSearch.id).all()
+    a = models.SkillAlias.__table__
+    refreshed = [search.refreshed for search in searches if search.refreshed is not None]
+    if refreshed and conn.execute(sa.select([sa.func.count(a.c.id)]).where(
+            a.c.updated >= min(refreshed) - SKEW)).scalar():
+        # Skills of searches may be named differently
+        rebuild = True
+    names = match.aliases(session)
+    full = [search for search in searches if rebuild or search.refreshed is None]
+    partial = [search for search in searches if search not in full]
+    changed = 0
+
+    if full:
+        matcher = match.Matcher(*match.load(session))
+        for search in full:
+            changed += sum(store(conn, search.id,
+                                 set(matcher.match(*requirement(search, names)))))
+
+    if partial:
+        since = min(search.refreshed for search in partial) - SKEW
+        parent_ids, records = changed_parents(conn, since)
+        if records:
+            m = models.SavedMatch.__table__
+            parent_ids.update(row[0] for row in conn.execute(sa.select([m.c.parent_id]).where(
+                m.c.search_id.in_([search.id for search in partial]))))
+        skills, slots = profiles(conn, parent_ids)
+        for search in partial:
+            skill_keys, slot_keys = requirement(search, names)
+            matching = set(id for id in parent_ids if skills[id].issuperset(skill_keys)
+                           and slots[id].issuperset(slot_keys))
+            changed += sum(store(conn, search.id, matching, parent_ids))
+        log.debug('Evaluated %s changed parents' % len(parent_ids))
+
+    for search in searches:
+        search.refreshed = now
+    session.commit()
+    return changed
+
+def matches(session, search, new=False):
+    """ Return [(matched, parent)] of a search, oldest first, or only
+        those matched since new matches were last checked
+    """
+    query = session.query(models.SavedMatch.created, models.Parent).join(
+        models.Parent, models.Parent.id == models.SavedMatch.parent_id).filter(
+        models.SavedMatch.search_id == search.id)
+    if new and search.checked:
+        query = query.filter(models.SavedMatch.created >= search.checked)
+    return query.order_by(models.SavedMatch.created, models.Parent.id).all()
+
+def main(args):
+    """
+Save searches for parents with skills and free time, and list new matches.
+
+  Saved searches are matched as skillsdb match, and their matches are kept up
+  to date by evaluating only the parents, skills and free times changed since
+  they were last read.
+
+  --add saves a search of NAME for parents with every --skill, free in every
+  --slot.  NAME alone lists the parents it matches, --new only those matched
+  since new matches were last listed (of every search, without NAME).  Without
+  NAME, saved searches are listed with counts of matches and new matches.
+  --rebuild matches every search against every parent again.
+
+  skillsdb saved "Friday cooks" --add --skill cooking --slot Friday
+  skillsdb saved "Friday cooks"
+  skillsdb saved --new
+  skillsdb saved
+  skillsdb saved "Friday cooks" --delete
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    session = session_config.get_session()
+    if args.add:
+        if not args.name:
+            raise SavedError, "Give the NAME of the search to save"
+        search = add(session, args.name, args.skill or [], args.slot or [])
+        log.info('Saved %s, matching %s parents' % (search.name, len(matches(session, search))))
+        session.close()
+        return 0
+    if args.delete:
+        if not args.name:
+            raise SavedError, "Give the NAME of the search to delete"
+        session.delete(get(session, args.name))
+        session.commit()
+        session.close()
+        return 0
+
+    log.info('%s matches changed' % refresh(session, args.rebuild))
+    now = datetime.datetime.now()
+    if args.name or args.new:
+        searches = [get(session, args.name)] if args.name else session.query(
+            models.SavedSearch).order_by(models.SavedSearch.name).all()
+        writer = formats.RecordWriter(args.format, MATCH_KEYS)
+        for search in searches:
+            for matched, parent in matches(session, search, args.new):
+                writer.write(zip(MATCH_KEYS, [search.name, matched, parent.id,
+                                              parent.first_name, parent.second_name]))
+            if args.new:
+                search.checked = now
+        session.commit()
+    else:
+        m = models.SavedMatch
+        writer = formats.RecordWriter(args.format, KEYS)
+        for search in session.query(models.SavedSearch).order_by(models.SavedSearch.name):
+            query = session.query(sa.func.count(m.id)).filter(m.search_id == search.id)
+            new = query.filter(m.created >= search.checked) if search.checked else query
+            writer.write(zip(KEYS, [search.name, search.skills, search.slots, query.scalar(),
+                                    new.scalar(), search.checked]))
+    writer.close()
+    session.close()
+    return 0
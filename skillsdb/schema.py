@@ -0,0 +1,126 @@
+"""
+Input schemas
+=============
+Keys and values given to manage, in searches and in imported files are
+checked against the schema of their model, built from its mapper once
+per process: the keys of its columns, and a coercer per column turning
+text into a value of the column's type.
+
+    Integer     whole numbers, '6'
+    Float       numbers, '52.2'
+    DateTime    times of today, hh:mm, or dates, YYYY-MM-DD [hh:mm[:ss]]
+    String(n)   text of at most n characters
+
+Blank values of columns other than strings are None.
+"""
+import datetime
+
+import sqlalchemy as sa
+
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Columns set by the database, not given with new records
+GENERATED = ['id', 'created', 'updated']
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+# Schemas by model, built on first use
+SCHEMAS = {}
+
+class SchemaError(Exception):pass
+
+def parse_time(text):
+    """ Return the datetime of today at text, hh:mm
+    """
+    h, sep, m = text.partition(':')
+    if not sep or len(text) > 5:
+        raise ValueError, 'Input times must be hh:mm format'
+    today = datetime.datetime.today().date()
+    return datetime.datetime.combine(today, datetime.time(int(h), int(m)))
+
+def parse_datetime(text):
+    """ Return the datetime of text, a time of today or a date
+    """
+    if len(text) <= 5:
+        return parse_time(text)
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, format)
+        except ValueError:
+            pass
+    raise ValueError, 'Input dates must be YYYY-MM-DD [hh:mm[:ss]] format'
+
+def string(column):
+    length = column.type.length
+
+    def coerce(text):
+        if length is not None and len(text) > length:
+            raise ValueError, 'longer than %s characters' % length
+        return text
+    return coerce
+
+def blank_none(coerce):
+    def coerce_blank(text):
+        if text == '':
+            return None
+        return coerce(text)
+    return coerce_blank
+
+# Coercers by column type, the first the column's type is an instance of
+COERCERS = [(sa.Integer, lambda column: blank_none(int)),
+            (sa.Float, lambda column: blank_none(float)),
+            (sa.DateTime, lambda column: blank_none(parse_datetime)),
+            (sa.String, string)]
+
+def coercer(column):
+    """ Return a function converting text to a value of column
+    """
+    for type_, factory in COERCERS:
+        if isinstance(column.type, type_):
+            return factory(column)
+    return lambda text: text
+
+class Schema(object):
+    """ Column keys of a model, and a coercer per column
+    """
+    def __init__(self, table):
+        self.table = table
+        self.coercers = {}
+        for attr in sa.inspect(table).column_attrs:
+            self.coercers[attr.key] = coercer(attr.columns[0])
+        self.keys = frozenset(self.coercers)
+        self.writable = self.keys.difference(GENERATED)
+
+    def check(self, key, keys=None):
+        if key not in (self.keys if keys is None else keys):
+            raise SchemaError, "'%s' is not a valid key for table '%s'" % (
+                key, self.table.classname)
+
+    def coerce(self, key, value, keys=None):
+        """ Return value of column key converted to its type
+        """
+        self.check(key, keys)
+        try:
+            return self.coercers[key](value)
+        except ValueError, e:
+            raise SchemaError, "%s is not a valid value for %s: %s" % (value, key, e)
+
+    def values(self, pairs, keys=None):
+        """ Return a dict of (key, value) pairs, values converted to the
+            types of their columns. keys limits the keys allowed
+        """
+        values = {}
+        for key, value in pairs:
+            values[key] = self.coerce(key, value, keys)
+        return values
+
+def for_table(table):
+    """ Return the schema of model table
+    """
+    try:
+        return SCHEMAS[table]
+    except KeyError:
+        log.debug('Building schema of %s' % table.classname)
+        schema = SCHEMAS[table] = Schema(table)
+        return schema
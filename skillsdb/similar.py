@@ -0,0 +1,169 @@
+"""
+Similar skills
+==============
+Find skills whose names are spelt alike ("wood work", "woodworking",
+"woodwrk" for "woodwork"), for searches such as
+
+    skillsdb manage --search --skill name=woodwork,similar
+
+Each skill is a vector of the character trigrams of its normalised name
+and aliases, weighted by TF-IDF (trigrams shared by many skills count
+for little) and scaled to unit length. Vectors are stored as an inverted
+index, the skillgram table of (trigram, skill, weight) rows, so a search
+reads only the rows of the trigrams of the searched name and sums them
+by skill, in the database, for the cosine similarity of each skill that
+shares any trigram.
+
+Trigrams only see spelling. Skills of the same meaning spelt differently
+("carpentry" and "woodwork") are found by making one an alias of the
+other (skillsdb skills --alias), as aliases are indexed with the name.
+
+The index is brought up to date before searches, indexing skills and
+aliases updated since it was last written. Weights of skills indexed
+earlier keep the document frequencies of that time, so rebuild the index
+(skillsdb skills --reindex) after adding many skills.
+"""
+import math
+import datetime
+import collections
+
+import sqlalchemy as sa
+
+import models
+import stats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+N = 3
+# Skills returned by a search, and the lowest similarity of any
+TOP_K = 10
+MINIMUM = 0.3
+BATCH_SIZE = 1000
+
+class SimilarError(Exception):pass
+
+def grams(text):
+    """ Return counts of the character trigrams of the words of text,
+        each word padded with spaces: 'aid' -> ' ai', 'aid', 'id '
+    """
+    counts = collections.Counter()
+    for word in models.skill_key(text).split():
+        padded = ' %s ' % word
+        for i in xrange(len(padded) - N + 1):
+            counts[padded[i:i + N]] += 1
+    return counts
+
+def unit(weights):
+    """ Scale weights by gram to unit length
+    """
+    norm = math.sqrt(sum(w * w for w in weights.itervalues()))
+    return dict((gram, w / norm) for gram, w in weights.iteritems()) if norm else {}
+
+def documents(conn, skill_ids=None):
+    """ Return trigram counts of the name and aliases of skills, or of
+        every skill, by skill ID
+    """
+    s = models.Skill.__table__
+    a = models.SkillAlias.__table__
+    queries = [(sa.select([s.c.id, s.c.name_key]), s.c.id),
+               (sa.select([a.c.skill_id, a.c.name_key]), a.c.skill_id)]
+    docs = collections.defaultdict(collections.Counter)
+    for query, column in queries:
+        if skill_ids is None:
+            chunked = [query]
+        else:
+            chunked = [query.where(column.in_(chunk)) for chunk in stats.chunks(skill_ids)]
+        for query in chunked:
+            for id, key in conn.execute(query):
+                docs[id].update(grams(key))
+    return docs
+
+def frequencies(conn, vocabulary):
+    """ Return the number of indexed skills with each gram of vocabulary
+    """
+    g = models.SkillGram.__table__
+    df = collections.Counter()
+    for chunk in stats.chunks(vocabulary):
+        df.update(dict(conn.execute(sa.select([g.c.gram, sa.func.count(g.c.skill_id)]).where(
+            g.c.gram.in_(chunk)).group_by(g.c.gram)).fetchall()))
+    return df
+
+def stale(conn, since):
+    """ Return IDs of skills whose names or aliases changed at or after
+        since
+    """
+    s = models.Skill.__table__
+    a = models.SkillAlias.__table__
+    ids = set(row[0] for row in conn.execute(sa.select([s.c.id]).where(s.c.updated >= since)))
+    ids.update(row[0] for row in conn.execute(
+        sa.select([a.c.skill_id]).where(a.c.updated >= since)))
+    # Named skills never indexed, such as skills synced with older times
+    g = models.SkillGram.__table__
+    ids.update(row[0] for row in conn.execute(sa.select([s.c.id]).where(
+        s.c.name_key != '').where(~sa.exists().where(g.c.skill_id == s.c.id))))
+    return ids
+
+def refresh(session, rebuild=False):
+    """ Index skills changed since the index was written, or every skill
+        with rebuild, and commit. Returns the number of skills indexed
+    """
+    conn = session.connection()
+    g = models.SkillGram.__table__
+    s = models.Skill.__table__
+    indexed = conn.execute(sa.select([sa.func.max(g.c.updated)])).scalar()
+    if rebuild or indexed is None:
+        conn.execute(g.delete())
+        skill_ids = None
+    else:
+        skill_ids = stale(conn, indexed)
+        if not skill_ids:
+            return 0
+        for chunk in stats.chunks(skill_ids):
+            conn.execute(g.delete().where(g.c.skill_id.in_(chunk)))
+
+    docs = documents(conn, skill_ids)
+    total = conn.execute(sa.select([sa.func.count(s.c.id)])).scalar()
+    df = frequencies(conn, set(gram for doc in docs.itervalues() for gram in doc))
+    for doc in docs.itervalues():
+        df.update(doc.keys())
+
+    now = datetime.datetime.now()
+    rows = []
+    for id, doc in docs.iteritems():
+        weights = unit(dict((gram, (1 + math.log(tf)) * math.log(1.0 + float(total) / df[gram]))
+                            for gram, tf in doc.iteritems()))
+        rows.extend({'gram':gram, 'skill_id':id, 'weight':weight, 'created':now, 'updated':now}
+                    for gram, weight in weights.iteritems())
+    for i in xrange(0, len(rows), BATCH_SIZE):
+        conn.execute(g.insert(), rows[i:i + BATCH_SIZE])
+    session.commit()
+    log.debug('Indexed %s skills' % len(docs))
+    return len(docs)
+
+def query(text, k=TOP_K, minimum=MINIMUM):
+    """ Return a select of (skill ID, similarity) of the k skills most
+        similar to text, most similar first
+    """
+    weights = unit(dict((gram, 1 + math.log(tf)) for gram, tf in grams(text).iteritems()))
+    if not weights:
+        raise SimilarError, "%r has no letters or digits to compare" % text
+    g = models.SkillGram.__table__
+    score = sa.func.sum(g.c.weight * sa.case(weights, value=g.c.gram, else_=0.0))
+    return sa.select([g.c.skill_id, score.label('score')]).where(
+        g.c.gram.in_(weights)).group_by(g.c.skill_id).having(score >= minimum).order_by(
+        score.desc(), g.c.skill_id).limit(k)
+
+def criterion(text, k=TOP_K, minimum=MINIMUM):
+    """ Return a criterion of Skill matching skills similar to text
+    """
+    top = query(text, k, minimum).alias('similar')
+    # MySQL can not LIMIT a subquery of IN, but can select from one
+    return models.Skill.id.in_(sa.select([top.c.skill_id]))
+
+def search(session, text, k=TOP_K, minimum=MINIMUM):
+    """ Return [(skill, similarity)] of the skills most similar to text
+    """
+    found = session.execute(query(text, k, minimum)).fetchall()
+    skills = models.Skill.get_many(session, [id for id, score in found])
+    return [(skills[id], score) for id, score in found if id in skills]
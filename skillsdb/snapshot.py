@@ -0,0 +1,295 @@
+"""
+Snapshot
+========
+A compact in memory copy of the directory, for long lived processes that
+answer many lookups.
+
+Parents, skills, freetimes and addresses are held as small __slots__
+entries of the columns lookups need, with repeated strings (skill names,
+days, postcode areas) stored once. Skills, freetimes and addresses are
+indexed by skill, day and postcode area, and by the parent owning them.
+Parents' links to vocabulary skills and to shared freetimes are held
+both ways, as arrays of record IDs by parent and sets of parent IDs by
+record. No ORM object or session is kept.
+
+refresh() reads only records updated, and tombstones written, since the
+last refresh, as the change feed does, so keeping a snapshot current
+costs a few indexed queries. Changes in the change feed's overlap window
+are read again, as changes may commit with earlier times. Parents are
+stamped as updated when their skill and freetime links change, and the
+links of updated parents are read again.
+
+    directory = snapshot.Snapshot()
+    directory.refresh(session)
+    directory.find(skill='first aid', freetime='Friday PM', area='CB')
+"""
+import heapq
+import array
+import datetime
+
+import sqlalchemy as sa
+
+import models
+import stats
+import changes
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Columns read of each table, after the ID
+COLUMNS = {models.Parent:['first_name', 'second_name', 'parent_id', 'household_id'],
+           models.Skill:['parent_id', 'name'],
+           models.Freetime:['parent_id'] + stats.FREETIME_KEYS,
+           models.Address:['parent_id', 'postcode']}
+# Tables of records owned by a parent
+OWNED = [models.Skill, models.Freetime, models.Address]
+# Tables of records linked to parents, and their link tables
+LINKS = {models.Skill:(models.parent_skill, 'skill_id'),
+         models.Freetime:(models.parent_freetime, 'freetime_id')}
+
+class Parent(object):
+    __slots__ = ['id', 'first_name', 'second_name', 'partner_id', 'household_id']
+
+    def __init__(self, id, first_name, second_name, partner_id, household_id):
+        self.id = id
+        self.first_name = first_name
+        self.second_name = second_name
+        self.partner_id = partner_id
+        self.household_id = household_id
+
+    @property
+    def full_name(self):
+        return '%s %s' % (self.first_name, self.second_name)
+
+class Skill(object):
+    """ key is the normalised skill name
+    """
+    __slots__ = ['id', 'parent_id', 'name', 'key']
+
+    def __init__(self, id, parent_id, name, key):
+        self.id = id
+        self.parent_id = parent_id
+        self.name = name
+        self.key = key
+
+class Freetime(object):
+    """ key is the day, period is AM, PM, Day or NA
+    """
+    __slots__ = ['id', 'parent_id', 'key', 'period']
+
+    def __init__(self, id, parent_id, key, period):
+        self.id = id
+        self.parent_id = parent_id
+        self.key = key
+        self.period = period
+
+class Address(object):
+    """ key is the postcode area
+    """
+    __slots__ = ['id', 'parent_id', 'postcode', 'key']
+
+    def __init__(self, id, parent_id, postcode, key):
+        self.id = id
+        self.parent_id = parent_id
+        self.postcode = postcode
+        self.key = key
+
+class Snapshot(object):
+    """ Parents, skills, freetimes and addresses of one database
+    """
+    def __init__(self):
+        self.records = dict((table, {}) for table in COLUMNS)
+        # Record IDs by skill, day and area, and by owning parent
+        self.index = dict((table, {}) for table in OWNED)
+        self.owned = dict((table, {}) for table in OWNED)
+        # Record IDs linked to each parent, and parent IDs linked to each
+        # record, of linked tables
+        self.links = dict((table, {}) for table in LINKS)
+        self.linked = dict((table, {}) for table in LINKS)
+        self.strings = {}
+        self.watermark = None
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.itervalues())
+
+    def intern(self, text):
+        """ Return the stored copy of a repeated string
+        """
+        if text is None:
+            return None
+        return self.strings.setdefault(text, text)
+
+    def entry(self, table, id, row):
+        """ Return the entry of a record from its column values
+        """
+        if table == models.Parent:
+            return Parent(id, self.intern(row[0]), self.intern(row[1]), row[2], row[3])
+        if table == models.Skill:
+            return Skill(id, row[0], self.intern(row[1]), self.intern(stats.skill_key(row[1])))
+        if table == models.Freetime:
+            day, period = stats.freetime_key(*row[1:]).rsplit(' ', 1)
+            return Freetime(id, row[0], self.intern(day), self.intern(period))
+        return Address(id, row[0], row[1], self.intern(stats.postcode_key(row[1])))
+
+    def link(self, table, entry, add=True):
+        """ Add an owned entry to, or remove it from, the indexes
+        """
+        if table not in self.index:
+            return
+        for ids, key in [(self.index[table], entry.key), (self.owned[table], entry.parent_id)]:
+            if key is None:
+                continue
+            if add:
+                ids.setdefault(key, array.array('l')).append(entry.id)
+            else:
+                ids[key].remove(entry.id)
+                if not ids[key]:
+                    del ids[key]
+
+    def upsert(self, table, id, row):
+        old = self.records[table].get(id)
+        if old is not None:
+            self.link(table, old, False)
+        entry = self.entry(table, id, row)
+        self.records[table][id] = entry
+        self.link(table, entry)
+
+    def delete(self, table, id):
+        entry = self.records[table].pop(id, None)
+        if entry is None:
+            return
+        self.link(table, entry, False)
+        if table in LINKS:
+            links = self.links[table]
+            for parent_id in self.linked[table].pop(id, ()):
+                links[parent_id].remove(id)
+                if not links[parent_id]:
+                    del links[parent_id]
+        # Owned records are deleted by the database, without tombstones
+        if table == models.Parent:
+            self.unlink_parent(id)
+            for owned in OWNED:
+                for owned_id in list(self.owned[owned].get(id, [])):
+                    self.delete(owned, owned_id)
+
+    def unlink_parent(self, parent_id):
+        for table in LINKS:
+            linked = self.linked[table]
+            for id in self.links[table].pop(parent_id, ()):
+                linked[id].discard(parent_id)
+                if not linked[id]:
+                    del linked[id]
+
+    def load_links(self, session, parent_ids=None):
+        """ Read the skill and freetime links of parents, or of every parent
+        """
+        if parent_ids is not None:
+            for parent_id in parent_ids:
+                self.unlink_parent(parent_id)
+        for table, (link, key) in LINKS.iteritems():
+            query = sa.select([link.c.parent_id, link.c[key]])
+            if parent_ids is None:
+                queries = [query]
+            else:
+                queries = [query.where(link.c.parent_id.in_(chunk))
+                           for chunk in stats.chunks(parent_ids)]
+            links, linked = self.links[table], self.linked[table]
+            for query in queries:
+                for parent_id, id in session.execute(query):
+                    if parent_id in self.records[models.Parent]:
+                        links.setdefault(parent_id, array.array('l')).append(id)
+                        linked.setdefault(id, set()).add(parent_id)
+
+    def updates(self, session, table, since):
+        """ Yield (updated, 'upsert', table, id, values) of records updated
+            at or after since, oldest first
+        """
+        t = table.__table__
+        query = sa.select([t.c.updated, t.c.id] + [t.c[key] for key in COLUMNS[table]])
+        if since:
+            query = query.where(t.c.updated >= since)
+        for row in session.execute(query.order_by(t.c.updated, t.c.id)):
+            yield row[0], 'upsert', table.classname, row[1], tuple(row[2:])
+
+    def refresh(self, session):
+        """ Apply changes made since the last refresh, loading every record
+            the first time. Returns the number of changes applied
+        """
+        now = datetime.datetime.now()
+        tables = dict((table.classname, table) for table in COLUMNS)
+        streams = [self.updates(session, table, self.watermark) for table in COLUMNS]
+        if self.watermark:
+            streams.append(changes.deletes(session, self.watermark, list(COLUMNS)))
+
+        first = self.watermark is None
+        parent_ids = set()
+        newest = None
+        count = 0
+        for changed, op, tablename, id, row in heapq.merge(*streams):
+            if op == 'upsert':
+                self.upsert(tables[tablename], id, row)
+                if tablename == models.Parent.classname:
+                    parent_ids.add(id)
+            else:
+                self.delete(tables[tablename], id)
+            if changed and (newest is None or changed > newest):
+                newest = changed
+            count += 1
+        # Read changes of the overlap window again next time
+        self.watermark = changes.watermark(self.watermark, newest, now)
+        self.load_links(session, None if first else parent_ids)
+        log.debug('Applied %s changes, watermark %s' % (count, self.watermark))
+        return count
+
+    def parent(self, id):
+        """ Return the parent with record ID id, or None
+        """
+        return self.records[models.Parent].get(id)
+
+    def owned_by(self, table, parent_id):
+        """ Return the skills or freetimes (owned or linked), or address
+            entries of a parent
+        """
+        records = self.records[table]
+        ids = list(self.owned[table].get(parent_id, []))
+        if table in LINKS:
+            ids.extend(id for id in self.links[table].get(parent_id, []) if id not in ids)
+        return [records[id] for id in ids if id in records]
+
+    def parent_ids(self, table, key, test=None):
+        """ Return IDs of parents owning (or linked to) an entry with key,
+            that passes test
+        """
+        records = self.records[table]
+        entries = [records[id] for id in self.index[table].get(key, [])]
+        entries = [entry for entry in entries if test is None or test(entry)]
+        found = set(entry.parent_id for entry in entries if entry.parent_id is not None)
+        if table in LINKS:
+            for entry in entries:
+                found.update(self.linked[table].get(entry.id, ()))
+        return found
+
+    def find(self, skill=None, freetime=None, area=None):
+        """ Return parents with a skill, free on a day ('Friday', or
+            'Friday PM' for parents free that afternoon or all day), and
+            living in a postcode area, by record ID
+        """
+        found = None
+        if skill is not None:
+            found = self.parent_ids(models.Skill, stats.skill_key(skill))
+        if freetime is not None:
+            day, period = (freetime.split() + [None])[:2]
+            test = None
+            if period:
+                # Parents free all day are free in the morning and afternoon
+                periods = set(['DAY', period.upper()])
+                test = lambda entry: entry.period.upper() in periods
+            ids = self.parent_ids(models.Freetime, day.capitalize(), test)
+            found = ids if found is None else found & ids
+        if area is not None:
+            ids = self.parent_ids(models.Address, stats.postcode_key(area))
+            found = ids if found is None else found & ids
+        if found is None:
+            found = self.records[models.Parent]
+        parents = self.records[models.Parent]
+        return [parents[id] for id in sorted(found) if id in parents]
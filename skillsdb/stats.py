@@ -0,0 +1,287 @@
+"""
+Statistics
+==========
+Precomputed counts for dashboards and coordinators' questions:
+
+    skill       parents linked to each skill, by normalised skill name
+    freetime    freetimes by day and period (AM, PM, Day)
+    postcode    addresses by postcode area (CB21 4EE -> CB)
+    parent      all parents
+
+Counts are adjusted as records are flushed, so reading one is a single
+indexed lookup. --rebuild recounts everything from the records.
+
+Skill counts are recounted, for the skills whose names or links changed,
+from the parent_skill links, so a parent listed twice under one name
+(before the skill vocabulary was migrated) is counted once.
+"""
+import re
+import itertools
+import collections
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes
+
+import utils
+import models
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+KINDS = ['skill', 'freetime', 'postcode', 'parent']
+KEYS = ['kind', 'key', 'count']
+FREETIME_KEYS = ['day', 'am_start', 'am_end', 'pm_start', 'pm_end']
+DELTAS = 'statistic_deltas'
+SKILL_KEYS = 'statistic_skill_keys'
+CHUNK = 500
+
+class StatsError(Exception):pass
+
+skill_key = models.skill_key
+
+def freetime_key(day, am_start, am_end, pm_start, pm_end):
+    period = models.Freetime(am_start=am_start, am_end=am_end,
+                             pm_start=pm_start, pm_end=pm_end).get_period
+    return '%s %s' % ((day or '').strip().capitalize(), period)
+
+def postcode_key(postcode):
+    area = re.match(r'\s*([A-Za-z]*)', postcode or '').group(1)
+    return area.upper()
+
+def statistic_key(table, values):
+    """ Return (kind, key) counting a record of class table with the given
+        column values
+    """
+    if issubclass(table, models.Freetime):
+        return 'freetime', freetime_key(*[values[key] for key in FREETIME_KEYS])
+    if issubclass(table, models.Address):
+        return 'postcode', postcode_key(values['postcode'])
+    if issubclass(table, models.Parent):
+        return 'parent', ''
+
+# Columns that the statistic key of each counted class depends on
+# Skills are counted from their links instead
+COUNTED = {models.Freetime:FREETIME_KEYS, models.Address:['postcode'], models.Parent:[]}
+
+def values(obj, keys, previous=False):
+    """ Return current, or previously flushed, column values of a record
+        Values of new records that are left unset take the column default
+    """
+    result = {}
+    new = sa.inspect(obj).pending
+    for key in keys:
+        history = attributes.get_history(obj, key)
+        if previous and history.deleted:
+            value = history.deleted[0]
+        elif previous and history.added and not history.unchanged:
+            value = None
+        else:
+            value = getattr(obj, key)
+        default = obj.__table__.c[key].default
+        if value is None and new and default is not None and default.is_scalar:
+            value = default.arg
+        result[key] = value
+    return result
+
+def chunks(ids):
+    ids = list(ids)
+    for i in xrange(0, len(ids), CHUNK):
+        yield ids[i:i + CHUNK]
+
+def skill_keys(conn, skill_ids=(), parent_ids=()):
+    """ Return the normalised names of skills, and of skills linked to
+        parents
+    """
+    s = models.Skill.__table__
+    ps = models.parent_skill
+    keys = set()
+    for chunk in chunks(skill_ids):
+        keys.update(row[0] for row in conn.execute(
+            sa.select([s.c.name]).where(s.c.id.in_(chunk))))
+    for chunk in chunks(parent_ids):
+        keys.update(row[0] for row in conn.execute(sa.select([s.c.name]).select_from(
+            s.join(ps, ps.c.skill_id == s.c.id)).where(ps.c.parent_id.in_(chunk))))
+    return set(skill_key(name) for name in keys)
+
+def recount_skills(conn, keys=None):
+    """ Set the skill counts of the given normalised names, or of every
+        skill, to the number of parents linked to a skill of that name
+    """
+    s = models.Skill.__table__
+    ps = models.parent_skill
+    t = models.Statistic.__table__
+    counted = sa.select([s.c.name_key, sa.func.count(sa.distinct(ps.c.parent_id))]).select_from(
+        s.join(ps, ps.c.skill_id == s.c.id)).group_by(s.c.name_key)
+    stored = sa.select([t.c.key, t.c.count]).where(t.c.kind == 'skill')
+    if keys is None:
+        queries = [(counted, stored)]
+    else:
+        queries = [(counted.where(s.c.name_key.in_(chunk)), stored.where(t.c.key.in_(chunk)))
+                   for chunk in chunks(set(key[:100] for key in keys))]
+
+    deltas = collections.Counter()
+    for counted, stored in queries:
+        for key, count in conn.execute(counted):
+            if key is not None:
+                deltas['skill', key] += count
+        for key, count in conn.execute(stored):
+            deltas['skill', key] -= count
+    adjust(conn, deltas)
+
+def collect_skill_keys(session):
+    """ Remember names of skills whose names or links a flush changes
+    """
+    keys = session.info.setdefault(SKILL_KEYS, set())
+    deleted = []
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if type(obj) == models.Skill:
+            keys.add(skill_key(obj.name))
+            if not sa.inspect(obj).pending:
+                keys.add(skill_key(values(obj, ['name'], True)['name']))
+        elif type(obj) == models.Parent:
+            if obj in session.deleted:
+                deleted.append(sa.inspect(obj).identity[0])
+                continue
+            history = attributes.get_history(obj, 'skills',
+                                             passive=attributes.PASSIVE_NO_INITIALIZE)
+            keys.update(skill_key(skill.name) for skill in
+                        list(history.added or []) + list(history.deleted or []))
+    if deleted:
+        keys.update(skill_keys(session.connection(), parent_ids=deleted))
+
+def collect_deltas(session, flush_context, instances):
+    """ Work out the change in counts made by a flush
+    """
+    collect_skill_keys(session)
+    deltas = session.info.setdefault(DELTAS, collections.Counter())
+    for obj in session.new:
+        if type(obj) in COUNTED:
+            deltas[statistic_key(type(obj), values(obj, COUNTED[type(obj)]))] += 1
+    for obj in session.deleted:
+        if type(obj) in COUNTED:
+            deltas[statistic_key(type(obj), values(obj, COUNTED[type(obj)], True))] -= 1
+    for obj in session.dirty:
+        keys = COUNTED.get(type(obj))
+        if not keys or not any(attributes.get_history(obj, key).has_changes() for key in keys):
+            continue
+        old = statistic_key(type(obj), values(obj, keys, True))
+        new = statistic_key(type(obj), values(obj, keys))
+        if old != new:
+            deltas[old] -= 1
+            deltas[new] += 1
+
+def row_deltas(table, previous, rows):
+    """ Return the change in counts of writing rows, dicts of column values
+        including the ID, over previous, the stored values of existing rows
+        by ID. Columns missing from new rows take the column default.
+        previous is updated, so later rows of a batch see earlier ones.
+    """
+    keys = COUNTED[table]
+    deltas = collections.Counter()
+    for row in rows:
+        old = previous.get(row['id'])
+        if old is None:
+            new = {}
+            for key in keys:
+                default = table.__table__.c[key].default
+                new[key] = row.get(key, default.arg if default is not None and
+                                   default.is_scalar else None)
+            deltas[statistic_key(table, new)] += 1
+            previous[row['id']] = new
+        elif any(key in row for key in keys):
+            new = dict(old)
+            new.update((key, row[key]) for key in keys if key in row)
+            deltas[statistic_key(table, old)] -= 1
+            deltas[statistic_key(table, new)] += 1
+            previous[row['id']] = new
+    return deltas
+
+def apply_deltas(session, flush_context):
+    """ Adjust stored counts by the changes collected before the flush
+    """
+    deltas = session.info.pop(DELTAS, None)
+    if deltas:
+        adjust(session.connection(), deltas)
+    keys = session.info.pop(SKILL_KEYS, None)
+    if keys:
+        recount_skills(session.connection(), keys)
+
+def adjust(conn, deltas):
+    """ Add deltas, a mapping of (kind, key) to change in count
+    """
+    table = models.Statistic.__table__
+    for (kind, key), delta in sorted(deltas.iteritems()):
+        if not delta:
+            continue
+        key = key[:100]
+        result = conn.execute(table.update().where(table.c.kind == kind).where(
+            table.c.key == key).values(count=table.c.count + delta))
+        if not result.rowcount:
+            conn.execute(table.insert().values(kind=kind, key=key, count=delta,
+                                               created=models.datetime.datetime.now()))
+
+def rebuild(session):
+    """ Recount every statistic from the records
+    """
+    counts = collections.Counter()
+    for row in session.query(*[getattr(models.Freetime, key) for key in FREETIME_KEYS]):
+        counts['freetime', freetime_key(*row)] += 1
+    for postcode, in session.query(models.Address.postcode):
+        counts['postcode', postcode_key(postcode)] += 1
+    counts['parent', ''] = session.query(models.Parent).count()
+
+    session.execute(models.Statistic.__table__.delete())
+    adjust(session.connection(), counts)
+    recount_skills(session.connection())
+    session.commit()
+    return len(counts)
+
+def lookup(session, kind=None, key=None):
+    """ Return statistics, optionally of one kind or one key
+    """
+    query = session.query(models.Statistic.kind, models.Statistic.key,
+                          models.Statistic.count).filter(models.Statistic.count != 0)
+    if kind:
+        query = query.filter(models.Statistic.kind == kind)
+    if key is not None:
+        query = query.filter(models.Statistic.key == key)
+    return query.order_by(models.Statistic.kind, models.Statistic.count.desc(),
+                          models.Statistic.key)
+
+sa.event.listen(sa.orm.Session, 'before_flush', collect_deltas)
+sa.event.listen(sa.orm.Session, 'after_flush', apply_deltas)
+
+def main(args):
+    """
+Show precomputed counts of skills, free times, postcode areas and parents.
+
+  Counts are kept up to date as records change.  Recount everything (after
+  upgrading a database, for example) with --rebuild.
+
+  skillsdb stats
+  skillsdb stats --kind skill --key "first aid"
+  skillsdb stats --kind freetime --key "Friday PM"
+  skillsdb stats --kind postcode --format csv
+    """
+    if args.key is not None and not args.kind:
+        raise StatsError, "--key requires a --kind of statistic"
+    if args.key is not None:
+        args.key = {'skill':skill_key, 'postcode':postcode_key}.get(
+            args.kind, lambda key: key)(args.key)
+
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.rebuild:
+        session = session_config.get_session()
+        count = rebuild(session)
+        session.close()
+        log.info('Rebuilt %s statistics' % count)
+        return 0
+
+    session = session_config.get_session(readonly=True)
+    writer = formats.RecordWriter(args.format, KEYS)
+    for row in lookup(session, args.kind, args.key):
+        writer.write(zip(KEYS, row))
+    writer.close()
+    session.close()
+    return 0
@@ -0,0 +1,255 @@
+"""
+Differential sync
+=================
+Copy records that differ from one skillsdb database to another, for
+example from a school's local SQLite copy to the central MySQL server.
+
+Each table is split into buckets of consecutive record IDs. A digest of
+every bucket (row count, sums of IDs, integer and float columns, sum of
+a CRC32 of each row's string columns, latest updated time) is computed
+by the database on both sides, so buckets that match cost one aggregate
+row each. SQLite has no CRC32, so one is registered on its connections.
+Rows of differing buckets are read from both sides and compared by
+content hash, and only rows whose hashes differ are written, as upserts
+in batches.
+
+The digest can't see every change. Changes made without a new updated
+time to dates and times other than updated, to floats by less than
+FLOAT_PLACES decimal places, or that swap values of a column between
+rows of a bucket keep the digest, as do string changes whose CRC32s
+collide. Such rows are copied once anything else in their bucket
+changes. Strings stored by MySQL in a character set other than UTF-8
+make buckets differ where they match, costing a row comparison.
+
+Rows are copied as they are, household labels and updated times
+included, so a synced database is an exact copy of its source. Foreign
+keys are not enforced while syncing, as rows of a table may refer to rows
+that arrive later in the same sync. Statistic counts and tombstones are
+the destination's own and are adjusted for the rows written. Skill counts
+are recounted when skills or their links change.
+"""
+import zlib
+import hashlib
+import datetime
+import decimal
+import collections
+
+import sqlalchemy as sa
+
+import utils
+import models
+import stats
+import upsert
+import changes
+import formats
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# Derived or local tables, kept by each database for itself
+LOCAL = ['params', 'statistic', 'tombstone', 'skillgram', 'postcode', 'savedsearch',
+         'savedmatch']
+# Tables deciding skill counts
+SKILL_TABLES = ['skill', 'parent_skill']
+KEYS = ['table', 'buckets', 'differing', 'upserted', 'deleted']
+BUCKET_SIZE = 1024
+BATCH_SIZE = 1000
+# Float sums are added in different orders by each database
+FLOAT_PLACES = 6
+# Separates string columns, and stands for NULL, in row CRCs
+SEPARATOR = u'\x1f'
+NULL = u'\x1e'
+
+class SyncError(Exception):pass
+
+def tables():
+    """ Return synced tables, parents of foreign keys first
+    """
+    return [t for t in models.metadata.sorted_tables if t.name not in LOCAL]
+
+def mapped_class(table):
+    """ Return the mapped class of a table, or None for association tables
+    """
+    for cls in changes.TRACKED:
+        if cls.__table__ is table:
+            return cls
+
+def normalise(value, seconds=False):
+    """ Return a column value comparable across databases: MySQL returns
+        sums as decimals, and keeps whole seconds, so with seconds times
+        are compared to the second
+    """
+    if seconds and isinstance(value, (datetime.datetime, datetime.time)):
+        return value.replace(microsecond=0)
+    if isinstance(value, (decimal.Decimal, long)):
+        return int(value)
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def row_hash(table, row, seconds=False):
+    """ Return a hash of the normalised column values of a row dict
+    """
+    values = tuple(normalise(row[col.name], seconds) for col in table.columns)
+    return hashlib.sha1(repr(values)).hexdigest()
+
+def crc32(text):
+    """ Return the unsigned CRC32 of the UTF-8 of text, as MySQL's CRC32
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return zlib.crc32(text) & 0xffffffff
+
+def string_crc(conn, table):
+    """ Return an expression of the CRC32 of a row's string columns, or
+        None when the table has none
+    """
+    strings = [col for col in table.columns if isinstance(col.type, sa.String)]
+    if not strings:
+        return None
+    if conn.dialect.name == 'sqlite':
+        conn.connection.create_function('crc32', 1, crc32)
+    text = sa.func.coalesce(strings[0], NULL)
+    for col in strings[1:]:
+        text = text + SEPARATOR + sa.func.coalesce(col, NULL)
+    return sa.func.crc32(text)
+
+def digests(conn, table, size=BUCKET_SIZE, seconds=False):
+    """ Return a digest of each bucket of size record IDs, by first ID
+    """
+    bucket = table.c.id - table.c.id % size
+    columns = [sa.func.count(), sa.func.sum(table.c.id)]
+    columns.extend(sa.func.sum(col) for col in table.columns
+                   if isinstance(col.type, (sa.Integer, sa.Float)) and col.name != 'id')
+    crc = string_crc(conn, table)
+    if crc is not None:
+        columns.append(sa.func.sum(crc))
+    if 'updated' in table.c:
+        columns.append(sa.func.max(table.c.updated))
+    query = sa.select([bucket] + columns).group_by(bucket)
+    return dict((int(row[0]), tuple(round(value, FLOAT_PLACES) if isinstance(value, float)
+                                    else normalise(value, seconds) for value in row[1:]))
+                for row in conn.execute(query))
+
+def bucket_rows(conn, table, start, size=BUCKET_SIZE):
+    """ Return rows of a bucket as dicts, by ID
+    """
+    query = sa.select(list(table.columns)).where(
+        table.c.id.between(start, start + size - 1))
+    return dict((row['id'], dict(row)) for row in conn.execute(query))
+
+def compare(source, target, table, size=BUCKET_SIZE):
+    """ Return (buckets, differing buckets, rows to upsert, IDs only in target)
+        of a table, connections to two databases
+    """
+    # SQLite keeps microseconds, so changes within a second are seen
+    seconds = not (source.dialect.name == target.dialect.name == 'sqlite')
+    source_digests = digests(source, table, size, seconds)
+    target_digests = digests(target, table, size, seconds)
+    buckets = set(source_digests) | set(target_digests)
+    differing = sorted(start for start in buckets
+                       if source_digests.get(start) != target_digests.get(start))
+
+    rows, extra = [], []
+    for start in differing:
+        source_rows = bucket_rows(source, table, start, size) if start in source_digests else {}
+        target_hashes = dict((id, row_hash(table, row, seconds)) for id, row in
+                             bucket_rows(target, table, start, size).iteritems())
+        for id in sorted(source_rows):
+            if row_hash(table, source_rows[id], seconds) != target_hashes.get(id):
+                rows.append(source_rows[id])
+        extra.extend(sorted(set(target_hashes) - set(source_rows)))
+    return len(buckets), len(differing), rows, extra
+
+def delete_rows(conn, table, ids, deltas):
+    """ Delete rows of table by ID, counting statistics and tombstones
+    """
+    cls = mapped_class(table)
+    for i in xrange(0, len(ids), BATCH_SIZE):
+        chunk = ids[i:i + BATCH_SIZE]
+        if cls in stats.COUNTED:
+            for values in upsert.stored(conn, cls, chunk, stats.COUNTED[cls]).itervalues():
+                deltas[stats.statistic_key(cls, values)] -= 1
+        conn.execute(table.delete().where(table.c.id.in_(chunk)))
+        if cls is not None:
+            changes.record_deletes(conn, cls, chunk)
+
+def write_rows(conn, table, rows, deltas, batch_size=BATCH_SIZE):
+    """ Upsert rows of table in batches, counting statistics
+    """
+    cls = mapped_class(table)
+    for i in xrange(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        if cls in stats.COUNTED:
+            keys = stats.COUNTED[cls]
+            previous = upsert.stored(conn, cls, [row['id'] for row in batch], keys)
+            deltas.update(stats.row_deltas(cls, previous, batch))
+        upsert.execute(conn, table, batch)
+
+def sync(source, target, size=BUCKET_SIZE, batch_size=BATCH_SIZE, delete=False,
+         dry_run=False):
+    """ Copy rows of source that differ to target, sessions of two databases
+        With delete, rows missing from source are deleted from target
+
+        Yields (table, buckets, differing, upserted, deleted) per table
+    """
+    if models.same_database(source.bind, target.bind):
+        raise SyncError, "Source and destination are the same database (%s)" % source.bind.url
+    if not dry_run:
+        models.foreign_keys(target.connection(), False)
+
+    found = []
+    for table in tables():
+        buckets, differing, rows, extra = compare(source.connection(), target.connection(),
+                                                  table, size)
+        found.append((table, buckets, differing, rows, extra if delete else []))
+    source.close()
+
+    conn = target.connection()
+    deltas = collections.Counter()
+    if not dry_run:
+        for table, buckets, differing, rows, extra in reversed(found):
+            delete_rows(conn, table, extra, deltas)
+        for table, buckets, differing, rows, extra in found:
+            write_rows(conn, table, rows, deltas, batch_size)
+        stats.adjust(conn, deltas)
+        if any(rows or extra for table, buckets, differing, rows, extra in found
+               if table.name in SKILL_TABLES):
+            stats.recount_skills(conn)
+        models.foreign_keys(conn, True)
+        target.commit()
+    for table, buckets, differing, rows, extra in found:
+        log.info('%s: %s of %s buckets differ' % (table.name, differing, buckets))
+        yield table.name, buckets, differing, len(rows), len(extra)
+
+def main(args):
+    """
+Copy records that differ from one database to another.
+
+  SRC and DST are configuration files of the two databases.  Tables are
+  compared in buckets of consecutive record IDs, and only rows whose content
+  differs are copied, so syncing a mostly unchanged database reads little
+  more than one summary row per bucket.  Rows are copied with their IDs, so
+  give each school its own destination --tenant.
+
+  Records deleted from SRC are kept in DST unless --delete is given.
+  --dry-run reports what would be copied without writing.
+
+  skillsdb sync school.cfg central.cfg --tenant st_marys
+  skillsdb sync school.cfg central.cfg --tenant st_marys --delete --dry-run
+    """
+    if args.bucket_size < 1 or args.batch_size < 1:
+        raise SyncError, "--bucket-size and --batch-size must be at least 1"
+    source = utils.load_config(args.src, args.src_tenant).get_session(readonly=True)
+    target = utils.load_config(args.dst, args.tenant).get_session()
+
+    writer = formats.RecordWriter(args.format, KEYS)
+    try:
+        for row in sync(source, target, args.bucket_size, args.batch_size, args.delete,
+                        args.dry_run):
+            writer.write(zip(KEYS, row))
+    finally:
+        source.close()
+        target.close()
+    writer.close()
+    return 0
@@ -0,0 +1,81 @@
+"""
+Test backup.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from skillsdb import (backup, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Backup(ModelsTestSetup):
+    """ Backups restore the database as it was
+    """
+    dbtype = 'sqlite'
+
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.directory = tempfile.mkdtemp(prefix='skillsdb_test_')
+        self.filename = os.path.join(self.directory, 'backup.gz')
+        session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        fred.freetimes = [models.Freetime(day='Monday')]
+        session.add_all([fred, wilma])
+        session.commit()
+        fred.parent_id, wilma.parent_id = wilma.id, fred.id
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        ModelsTestSetup.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def change(self):
+        session = self.get_session()
+        session.add(models.Parent(first_name='Barney', second_name='Rubble'))
+        session.commit()
+        session.close()
+
+    def names(self):
+        session = self.get_session()
+        names = sorted(row[0] for row in session.query(models.Parent.first_name))
+        session.close()
+        return names
+
+    def test_sqlite(self):
+        session = self.get_session()
+        backup.backup(session, self.filename)
+        session.close()
+        self.assertTrue(backup.is_sqlite_backup(self.filename))
+
+        self.change()
+        backup.restore(self.get_session(), self.filename)
+        self.assertEqual(self.names(), ['Fred', 'Wilma'])
+
+    def test_rows(self):
+        session = self.get_session()
+        backup.backup_rows(session, self.filename)
+        session.close()
+        self.assertFalse(backup.is_sqlite_backup(self.filename))
+
+        self.change()
+        session = self.get_session()
+        created = session.query(models.Freetime.created).scalar()
+        backup.restore(session, self.filename)
+        session.close()
+        self.assertEqual(self.names(), ['Fred', 'Wilma'])
+        session = self.get_session()
+        freetime = session.query(models.Freetime).one()
+        self.assertEqual((freetime.created, freetime.am_start), (created, models.TIME_AM_START))
+        self.assertEqual(session.query(models.Statistic).filter_by(kind='parent').one().count, 2)
+        session.close()
+
+    def test_missing(self):
+        self.assertRaises(backup.BackupError, backup.restore, self.get_session(), self.filename)
+
+class MemoryBackup(Backup):
+    """ Backups restore into an in memory database
+    """
+    dbtype = 'memory'
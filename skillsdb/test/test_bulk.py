@@ -0,0 +1,111 @@
+"""
+Test bulk.py module
+"""
+import unittest
+
+from skillsdb import (bulk, stats, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class BulkTestSetup(ModelsTestSetup):
+    """ Parents, partners and children, with skills and an address
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        barney = models.Parent(first_name='Barney', second_name='Rubble')
+        fred.partner = wilma
+        fred.address = models.Address(postcode='CB21 4EE')
+        fred.skills = [models.Skill(name='First Aid')]
+        pebbles = models.Child(first_name='Pebbles', second_name='Flintstone', year=6)
+        pebbles.parents = [fred, wilma]
+        bamm = models.Child(first_name='Bamm-Bamm', second_name='Rubble', year=5)
+        bamm.parents = [barney]
+        self.session.add_all([fred, wilma, barney, pebbles, bamm])
+        self.session.commit()
+        fred.skills[0].parent_id = fred.id
+        self.session.commit()
+        self.fred, self.wilma, self.pebbles = fred.id, wilma.id, pebbles.id
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def counts(self):
+        return dict(((kind, key), count) for kind, key, count in stats.lookup(self.session))
+
+class BulkDelete(BulkTestSetup):
+    """ Deletes take owned records and links with them
+    """
+    def test_delete_parent(self):
+        count = bulk.delete(self.session, models.Parent, models.Parent.id == self.fred)
+        self.session.commit()
+        self.assertEqual(count, 1)
+        self.assertEqual(self.session.query(models.Address).count(), 0)
+        self.assertEqual(self.session.query(models.Skill).count(), 0)
+        self.assertEqual(self.session.query(models.parent_skill).count(), 0)
+
+        wilma = models.Parent.get(self.session, self.wilma)
+        self.assertEqual(wilma.parent_id, None)
+        self.assertEqual(wilma.household_id, self.wilma)
+        pebbles = models.Child.get(self.session, self.pebbles)
+        self.assertEqual([p.id for p in pebbles.parents], [self.wilma])
+        self.assertEqual(pebbles.household_id, self.wilma)
+
+        counts = self.counts()
+        self.assertEqual(counts[('parent', '')], 2)
+        self.assertTrue(('skill', 'first aid') not in counts)
+        self.assertTrue(('postcode', 'CB') not in counts)
+
+    def test_delete_by_search(self):
+        count = bulk.delete(self.session, models.Child, models.Child.year == 6)
+        self.session.commit()
+        self.assertEqual(count, 1)
+        self.assertEqual([c.first_name for c in self.session.query(models.Child)], ['Bamm-Bamm'])
+        self.assertEqual(self.session.query(models.parent_child).count(), 1)
+        self.assertEqual(bulk.delete(self.session, models.Child, models.Child.year == 6), 0)
+
+    def test_database_cascade(self):
+        # Foreign keys delete links and owned records without help
+        self.session.execute(models.Parent.__table__.delete().where(
+            models.Parent.id == self.fred))
+        self.session.commit()
+        self.assertEqual(self.session.query(models.Skill).count(), 0)
+        self.assertEqual(self.session.query(models.parent_child).count(), 2)
+        self.assertEqual(models.Parent.get(self.session, self.wilma).parent_id, None)
+
+class BulkUpdate(BulkTestSetup):
+    """ Updates set columns of every matching record
+    """
+    def test_update(self):
+        self.assertEqual(bulk.count(self.session, models.Child, models.Child.year >= 5), 2)
+        count = bulk.update(self.session, models.Child, models.Child.year >= 5, {'year':7})
+        self.session.commit()
+        self.assertEqual(count, 2)
+        self.assertEqual(set(year for year, in self.session.query(models.Child.year)), set([7]))
+
+    def test_update_statistics(self):
+        bulk.update(self.session, models.Address, models.Address.postcode.like('CB%'),
+                    {'postcode':'EH1 1AA'})
+        self.session.commit()
+        counts = self.counts()
+        self.assertEqual(counts[('postcode', 'EH')], 1)
+        self.assertTrue(('postcode', 'CB') not in counts)
+
+    def test_update_partners(self):
+        bulk.update(self.session, models.Parent, models.Parent.first_name == 'Barney',
+                    {'parent_id':self.wilma})
+        self.session.commit()
+        households = set(household for household, in self.session.query(
+            models.Parent.household_id))
+        lowest = min(id for id, in self.session.query(models.Parent.id))
+        self.assertEqual(households, set([lowest]))
+
+    def test_invalid_update(self):
+        self.assertRaises(bulk.BulkError, bulk.update, self.session, models.Skill,
+                          models.Skill.id > 0, {'parent_id':self.wilma})
+        self.assertRaises(bulk.BulkError, bulk.update, self.session, models.Skill,
+                          models.Skill.id > 0, {'parents':[]})
+        self.assertRaises(bulk.BulkError, bulk.update, self.session, models.Skill,
+                          models.Skill.id > 0, {})
@@ -0,0 +1,89 @@
+"""
+Test changes.py module
+"""
+import unittest
+import datetime
+import time
+
+from skillsdb import (changes, bulk, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class ChangeFeed(ModelsTestSetup):
+    """ Changes since a watermark, including deletes
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        fred.skills = [models.Skill(name='First Aid')]
+        barney = models.Parent(first_name='Barney', second_name='Rubble')
+        self.session.add_all([fred, barney])
+        self.session.commit()
+        self.fred, self.barney = fred, barney
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def watermark(self):
+        time.sleep(0.01)
+        watermark = datetime.datetime.now()
+        time.sleep(0.01)
+        return watermark
+
+    def test_created_per_record(self):
+        watermark = self.watermark()
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        self.session.add(wilma)
+        self.session.commit()
+        self.assertTrue(wilma.created > watermark > self.fred.created)
+        self.assertTrue(wilma.updated >= wilma.created)
+
+    def test_feed_since(self):
+        self.assertEqual(len(list(changes.feed(self.session))), 3)
+        watermark = self.watermark()
+        fred, barney, skill = self.fred.id, self.barney.id, self.fred.skills[0].id
+        self.session.delete(self.fred.skills[0])
+        self.session.commit()
+        self.fred.first_name = 'Frederick'
+        self.session.commit()
+        bulk.delete(self.session, models.Parent, models.Parent.id == barney)
+        self.session.commit()
+
+        feed = [change[1:4] for change in changes.feed(self.session, watermark)]
+        self.assertEqual(sorted(feed), sorted([
+            ('upsert', 'parent', fred), ('delete', 'skill', skill),
+            ('delete', 'parent', barney)]))
+        upsert = [change for change in changes.feed(self.session, watermark) if change[1] == 'upsert']
+        self.assertEqual(upsert[0][4]['first_name'], 'Frederick')
+        self.assertTrue(upsert[0][0] >= watermark)
+
+        parents = changes.feed(self.session, watermark, [models.Parent])
+        self.assertEqual(len(list(parents)), 2)
+        self.assertEqual(changes.prune(self.session, datetime.datetime.now()), 2)
+
+    def test_parse_watermark(self):
+        self.assertEqual(changes.parse_watermark('2014-03-29T09:44:19.271803'),
+                         datetime.datetime(2014, 3, 29, 9, 44, 19, 271803))
+        self.assertEqual(changes.parse_watermark('2014-03-29'), datetime.datetime(2014, 3, 29))
+        self.assertRaises(changes.ChangesError, changes.parse_watermark, 'yesterday')
+
+    def test_watermark_overlap(self):
+        now = datetime.datetime.now()
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(changes.watermark(None, now, now), now - changes.OVERLAP)
+        self.assertEqual(changes.watermark(None, now - hour, now), now - hour)
+        self.assertEqual(changes.watermark(now - hour, None, now), now - hour)
+        self.assertEqual(changes.watermark(None, None, now), None)
+
+        # A change stamped before the feed was read, committed after it
+        newest = max(change[0] for change in changes.feed(self.session))
+        mark = changes.watermark(None, newest, now)
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        self.session.add(wilma)
+        self.session.flush()
+        self.session.execute(models.Parent.__table__.update().where(
+            models.Parent.__table__.c.id == wilma.id).values(updated=now - changes.OVERLAP / 2))
+        self.session.commit()
+        self.assertTrue(wilma.id in [change[3] for change in changes.feed(self.session, mark)
+                                     if change[2] == 'parent'])
@@ -3,6 +3,8 @@ Test config.py module
 """
 import unittest
 import os
+import shutil
+import tempfile
 from copy import deepcopy
 
 from skillsdb import (config, models)
@@ -12,18 +14,26 @@ def drop_db(x, host='', user='skills', passwd='skills', dbtype='sqlite', echo=Fa
         'sqlite:///' + user + ':' + passwd + '@' + host + '/' + x, poolclass=models.NullPool)
     models.metadata.drop_all(engine)
 
-def path_to(filename):
-    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
-
 class Params(object):
-    def __init__(self, config_file=config.FNAME, **kwargs):
+    def __init__(self, directory, config_file=config.FNAME, **kwargs):
         # user definable database parameters
-        self.filename = path_to('data_out/' + config_file)
+        self.filename = os.path.join(directory, config_file)
         self.user = 'skills'
         self.passwd = 'skills'
         self.host = ''
+        self.read_host = ''
         self.dbtype = 'sqlite'
         self.dbname = 'skillsdb.sqlite'
+        self.tenants = ''
+        self.tenant = None
+        self.journal_mode = 'wal'
+        self.synchronous = 'normal'
+        self.cache_size = '-16000'
+        self.mmap_size = '268435456'
+        self.busy_timeout = '5000'
+        self.temp_store = 'memory'
+        self.write_retries = '5'
+        self.write_backoff = '0.05'
         self.force = False
         self.set = False
         self.load = False
@@ -44,17 +54,25 @@ class Params(object):
   
 
 class ConfigTestSetup(unittest.TestCase):
-    """ Common methods for tests
+    """ Common methods for tests, each test writes its config files and
+        databases to its own directory
     """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='skillsdb_config_')
+
+    def tearDown(self):
+        models.dispose()
+        shutil.rmtree(self.directory)
+
     def remove_files(self, paths, add_dir=True):
         """ Delete an interable of file paths.
-            Add dir assumes you want to remove a file from the test/data_out
-            Directory
+            Add dir assumes you want to remove a file from the test's
+            directory
         """
         for path in paths:
             try:
                 if add_dir:
-                    os.unlink(path_to('data_out/' + path))
+                    os.unlink(os.path.join(self.directory, path))
                 else:
                     os.unlink(path)
             except OSError:
@@ -81,7 +99,8 @@ class ConfigProgram(ConfigTestSetup):
         """ All defaults - new config
             skillsdb config -l
         """
-        test_params = Params(config_file='all_defaults.cfg', force=True, load=True)
+        test_params = Params(self.directory, config_file='all_defaults.cfg',
+                             force=True, load=True)
         settings_expect = config.DEFAULTS
         observed = config.Config(test_params)
         self.assertDictEqual(settings_expect, observed.settings)
@@ -94,7 +113,7 @@ class ConfigProgram(ConfigTestSetup):
 
             NB: as this is a new instance, the CLA gets into the config file
         """
-        test_params = Params(config_file='defaults_dbname_cla.cfg',
+        test_params = Params(self.directory, config_file='defaults_dbname_cla.cfg',
                              dbname='fliggle.sqlite', force=True, load=True)
 
         settings_expect = config.DEFAULTS
@@ -113,7 +132,7 @@ class ConfigProgram(ConfigTestSetup):
             skillsdb config -Fl --dbname new_db.sqlite file_init_test.cfg 
         """
         # initialize a clean database
-        test_params = Params(config_file='file_init_test.cfg',
+        test_params = Params(self.directory, config_file='file_init_test.cfg',
                              dbname='file_init_test.sqlite',
                              force=True, load=True)
         settings_expect = config.DEFAULTS
@@ -145,7 +164,7 @@ class ConfigProgram(ConfigTestSetup):
 
             skillsdb config -Fs --dbname new_db.sqlite file_init_test.cfg
         """
-        test_params = Params(config_file='file_init_save_test.cfg',
+        test_params = Params(self.directory, config_file='file_init_save_test.cfg',
                              dbname='file_init_save_test.sqlite',
                              force=True, save=True)
         settings_expect = config.DEFAULTS
@@ -168,7 +187,20 @@ class ConfigProgram(ConfigTestSetup):
         self.remove_files([file_, obs1_settings['dbname'],
                            obs2_settings['dbname']])
 
-        
-        
-
+    def test_memory_database(self):
+        """ A memory database, with the config file's pragmas, writes no
+            database file
 
+            skillsdb config -Fl --dbtype memory
+        """
+        test_params = Params(self.directory, config_file='memory.cfg', dbtype='memory',
+                             force=True, load=True)
+        observed = config.Config(test_params)
+        session = observed.get_session()
+        session.add(models.Parent(first_name='Fred', second_name='Flintstone'))
+        session.commit()
+        reader = observed.get_session(readonly=True)
+        self.assertEqual(reader.query(models.Parent).count(), 1)
+        reader.close()
+        session.close()
+        self.assertEqual(os.listdir(self.directory), ['memory.cfg'])
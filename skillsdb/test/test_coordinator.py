@@ -0,0 +1,108 @@
+"""
+Test coordinator.py module
+"""
+import gc
+import os
+import time
+import threading
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from skillsdb import (coordinator, manage, utils, config, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+def busy():
+    return OperationalError('INSERT', (), Exception('database is locked'))
+
+class Retry(ModelsTestSetup):
+    """ Transactions finding the database busy are run again
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.attempts = 0
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def work(self, failures, error=busy):
+        def add(session):
+            self.attempts += 1
+            session.add(models.Parent(first_name='Fred', second_name='Flintstone'))
+            session.flush()
+            if self.attempts <= failures:
+                raise error()
+            return self.attempts
+        return add
+
+    def test_retried(self):
+        self.assertEqual(coordinator.transaction(self.session, self.work(2), base=0), 3)
+        self.assertEqual(self.session.query(models.Parent).count(), 1)
+
+    def test_gives_up(self):
+        self.assertRaises(OperationalError, coordinator.transaction, self.session,
+                          self.work(3), retries=2, base=0)
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(self.session.query(models.Parent).count(), 0)
+
+    def test_other_errors(self):
+        other = lambda: OperationalError('INSERT', (), Exception('no such table: parent'))
+        self.assertRaises(OperationalError, coordinator.transaction, self.session,
+                          self.work(1, other), base=0)
+        self.assertEqual(self.attempts, 1)
+
+    def test_backoff(self):
+        self.assertTrue(0.05 <= coordinator.backoff(2, 0.1) <= 0.2)
+        self.assertTrue(coordinator.backoff(20) <= coordinator.MAX_BACKOFF)
+
+class Queue(ModelsTestSetup):
+    """ Commands submitted to the writer are run by it
+    """
+    dbtype = 'sqlite'
+
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.filename = os.path.join(self.path, config.FNAME)
+        self.session_config = config.Config(utils.Params(self.filename, load=True, force=True))
+
+    def start(self, count):
+        writer = threading.Thread(target=coordinator.serve, args=(self.filename, count))
+        writer.start()
+        while writer.is_alive() and not os.path.exists(coordinator.address(self.filename)):
+            time.sleep(0.01)
+        return writer
+
+    def stop(self, writer):
+        writer.join()
+        # Sessions of the writer's commands are closed as they are collected
+        gc.collect()
+        self.assertFalse(os.path.exists(coordinator.address(self.filename)))
+        self.assertFalse(os.path.exists(coordinator.address(self.filename, coordinator.KEY)))
+
+    def test_submit(self):
+        argv = ['manage', '--add', '--queue', '--parent', '--config', self.filename,
+                'first_name=Fred', 'second_name=Flintstone']
+        self.assertEqual(coordinator.submit(argv, self.filename), None)
+
+        writer = self.start(1)
+        for name in [coordinator.SOCKET, coordinator.KEY]:
+            mode = os.stat(coordinator.address(self.filename, name)).st_mode
+            self.assertEqual(mode & 0777, 0600)
+        self.assertEqual(coordinator.submit(argv, self.filename), 0)
+        self.stop(writer)
+
+        session = self.session_config.get_session()
+        self.assertEqual([p.first_name for p in session.query(models.Parent)], ['Fred'])
+        session.close()
+
+    def test_rejected(self):
+        writer = self.start(3)
+        other = os.path.join(self.path, 'other.cfg')
+        for argv, config_file in [(['config', '--save', other], self.filename),
+                                  (['manage', '--search', '--parent'], other),
+                                  (['manage', '--bogus'], self.filename)]:
+            self.assertRaises(coordinator.WriterError, coordinator.submit, argv, config_file)
+        self.stop(writer)
+        self.assertFalse(os.path.exists(other))
@@ -0,0 +1,104 @@
+"""
+Test dedupe.py module
+"""
+import unittest
+
+from skillsdb import (dedupe, stats, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class DedupeParents(ModelsTestSetup):
+    """ Block, score and merge duplicate parents
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        wilma.partner = fred
+        fred.address = models.Address(postcode='CB21 4EE', home_email='fred@rock.com')
+        pebbles = models.Child(first_name='Pebbles', second_name='Flintstone')
+        pebbles.parents = [fred, wilma]
+        fred.skills = [models.Skill(name='bowling')]
+        session.add(pebbles)
+        session.commit()
+
+        # Fred, entered again the next term
+        freddy = models.Parent(first_name='Freddie', second_name='Flint-stone')
+        freddy.address = models.Address(postcode='cb214ee', work_email='FRED@rock.com')
+        freddy.skills = [models.Skill(name='quarrying')]
+        freddy.children = [models.Child(first_name='Bam Bam', second_name='Flintstone')]
+        session.add(freddy)
+        session.commit()
+        self.ids = dict((p.first_name, p.id) for p in session.query(models.Parent))
+        session.close()
+
+    def test_normalise(self):
+        self.assertEqual(dedupe.normalise(' Flint-Stone '), 'flintstone')
+        self.assertEqual(dedupe.normalise(None), '')
+
+    def test_candidates(self):
+        session = self.get_session()
+        people = dedupe.load_people(session, models.Parent)
+        session.close()
+        pairs = dedupe.candidates(people, threshold=0.7)
+        self.assertEqual([pair[1:] for pair in pairs],
+                         [(self.ids['Fred'], self.ids['Freddie'])])
+
+    def test_merge(self):
+        keep, drop = self.ids['Fred'], self.ids['Freddie']
+        session = self.get_session()
+        dedupe.merge(session, models.Parent, [(keep, drop)])
+        session.close()
+
+        session = self.get_session()
+        fred = session.query(models.Parent).get(keep)
+        self.assertEqual(session.query(models.Parent).count(), 2)
+        self.assertEqual(sorted(s.name for s in fred.skills), ['bowling', 'quarrying'])
+        self.assertEqual(sorted(c.first_name for c in fred.children), ['Bam Bam', 'Pebbles'])
+        self.assertEqual(fred.address.postcode, 'CB21 4EE')
+        self.assertEqual(session.query(models.Address).count(), 1)
+        self.assertEqual(fred.other.first_name, 'Wilma')
+        session.close()
+
+    def test_merge_unknown(self):
+        session = self.get_session()
+        self.assertRaises(dedupe.DedupeError, dedupe.merge, session, models.Parent,
+                          [(self.ids['Fred'], 99)])
+        session.close()
+
+    def test_merge_chained(self):
+        fred, freddie, wilma = self.ids['Fred'], self.ids['Freddie'], self.ids['Wilma']
+        session = self.get_session()
+        for pairs in [[(fred, freddie), (freddie, wilma)], [(fred, freddie), (wilma, freddie)]]:
+            self.assertRaises(dedupe.DedupeError, dedupe.merge, session, models.Parent, pairs)
+        self.assertEqual(session.query(models.Parent).count(), 3)
+        # Dropping into a record merged later is a chain in order
+        dedupe.merge(session, models.Parent, [(freddie, wilma), (fred, freddie)])
+        self.assertEqual([p.id for p in session.query(models.Parent)], [fred])
+        session.close()
+
+    def test_merge_partnered(self):
+        session = self.get_session()
+        betty = models.Parent(first_name='Betty', second_name='Rubble',
+                              parent_id=self.ids['Freddie'])
+        session.add(betty)
+        session.commit()
+        dedupe.merge(session, models.Parent, [(self.ids['Fred'], self.ids['Freddie'])])
+        session.close()
+
+        # Fred keeps Wilma, Betty is left without a partner
+        session = self.get_session()
+        fred = models.Parent.get(session, self.ids['Fred'])
+        self.assertEqual((fred.partner, fred.other.first_name), (None, 'Wilma'))
+        self.assertEqual(session.query(models.Parent).filter_by(first_name='Betty').one().partner,
+                         None)
+        session.close()
+
+    def test_merge_statistics(self):
+        session = self.get_session()
+        dedupe.merge(session, models.Parent, [(self.ids['Fred'], self.ids['Freddie'])])
+        counts = sorted(stats.lookup(session))
+        stats.rebuild(session)
+        self.assertEqual(counts, sorted(stats.lookup(session)))
+        self.assertTrue(('parent', '', 2) in counts)
+        session.close()
@@ -0,0 +1,47 @@
+"""
+Test explain.py module
+"""
+import unittest
+
+from skillsdb import (explain, views, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Explain(ModelsTestSetup):
+    """ Queries are recorded, and full scans of searched columns flagged
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.session.add(models.Parent(first_name='Fred', second_name='Flintstone'))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def explain(self, terms):
+        with explain.Recorder(self.session.get_bind()) as recorder:
+            self.session.query(models.Parent).filter(
+                views.build_criterion(models.Parent, terms)).all()
+        self.assertEqual(len(recorder.statements), 1)
+        return explain.explain(self.session.connection(), recorder.statements)[0]
+
+    def test_index_used(self):
+        statement, parameters, steps, advice = self.explain([{'household_id':(3, '==')}])
+        self.assertEqual(list(parameters), [3])
+        self.assertTrue('ix_parent_household_id' in steps[0])
+        self.assertEqual(advice, [])
+
+    def test_full_scans(self):
+        statement, parameters, steps, advice = self.explain([{'first_name':('Fr', '.like(')}])
+        self.assertTrue(steps[0].startswith('SCAN'))
+        self.assertEqual(len(advice), 1)
+        self.assertTrue('parent.first_name has no index' in advice[0])
+
+        statement, parameters, steps, advice = self.explain([{'household_id':(3, '!=')}])
+        self.assertTrue('has index ix_parent_household_id' in advice[0])
+
+    def test_recorder_disabled(self):
+        with explain.Recorder(self.session.get_bind(), False) as recorder:
+            self.session.query(models.Parent).all()
+        self.assertEqual(recorder.statements, [])
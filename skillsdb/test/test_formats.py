@@ -0,0 +1,65 @@
+"""
+Test formats.py module
+"""
+import unittest
+import json
+import datetime
+from StringIO import StringIO
+
+from skillsdb import (formats, models)
+
+class FormatRecords(unittest.TestCase):
+    """ Records are serialised from column values
+    """
+    def setUp(self):
+        self.created = datetime.datetime(2014, 3, 29, 9, 44, 19)
+        self.records = [
+            models.Parent(id=1, first_name='Fred', second_name='Flintstone',
+                          created=self.created),
+            models.Parent(id=2, first_name='Wilma', second_name='Flintstone',
+                          parent_id=1, created=self.created)]
+
+    def write(self, fmt):
+        stream = StringIO()
+        count = formats.write_records(self.records, fmt, models.Parent, stream)
+        self.assertEqual(count, 2)
+        return stream.getvalue()
+
+    def test_columns_primary_key_first(self):
+        keys = formats.columns(models.Parent)
+        self.assertEqual(keys[0], 'id')
+        self.assertEqual(sorted(keys), sorted(
+            ['id', 'created', 'updated', 'first_name', 'second_name', 'parent_id',
+             'household_id']))
+
+    def test_jsonl(self):
+        lines = self.write('jsonl').splitlines()
+        self.assertEqual(len(lines), 2)
+        row = json.loads(lines[1])
+        self.assertEqual(row['first_name'], 'Wilma')
+        self.assertEqual(row['parent_id'], 1)
+        self.assertEqual(row['created'], '2014-03-29T09:44:19')
+
+    def test_json(self):
+        rows = json.loads(self.write('json'))
+        self.assertEqual([r['id'] for r in rows], [1, 2])
+
+    def test_json_empty(self):
+        stream = StringIO()
+        formats.write_records([], 'json', models.Parent, stream)
+        self.assertEqual(json.loads(stream.getvalue()), [])
+
+    def test_csv(self):
+        lines = self.write('csv').splitlines()
+        self.assertEqual(lines[0].split(','), formats.columns(models.Parent))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('1,'))
+
+    def test_table(self):
+        lines = self.write('table').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('id'))
+        self.assertTrue(lines[1].startswith('--'))
+
+    def test_unknown_format(self):
+        self.assertRaises(formats.FormatError, formats.RecordWriter, 'xml', ['id'])
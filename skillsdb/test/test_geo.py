@@ -0,0 +1,95 @@
+"""
+Test geo.py module
+"""
+import unittest
+import StringIO
+
+from skillsdb import (geo, bulk, views, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+# Cambridge area postcodes, and one terminated postcode without a location
+DIRECTORY = """pcds,lat,long
+CB21 4EE,52.148,0.254
+CB1 1AA,52.200,0.130
+CB2 1TN,52.203,0.118
+SG8 1AA,52.042,-0.021
+CB9 9ZZ,99.999999,0.000000
+"""
+
+class Geohash(unittest.TestCase):
+    """ Points and cells
+    """
+    def test_geohash(self):
+        self.assertEqual(geo.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.geohash(57.64911, 10.40744), 'u4pruydqq')
+
+    def test_miles(self):
+        self.assertAlmostEqual(geo.miles(52.200, 0.130, 52.203, 0.118), 0.55, 2)
+
+    def test_covering_cells(self):
+        cells = geo.covering_cells(52.2, 0.13, 2)
+        self.assertTrue(len(cells) <= geo.MAX_CELLS)
+        self.assertTrue(geo.geohash(52.2, 0.13).startswith(tuple(cells)))
+        self.assertTrue(geo.geohash(52.225, 0.16).startswith(tuple(cells)))
+
+class Proximity(ModelsTestSetup):
+    """ Addresses are located from postcodes, and found by distance
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.ids = {}
+        for name, postcode in [('Fred', 'CB21 4EE'), ('Wilma', 'cb11aa'), ('Barney', 'SG8 1AA')]:
+            parent = models.Parent(first_name=name, second_name='Flintstone')
+            parent.address = models.Address(postcode=postcode)
+            self.session.add(parent)
+            self.session.commit()
+            self.ids[name] = parent.id
+        self.assertEqual(geo.load(self.session, StringIO.StringIO(DIRECTORY)), 4)
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def near(self, place, radius):
+        return sorted(self.ids[name] for name in self.ids if self.ids[name] in
+                      geo.parents_near(self.session.connection(), place, radius))
+
+    def test_within(self):
+        self.assertEqual(self.near('CB2 1TN', 1), [self.ids['Wilma']])
+        self.assertEqual(self.near('CB2 1TN', 8), [self.ids['Fred'], self.ids['Wilma']])
+        self.assertEqual(self.near('52.2,0.13', 0.1), [self.ids['Wilma']])
+        self.assertRaises(geo.GeoError, geo.locate, self.session.connection(), 'CB9 9ZZ')
+
+    def test_nearest(self):
+        found = geo.nearest(self.session.connection(), 52.042, -0.021, 2)
+        self.assertEqual([parent_id for distance, id, parent_id in found],
+                         [self.ids['Barney'], self.ids['Wilma']])
+
+    def test_located_as_written(self):
+        address = models.Address.get_by_parent_id(self.session, self.ids['Barney'])
+        address.postcode = 'CB2 1TN'
+        self.session.commit()
+        self.assertEqual(self.near('CB1 1AA', 1), [self.ids['Wilma'], self.ids['Barney']])
+
+        bulk.update(self.session, models.Address, models.Address.postcode == 'CB2 1TN',
+                    {'postcode':'XX1 1XX'})
+        self.session.commit()
+        self.assertEqual(models.Address.get(self.session, address.id).grid, None)
+
+    def test_search(self):
+        terms = [{'postcode':('CB1 1AA:10', 'near')}]
+        found = self.session.query(models.Address).filter(
+            views.build_criterion(models.Address, terms, self.session)).all()
+        self.assertEqual(sorted(a.parent_id for a in found), [self.ids['Fred'], self.ids['Wilma']])
+        self.assertRaises(views.ViewError, views.build_criterion, models.Address, terms)
+
+    def test_criterion_in_sql(self):
+        conn = self.session.connection()
+        for radius in [0.1, 1, 8, 30]:
+            criterion = geo.near_criterion(conn, 'CB2 1TN:%s' % radius)
+            # Grid ranges and a distance, not a list of address IDs
+            self.assertFalse(' IN ' in str(criterion))
+            found = self.session.query(models.Address.id).filter(criterion).all()
+            self.assertEqual(sorted(id for id, in found), sorted(
+                id for distance, id, parent_id in geo.within(conn, 52.203, 0.118, radius)))
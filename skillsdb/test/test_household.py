@@ -0,0 +1,66 @@
+"""
+Test household.py module
+"""
+import unittest
+
+from skillsdb import (household, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Households(ModelsTestSetup):
+    """ Households are kept up to date on flush and may be rebuilt
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        session = self.get_session()
+        self.fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        self.wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        self.wilma.partner = self.fred
+        self.barney = models.Parent(first_name='Barney', second_name='Rubble')
+        self.pebbles = models.Child(first_name='Pebbles', second_name='Flintstone', year=3)
+        self.pebbles.parents = [self.fred, self.wilma]
+        session.add_all([self.pebbles, self.barney])
+        session.commit()
+        self.session = session
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def households(self):
+        self.session.expire_all()
+        return dict((p.first_name, p.household_id) for p in
+                    self.session.query(models.Parent).all() + self.session.query(models.Child).all())
+
+    def test_maintained_on_flush(self):
+        ids = self.households()
+        self.assertEqual(ids['Fred'], self.fred.id)
+        self.assertEqual(ids['Wilma'], self.fred.id)
+        self.assertEqual(ids['Pebbles'], self.fred.id)
+        self.assertEqual(ids['Barney'], self.barney.id)
+
+        # Barney becomes a step parent of Pebbles
+        self.pebbles.parents.append(self.barney)
+        self.session.commit()
+        self.assertEqual(self.households()['Barney'], self.fred.id)
+
+        self.session.delete(self.pebbles)
+        self.session.commit()
+        ids = self.households()
+        self.assertEqual(ids['Wilma'], self.fred.id)
+        self.assertEqual(ids['Barney'], self.barney.id)
+
+    def test_rebuild(self):
+        parent = models.Parent.__table__
+        self.session.execute(parent.update().values(household_id=None))
+        self.session.commit()
+        self.assertEqual(household.rebuild(self.session), 2)
+        ids = self.households()
+        self.assertEqual(ids['Wilma'], self.fred.id)
+        self.assertEqual(ids['Pebbles'], self.fred.id)
+
+    def test_members_by_year(self):
+        ids = self.session.query(models.Child.household_id).filter(models.Child.year == 3)
+        rows = list(household.members(self.session, ids.subquery()))
+        self.assertEqual([row[1:3] for row in rows],
+                         [['parent', self.fred.id], ['parent', self.wilma.id],
+                          ['child', self.pebbles.id]])
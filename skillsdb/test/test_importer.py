@@ -0,0 +1,88 @@
+"""
+Test importer.py module
+"""
+import unittest
+from StringIO import StringIO
+
+from skillsdb import (importer, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+PARENTS = """first_name,second_name,pid
+Fred,Flintstone,
+Betty,Rubble,
+
+Barney,Rubble,x
+Wilma,Flintstone,1
+"""
+
+FREETIMES = """day,am_start,am_end,pid
+Monday,09:00,12:00,1
+Tuesday,9,12,1
+Friday,,,2
+Friday,,,9
+Friday,,,
+"""
+
+UPSERTS = """id,first_name,second_name
+2,Elizabeth,
+x,Bamm-Bamm,Rubble
+10,Pebbles,Flintstone
+,Dino,Flintstone
+"""
+
+class ImportRecords(ModelsTestSetup):
+    """ Validate in parallel, write in order
+    """
+    def import_csv(self, text, table, workers=1):
+        session = self.get_session()
+        written, errors = importer.run(StringIO(text), table, session, workers,
+                                       chunk_size=2, batch_size=2)
+        session.close()
+        return written, errors
+
+    def test_import_parents(self):
+        written, errors = self.import_csv(PARENTS, models.Parent)
+        self.assertEqual(written, 3)
+        self.assertEqual([line for line, message in errors], [5])
+
+        session = self.get_session()
+        wilma = session.query(models.Parent).filter_by(first_name='Wilma').one()
+        self.assertEqual(wilma.partner.first_name, 'Fred')
+        session.close()
+
+    def test_invalid_utf8(self):
+        text = "first_name,second_name\nJos\xc3\xa9,Flintstone\nJos\xe9,Rubble\n"
+        written, errors = self.import_csv(text, models.Parent)
+        self.assertEqual(written, 1)
+        self.assertEqual([line for line, message in errors], [3])
+        self.assertTrue('first_name is not UTF-8' in errors[0][1])
+
+        session = self.get_session()
+        self.assertEqual([p.first_name for p in session.query(models.Parent)], [u'Jos\xe9'])
+        session.close()
+
+    def test_import_parallel(self):
+        self.import_csv(PARENTS, models.Parent)
+        written, errors = self.import_csv(FREETIMES, models.Freetime, workers=2)
+        self.assertEqual(written, 2)
+        self.assertEqual([line for line, message in errors], [3, 5, 6])
+
+        session = self.get_session()
+        monday = session.query(models.Freetime).filter_by(day='Monday').one()
+        self.assertEqual(monday.get_period, 'Day')
+        self.assertEqual([p.first_name for p in monday.parents], ['Fred'])
+        session.close()
+
+    def test_import_upserts(self):
+        self.import_csv(PARENTS, models.Parent)
+        session = self.get_session()
+        written, errors = importer.run(StringIO(UPSERTS), models.Parent, session,
+                                       1, chunk_size=2, batch_size=2, upserts=True)
+        self.assertEqual(written, 3)
+        self.assertEqual([line for line, message in errors], [3])
+
+        names = dict(session.query(models.Parent.id, models.Parent.first_name))
+        self.assertEqual(names[2], 'Elizabeth')
+        self.assertEqual(names[10], 'Pebbles')
+        self.assertEqual(len(names), 5)
+        session.close()
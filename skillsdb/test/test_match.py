@@ -0,0 +1,73 @@
+"""
+Test match.py module
+"""
+import unittest
+
+from skillsdb import (match, vocabulary, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+SKILLS = {1:set(['first aid', 'woodwork']), 2:set(['first aid']), 3:set(['painting'])}
+SLOTS = {1:set([('Friday', 'AM'), ('Friday', 'PM')]), 2:set([('Friday', 'PM')]),
+         4:set([('Monday', 'AM')])}
+REQUIREMENTS = [(['first aid'], []), (['first aid'], [('Friday', 'PM')]),
+                (['first aid', 'woodwork'], [('Friday', 'AM')]), ([], [('Monday', 'AM')]),
+                (['juggling'], []), ([], [])]
+
+class Matching(unittest.TestCase):
+    """ Parents with every skill, free in every slot
+    """
+    def test_slot_keys(self):
+        self.assertEqual(match.slot_keys('friday pm'), [('Friday', 'PM')])
+        self.assertEqual(match.slot_keys('Friday'), [('Friday', 'AM'), ('Friday', 'PM')])
+        self.assertRaises(match.MatchError, match.slot_keys, 'Friday evening')
+
+    def check_engine(self, engine):
+        matcher = match.Matcher([1, 2, 3, 4], SKILLS, SLOTS, engine)
+        self.assertEqual(matcher.match(['first aid']), [1, 2])
+        self.assertEqual(matcher.match(['first aid'], [('Friday', 'AM')]), [1])
+        self.assertEqual(matcher.match(['juggling']), [])
+        self.assertEqual(matcher.coverage(REQUIREMENTS), [2, 2, 1, 1, 0, 4])
+
+    def test_python(self):
+        self.check_engine('python')
+
+    @unittest.skipIf(match.numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        self.check_engine('numpy')
+
+    def test_engine(self):
+        self.assertRaises(match.MatchError, match.Matcher, [], {}, {}, 'fortran')
+        if match.numpy is None:
+            self.assertRaises(match.MatchError, match.Matcher, [], {}, {}, 'numpy')
+
+class Load(ModelsTestSetup):
+    """ Skills and slots of owned and linked records
+    """
+    def test_load(self):
+        session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        barney = models.Parent(first_name='Barney', second_name='Rubble')
+        fred.skills = [models.Skill(name='First Aid')]
+        session.add_all([fred, barney])
+        session.commit()
+        session.add(models.Freetime(day='friday', parent_id=barney.id,
+                                    am_end=models.TIME_AM_START))
+        session.commit()
+
+        parent_ids, skills, slots = match.load(session)
+        self.assertEqual(parent_ids, [fred.id, barney.id])
+        self.assertEqual(dict(skills), {fred.id:set(['first aid'])})
+        self.assertEqual(dict(slots), {barney.id:set([('Friday', 'PM')])})
+        session.close()
+
+    def test_aliases(self):
+        session = self.get_session()
+        session.add(models.Parent(first_name='Fred', second_name='Flintstone',
+                                  skills=[models.Skill(name='First Aid')]))
+        session.commit()
+        vocabulary.add_alias(session, 'CPR', 'first aid')
+        names = match.aliases(session)
+        self.assertEqual(names, {'cpr':'first aid'})
+        self.assertEqual(match.parse_requirement([' cpr', 'Woodwork'], ['Friday PM'], names),
+                         (['first aid', 'woodwork'], [('Friday', 'PM')]))
+        session.close()
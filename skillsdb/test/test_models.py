@@ -0,0 +1,167 @@
+"""
+Test models.py module
+"""
+import unittest
+import shutil
+import tempfile
+
+from sqlalchemy.exc import OperationalError
+
+from skillsdb import models
+
+class ModelsTestSetup(unittest.TestCase):
+    """ Common methods for tests, each test gets its own database, in
+        memory unless the test needs files
+    """
+    dbtype = 'memory'
+
+    def setUp(self):
+        if self.dbtype == 'memory':
+            # Names the test's databases, no directory is made
+            self.path = self.id()
+        else:
+            self.path = tempfile.mkdtemp(prefix='skillsdb_test_')
+
+    def tearDown(self):
+        models.dispose()
+        if self.dbtype != 'memory':
+            shutil.rmtree(self.path)
+
+    def get_session(self, **kwargs):
+        return models.init(uri='skillsdb.sqlite', path=self.path, dbtype=self.dbtype,
+                           user='skills', passwd='skills', host='', **kwargs)
+
+class SqliteSessions(ModelsTestSetup):
+    """ Connection pragmas and read only sessions
+    """
+    dbtype = 'sqlite'
+
+    def test_pragmas_applied(self):
+        session = self.get_session(pragmas={'journal_mode':'wal', 'busy_timeout':'2500'})
+        self.assertEqual(session.execute('PRAGMA journal_mode').scalar(), 'wal')
+        self.assertEqual(session.execute('PRAGMA busy_timeout').scalar(), 2500)
+        session.close()
+
+    def test_invalid_pragma(self):
+        self.assertRaises(ValueError, models.sqlite_pragmas, journal_mode='fast')
+        self.assertRaises(ValueError, models.sqlite_pragmas, cache_size='lots')
+        self.assertRaises(ValueError, models.sqlite_pragmas, page_size='4096')
+
+    def test_readonly_session(self):
+        session = self.get_session()
+        session.add(models.Parent(first_name='Fred', second_name='Flintstone'))
+        session.commit()
+        session.close()
+
+        reader = self.get_session(readonly=True)
+        self.assertEqual(reader.query(models.Parent).count(), 1)
+        reader.add(models.Parent(first_name='Wilma', second_name='Flintstone'))
+        self.assertRaises(OperationalError, reader.commit)
+        reader.close()
+
+    def test_readonly_upgrade(self):
+        session = self.get_session()
+        engine = session.get_bind()
+        session.close()
+        # A skill table of an earlier version, before updated and name_key
+        engine.execute('DROP TABLE skill')
+        engine.execute('CREATE TABLE skill (id INTEGER PRIMARY KEY, name VARCHAR(100), '
+                       'parent_id INTEGER, created DATETIME)')
+        engine.execute("INSERT INTO skill (name) VALUES ('Cooking')")
+        models.dispose()
+
+        reader = self.get_session(readonly=True)
+        self.assertEqual([s.name_key for s in reader.query(models.Skill)], ['cooking'])
+        reader.close()
+
+class TenantRouting(ModelsTestSetup):
+    """ Each tenant is routed to its own database
+    """
+    def test_tenant_dbname(self):
+        self.assertEqual(models.tenant_dbname('skillsdb.sqlite', 'st_marys'),
+                         'skillsdb_st_marys.sqlite')
+        self.assertEqual(models.tenant_dbname('skillsdb', 'oakfield'), 'skillsdb_oakfield')
+        self.assertRaises(ValueError, models.tenant_dbname, 'skillsdb.sqlite', '../other')
+
+    def test_tenants_isolated(self):
+        for tenant, name in [('oakfield', 'Fred'), ('st_marys', 'Wilma')]:
+            session = self.get_session(tenant=tenant)
+            session.add(models.Parent(first_name=name, second_name='Flintstone'))
+            session.commit()
+            session.close()
+
+        session = self.get_session(tenant='oakfield', readonly=True)
+        self.assertEqual([p.first_name for p in session.query(models.Parent)], ['Fred'])
+        session.close()
+        self.assertEqual(self.get_session().query(models.Parent).count(), 0)
+
+class Upgrade(ModelsTestSetup):
+    """ Columns and indexes added since a database was created
+    """
+    def test_add_missing_columns(self):
+        session = self.get_session()
+        engine = session.get_bind()
+        session.close()
+        engine.execute('DROP TABLE child')
+        engine.execute('CREATE TABLE child (id INTEGER PRIMARY KEY, first_name VARCHAR(50))')
+        engine.execute("INSERT INTO child (first_name) VALUES ('Pebbles')")
+
+        models.upgrade(engine)
+        inspector = models.sa.inspect(engine)
+        columns = [col['name'] for col in inspector.get_columns('child')]
+        self.assertTrue('household_id' in columns and 'year' in columns)
+        indexes = [index['name'] for index in inspector.get_indexes('child')]
+        self.assertTrue('ix_child_year' in indexes)
+        self.assertEqual(engine.execute('SELECT year FROM child').scalar(), None)
+
+class Lookups(ModelsTestSetup):
+    """ Primary key and parent ID lookups
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        fred.address = models.Address(postcode='CB21 4EE')
+        barney = models.Parent(first_name='Barney', second_name='Rubble')
+        session.add_all([fred, barney])
+        session.commit()
+        self.ids = [fred.id, barney.id]
+        session.close()
+        self.session = self.get_session()
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def test_get(self):
+        fred = models.Parent.get(self.session, self.ids[0])
+        self.assertEqual(fred.first_name, 'Fred')
+        self.assertTrue(models.Parent.get(self.session, self.ids[0]) is fred)
+        self.assertEqual(models.Parent.get(self.session, 999), None)
+        self.assertEqual(models.Child.get(self.session, self.ids[0]), None)
+
+    def test_get_by_parent_id(self):
+        address = models.Address.get_by_parent_id(self.session, self.ids[0])
+        self.assertEqual(address.postcode, 'CB21 4EE')
+        self.assertEqual(models.Address.get_by_parent_id(self.session, self.ids[1]), None)
+
+    def test_get_many(self):
+        barney = models.Parent.get(self.session, self.ids[1])
+        records = models.Parent.get_many(self.session, self.ids + [999])
+        self.assertEqual(sorted(records), sorted(self.ids))
+        self.assertTrue(records[self.ids[1]] is barney)
+        self.assertEqual(records[self.ids[0]].first_name, 'Fred')
+        self.assertEqual(models.Parent.get_many(self.session, []), {})
+
+    def test_updated_from_created(self):
+        session = self.get_session()
+        engine = session.get_bind()
+        session.close()
+        engine.execute('DROP TABLE skill')
+        engine.execute('CREATE TABLE skill (id INTEGER PRIMARY KEY, name VARCHAR(100), '
+                       'created DATETIME)')
+        engine.execute("INSERT INTO skill (name, created) VALUES ('Cooking', '2014-03-29 09:44:19')")
+
+        models.upgrade(engine)
+        self.assertEqual(engine.execute('SELECT updated FROM skill').scalar(),
+                         '2014-03-29 09:44:19')
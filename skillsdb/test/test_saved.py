@@ -0,0 +1,99 @@
+"""
+Test saved.py module
+"""
+import datetime
+
+from skillsdb import (saved, bulk, vocabulary, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class SavedSearches(ModelsTestSetup):
+    """ Matches of saved searches follow changes to parents, skills and
+        freetimes
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.ids = {}
+        for name, skill, day in [('Fred', 'Cooking', 'Friday'), ('Wilma', 'Cooking', 'Monday'),
+                                 ('Barney', 'First Aid', 'Friday')]:
+            self.ids[name] = self.add_parent(name, skill, day)
+        self.search = saved.add(self.session, 'Friday cooks', ['cooking'], ['Friday'])
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def add_parent(self, name, skill, day):
+        parent = models.Parent(first_name=name, second_name='Flintstone')
+        self.session.add(parent)
+        vocabulary.link(self.session, parent, skill)
+        parent.freetimes = [models.Freetime(day=day)]
+        self.session.commit()
+        return parent.id
+
+    def matched(self, new=False):
+        saved.refresh(self.session)
+        return sorted(parent.first_name for matched, parent in
+                      saved.matches(self.session, self.search, new))
+
+    def test_add(self):
+        self.assertEqual(self.matched(), ['Fred'])
+        self.assertRaises(saved.SavedError, saved.add, self.session, 'Friday cooks', ['x'], [])
+        self.assertRaises(saved.SavedError, saved.add, self.session, 'Nothing', [], [])
+        self.assertRaises(saved.SavedError, saved.add, self.session, 'Bad', [], ['Friday XM'])
+
+    def test_changes(self):
+        self.ids['Pebbles'] = self.add_parent('Pebbles', 'cooking', 'Friday')
+        self.assertEqual(self.matched(), ['Fred', 'Pebbles'])
+
+        # Freetimes changed, linked and deleted
+        wilma = models.Parent.get(self.session, self.ids['Wilma'])
+        wilma.freetimes[0].day = 'Friday'
+        self.session.commit()
+        self.assertEqual(self.matched(), ['Fred', 'Pebbles', 'Wilma'])
+        bulk.delete(self.session, models.Freetime, models.Freetime.day == 'Friday')
+        self.session.commit()
+        self.assertEqual(self.matched(), [])
+
+        barney = models.Parent.get(self.session, self.ids['Barney'])
+        barney.freetimes.append(models.Freetime(day='Friday'))
+        vocabulary.link(self.session, barney, 'cooking')
+        self.session.commit()
+        self.assertEqual(self.matched(), ['Barney'])
+        barney.skills = []
+        self.session.commit()
+        self.assertEqual(self.matched(), [])
+
+    def test_aliases(self):
+        search = saved.add(self.session, 'Friday chefs', ['chef'], ['Friday'])
+        self.assertEqual(saved.matches(self.session, search), [])
+        # Parents unchanged since long before the refresh
+        earlier = datetime.datetime.now() - datetime.timedelta(hours=1)
+        for table in [models.Parent, models.Skill, models.Freetime]:
+            self.session.execute(table.__table__.update().values(updated=earlier))
+        self.session.commit()
+        vocabulary.add_alias(self.session, 'chef', 'cooking')
+        saved.refresh(self.session)
+        self.assertEqual([parent.first_name for matched, parent in
+                          saved.matches(self.session, search)], ['Fred'])
+
+    def test_deleted_parent(self):
+        self.session.delete(models.Parent.get(self.session, self.ids['Fred']))
+        self.session.commit()
+        self.assertEqual(self.matched(), [])
+
+    def test_changed_parents(self):
+        since = datetime.datetime.now()
+        fred = models.Parent.get(self.session, self.ids['Fred'])
+        fred.freetimes[0].day = 'Sunday'
+        self.session.commit()
+        ids, records = saved.changed_parents(self.session.connection(), since)
+        self.assertEqual((ids, records), (set([self.ids['Fred']]), True))
+
+    def test_new_matches(self):
+        self.search.checked = datetime.datetime.now()
+        self.session.commit()
+        self.assertEqual(self.matched(new=True), [])
+        self.add_parent('Pebbles', 'cooking', 'Friday')
+        self.assertEqual(self.matched(new=True), ['Pebbles'])
+        self.assertEqual(saved.refresh(self.session, rebuild=True), 0)
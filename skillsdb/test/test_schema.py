@@ -0,0 +1,48 @@
+"""
+Test schema.py module
+"""
+import unittest
+import datetime
+
+from skillsdb import (schema, views, models)
+
+class Coerce(unittest.TestCase):
+    """ Input text is converted to column types
+    """
+    def test_registry(self):
+        fields = schema.for_table(models.Freetime)
+        self.assertTrue(schema.for_table(models.Freetime) is fields)
+        self.assertTrue('am_start' in fields.keys)
+        self.assertFalse('parents' in fields.keys)
+        self.assertFalse('id' in fields.writable)
+
+    def test_values(self):
+        values = schema.for_table(models.Freetime).values(
+            [('day', 'Monday'), ('am_start', '9:30'), ('updated', '2014-03-29 10:00')])
+        self.assertEqual(values['day'], 'Monday')
+        self.assertEqual(values['am_start'].time(), datetime.time(9, 30))
+        self.assertEqual(values['updated'], datetime.datetime(2014, 3, 29, 10, 0))
+        values = schema.for_table(models.Child).values([('year', '6'), ('household_id', '')])
+        self.assertEqual(values, {'year':6, 'household_id':None})
+
+    def test_invalid(self):
+        fields = schema.for_table(models.Parent)
+        self.assertRaises(schema.SchemaError, fields.coerce, 'first_name', 'x' * 51)
+        self.assertRaises(schema.SchemaError, fields.coerce, 'household_id', 'two')
+        self.assertRaises(schema.SchemaError, fields.coerce, 'skills', 'cooking')
+        self.assertRaises(schema.SchemaError, fields.values, [('id', '1')], fields.writable)
+        self.assertRaises(schema.SchemaError, schema.for_table(models.Freetime).coerce,
+                          'am_start', '9')
+
+class ViewInput(unittest.TestCase):
+    """ Search terms compared for equality are coerced, others checked
+    """
+    def test_terms(self):
+        view = views.View.__new__(views.View)
+        fields = schema.for_table(models.Child)
+        terms = view.get_input_retrieve(['year=6,equals', 'AND', 'first_name=Pe,like'], fields)
+        self.assertEqual(terms, [{'first_name':('Pe', '.like(')}, views.CONDITIONS['AND'],
+                                 {'year':(6, '==')}])
+        self.assertRaises(views.ViewError, view.get_input_retrieve, ['year=six,equals'], fields)
+        self.assertRaises(views.ViewError, view.get_input_retrieve, ['age=6,like'], fields)
+        self.assertRaises(views.ViewError, view.get_input_general, ['year=6=7'], fields)
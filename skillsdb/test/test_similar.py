@@ -0,0 +1,58 @@
+"""
+Test similar.py module
+"""
+import unittest
+
+from skillsdb import (similar, views, vocabulary, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+SKILLS = ['Woodwork', 'Woodworking', 'Wood turning', 'First Aid', 'Painting', 'Paint mixing']
+
+class Similar(ModelsTestSetup):
+    """ Skills spelt alike, from the trigram index
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.session.add_all([models.Skill(name=name) for name in SKILLS])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def names(self, text, **kwargs):
+        return [skill.name for skill, score in similar.search(self.session, text, **kwargs)]
+
+    def test_grams(self):
+        self.assertEqual(sorted(similar.grams('First-Aid')),
+                         [' ai', ' fi', 'aid', 'fir', 'id ', 'irs', 'rst', 'st '])
+
+    def test_search(self):
+        self.assertEqual(similar.refresh(self.session), len(SKILLS))
+        self.assertEqual(self.names('woodwork')[:2], ['Woodwork', 'Woodworking'])
+        self.assertEqual(self.names('woodwrk')[0], 'Woodwork')
+        self.assertEqual(self.names('woodwork', k=1), ['Woodwork'])
+        self.assertEqual(self.names('juggling'), [])
+        self.assertRaises(similar.SimilarError, similar.query, '--')
+
+    def test_refresh(self):
+        similar.refresh(self.session)
+        self.assertEqual(similar.refresh(self.session), 0)
+        self.session.add(models.Skill(name='Juggling'))
+        self.session.commit()
+        self.assertEqual(similar.refresh(self.session), 1)
+        self.assertEqual(self.names('juggler'), ['Juggling'])
+
+        vocabulary.add_alias(self.session, 'carpentry', 'woodwork')
+        similar.refresh(self.session)
+        self.assertEqual(self.names('carpenter')[0], 'Woodwork')
+
+    def test_criterion(self):
+        similar.refresh(self.session)
+        terms = [{'name':('paint', 'similar')}]
+        names = [skill.name for skill in self.session.query(models.Skill).filter(
+            views.build_criterion(models.Skill, terms))]
+        self.assertEqual(sorted(names), ['Paint mixing', 'Painting'])
+        self.assertRaises(views.ViewError, views.build_criterion, models.Parent,
+                          [{'first_name':('Fred', 'similar')}])
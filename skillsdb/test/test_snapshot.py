@@ -0,0 +1,118 @@
+"""
+Test snapshot.py module
+"""
+import unittest
+import time
+import datetime
+
+from skillsdb import (snapshot, bulk, vocabulary, changes, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Snapshot(ModelsTestSetup):
+    """ Lookups from memory, refreshed from changes
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.fred = self.add_parent('Fred', 'First Aid', 'Friday', 'CB21 4EE')
+        self.barney = self.add_parent('Barney', 'Woodwork', 'Friday', 'SG8 1AA')
+        self.directory = snapshot.Snapshot()
+        self.directory.refresh(self.session)
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def add_parent(self, name, skill, day, postcode):
+        parent = models.Parent(first_name=name, second_name='Flintstone')
+        self.session.add(parent)
+        self.session.commit()
+        self.session.add_all([
+            models.Skill(name=skill, parent_id=parent.id),
+            models.Freetime(day=day, parent_id=parent.id, pm_end=models.TIME_PM_START),
+            models.Address(postcode=postcode, parent_id=parent.id)])
+        self.session.commit()
+        return parent.id
+
+    def names(self, **kwargs):
+        return [parent.first_name for parent in self.directory.find(**kwargs)]
+
+    def test_find(self):
+        self.assertEqual(len(self.directory), 8)
+        self.assertEqual(self.names(skill='FIRST AID'), ['Fred'])
+        self.assertEqual(self.names(freetime='friday'), ['Fred', 'Barney'])
+        self.assertEqual(self.names(freetime='Friday AM', area='sg8'), ['Barney'])
+        self.assertEqual(self.names(freetime='Friday PM'), [])
+        self.assertEqual(self.names(), ['Fred', 'Barney'])
+        skills = self.directory.owned_by(models.Skill, self.fred)
+        self.assertEqual([skill.name for skill in skills], ['First Aid'])
+
+    def test_strings_shared(self):
+        wilma = self.add_parent('Wilma', 'first aid', 'Friday', 'CB1 1AA')
+        self.directory.refresh(self.session)
+        skills = self.directory.owned_by(models.Skill, self.fred)
+        skills += self.directory.owned_by(models.Skill, wilma)
+        self.assertTrue(skills[0].key is skills[1].key)
+
+    def test_refresh(self):
+        time.sleep(0.01)
+        skill = self.session.query(models.Skill).filter_by(parent_id=self.barney).one()
+        skill.name = 'First Aid'
+        self.session.commit()
+        bulk.delete(self.session, models.Parent, models.Parent.id == self.fred)
+        self.session.commit()
+
+        self.assertTrue(self.directory.refresh(self.session) >= 2)
+        self.assertEqual(self.names(skill='first aid'), ['Barney'])
+        self.assertEqual(self.directory.parent(self.fred), None)
+        self.assertEqual(self.directory.owned_by(models.Address, self.fred), [])
+        self.assertEqual(len(self.directory), 4)
+
+    def test_parent_deleted_by_session(self):
+        time.sleep(0.01)
+        self.session.delete(models.Parent.get(self.session, self.barney))
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.names(freetime='Friday'), ['Fred'])
+        self.assertEqual(self.directory.owned_by(models.Skill, self.barney), [])
+
+    def test_linked_skills(self):
+        time.sleep(0.01)
+        parent = models.Parent.get(self.session, self.barney)
+        vocabulary.link(self.session, parent, 'first aid')
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.names(skill='First-Aid'), ['Fred', 'Barney'])
+
+        time.sleep(0.01)
+        parent.skills = []
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.names(skill='first aid'), ['Fred'])
+
+    def test_linked_freetimes(self):
+        time.sleep(0.01)
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        wilma.freetimes = [models.Freetime(day='Monday')]
+        self.session.add(wilma)
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.names(freetime='Monday PM'), ['Wilma'])
+        self.assertEqual(len(self.directory.owned_by(models.Freetime, wilma.id)), 1)
+
+        time.sleep(0.01)
+        wilma.freetimes = []
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.names(freetime='Monday'), [])
+
+    def test_late_commit(self):
+        # A change stamped before the last refresh, committed after it
+        earlier = self.directory.watermark + changes.OVERLAP / 2
+        self.assertTrue(earlier < datetime.datetime.now())
+        p = models.Parent.__table__
+        self.session.execute(p.update().where(p.c.id == self.barney).values(
+            first_name='Bamm-Bamm', updated=earlier))
+        self.session.commit()
+        self.directory.refresh(self.session)
+        self.assertEqual(self.directory.parent(self.barney).first_name, 'Bamm-Bamm')
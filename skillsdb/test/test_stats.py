@@ -0,0 +1,63 @@
+"""
+Test stats.py module
+"""
+import unittest
+
+from skillsdb import (stats, models, views)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Statistics(ModelsTestSetup):
+    """ Counts follow flushed changes and match a rebuild
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        fred.address = models.Address(postcode='CB21 4EE')
+        fred.skills = [models.Skill(name='First Aid')]
+        fred.freetimes = [models.Freetime(day='friday', am_start=views.format_time('10:00'),
+                                          am_end=views.format_time('09:00'))]
+        wilma = models.Parent(first_name='Wilma', second_name='Flintstone')
+        wilma.address = models.Address(postcode='cb1 2ab')
+        wilma.skills = [models.Skill(name='first aid '), models.Skill(name='Cooking')]
+        self.session.add_all([fred, wilma])
+        self.session.commit()
+        self.fred, self.wilma = fred, wilma
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def counts(self):
+        return dict(((kind, key), count) for kind, key, count in stats.lookup(self.session))
+
+    def test_keys(self):
+        self.assertEqual(stats.skill_key(' First Aid'), 'first aid')
+        self.assertEqual(stats.postcode_key('cb21 4ee'), 'CB')
+        self.assertEqual(stats.postcode_key(None), '')
+
+    def test_counts_follow_flush(self):
+        expected = {('skill', 'first aid'):2, ('skill', 'cooking'):1,
+                    ('freetime', 'Friday PM'):1, ('postcode', 'CB'):2, ('parent', ''):2}
+        self.assertEqual(self.counts(), expected)
+
+        [cooking] = [skill for skill in self.wilma.skills if skill.name == 'Cooking']
+        cooking.name = 'baking'
+        self.wilma.address.postcode = 'SW1A 1AA'
+        self.session.delete(self.fred.skills[0])
+        self.session.add(models.Parent(first_name='Barney', second_name='Rubble'))
+        self.session.commit()
+        counts = self.counts()
+        self.assertEqual(counts[('skill', 'first aid')], 1)
+        self.assertEqual(counts[('skill', 'baking')], 1)
+        self.assertTrue(('skill', 'cooking') not in counts)
+        self.assertEqual(counts[('postcode', 'SW')], 1)
+        self.assertEqual(counts[('parent', '')], 3)
+
+    def test_rebuild(self):
+        self.session.delete(self.wilma.address)
+        self.session.commit()
+        counts = self.counts()
+        stats.rebuild(self.session)
+        self.assertEqual(self.counts(), counts)
+        self.assertEqual(counts[('postcode', 'CB')], 1)
@@ -0,0 +1,99 @@
+"""
+Test sync.py module
+"""
+import unittest
+
+from skillsdb import (sync, stats, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Sync(ModelsTestSetup):
+    """ Only differing rows are copied, statistics follow
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.source = self.get_session()
+        for i in range(20):
+            parent = models.Parent(first_name='Fred%s' % i, second_name='Flintstone')
+            parent.skills = [models.Skill(name='First Aid')]
+            self.source.add(parent)
+        self.source.commit()
+
+    def tearDown(self):
+        self.source.close()
+        ModelsTestSetup.tearDown(self)
+
+    def get_target(self):
+        return models.init(uri='target.sqlite', path=self.path, dbtype=self.dbtype,
+                           user='skills', passwd='skills', host='')
+
+    def sync(self, **kwargs):
+        return dict((row[0], row[1:]) for row in sync.sync(
+            self.get_session(readonly=True), self.get_target(), size=8, **kwargs))
+
+    def test_copy_and_resync(self):
+        result = self.sync()
+        self.assertEqual(result['parent'], (3, 3, 20, 0))
+        self.assertEqual(result['parent_skill'], (3, 3, 20, 0))
+
+        target = self.get_target()
+        self.assertEqual(target.query(models.Parent).count(), 20)
+        self.assertEqual(list(stats.lookup(target, 'skill')), [('skill', 'first aid', 20)])
+        target.close()
+
+        result = self.sync()
+        self.assertEqual(result['parent'], (3, 0, 0, 0))
+
+    def test_changed_rows_only(self):
+        self.sync()
+        parent = self.source.query(models.Parent).filter_by(first_name='Fred9').one()
+        parent.skills[0].name = 'Woodwork'
+        self.source.commit()
+
+        result = self.sync()
+        self.assertEqual(result['skill'], (3, 1, 1, 0))
+        self.assertEqual(result['parent'], (3, 0, 0, 0))
+        target = self.get_target()
+        self.assertEqual(dict((row[1], row[2]) for row in stats.lookup(target, 'skill')),
+                         {'first aid':19, 'woodwork':1})
+        target.close()
+
+    def test_unchanged_updated(self):
+        """ Strings and floats changed leaving updated as it was, as geocoding
+            does, are still copied
+        """
+        self.source.query(models.Parent).first().address = models.Address(postcode='CB21 4EE')
+        self.source.commit()
+        self.sync()
+        address = models.Address.__table__
+        self.source.execute(address.update().values(
+            postcode='CB21 4EF', latitude=52.1, updated=address.c.updated))
+        self.source.commit()
+
+        result = self.sync()
+        self.assertEqual(result['address'], (1, 1, 1, 0))
+        target = self.get_target()
+        self.assertEqual([(a.postcode, a.latitude) for a in target.query(models.Address)],
+                         [('CB21 4EF', 52.1)])
+        target.close()
+
+    def test_delete(self):
+        self.sync()
+        self.source.delete(self.source.query(models.Parent).filter_by(first_name='Fred0').one())
+        self.source.commit()
+
+        result = self.sync(dry_run=True, delete=True)
+        self.assertEqual(result['parent'], (3, 1, 0, 1))
+        result = self.sync()
+        self.assertEqual(result['parent'][3], 0)
+        result = self.sync(delete=True)
+        self.assertEqual(result['parent'][3], 1)
+        target = self.get_target()
+        self.assertEqual(target.query(models.Parent).count(), 19)
+        self.assertEqual(target.query(models.Tombstone).filter_by(tablename='parent').count(), 1)
+        target.close()
+
+    def test_same_database(self):
+        self.assertRaises(sync.SyncError, self.sync_same)
+
+    def sync_same(self):
+        list(sync.sync(self.get_session(), self.get_session()))
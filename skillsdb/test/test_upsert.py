@@ -0,0 +1,68 @@
+"""
+Test upsert.py module
+"""
+import unittest
+
+from skillsdb import (upsert, stats, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Upserts(ModelsTestSetup):
+    """ Existing IDs are updated and missing IDs created
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        fred.skills = [models.Skill(name='First Aid')]
+        self.session.add(fred)
+        self.session.commit()
+        self.fred = fred.id
+        self.skill = fred.skills[0].id
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def counts(self):
+        return dict(((kind, key), count) for kind, key, count in stats.lookup(self.session))
+
+    def upsert_skills(self):
+        upsert.upsert(self.session, models.Skill, [
+            {'id':self.skill, 'name':'Cooking'},
+            {'id':50, 'name':'Cooking', 'parent_id':self.fred},
+            {'id':51}])
+        self.session.commit()
+
+    def test_upsert(self):
+        self.upsert_skills()
+        skills = dict(self.session.query(models.Skill.id, models.Skill.name))
+        self.assertEqual(skills, {self.skill:'Cooking', 50:'Cooking', 51:None})
+        self.assertEqual(models.Skill.get(self.session, 50).parent_id, self.fred)
+        self.assertEqual(models.Skill.get(self.session, 50).name_key, 'cooking')
+        # Skills count the parents linked to them
+        counts = self.counts()
+        self.assertEqual(counts[('skill', 'cooking')], 1)
+        self.assertTrue(('skill', 'first aid') not in counts)
+
+    def test_fallback(self):
+        native = upsert.native
+        upsert.native = lambda conn: False
+        try:
+            self.upsert_skills()
+        finally:
+            upsert.native = native
+        self.assertEqual(self.session.query(models.Skill).count(), 3)
+        self.assertEqual(models.Skill.get(self.session, self.skill).name, 'Cooking')
+
+    def test_households(self):
+        upsert.upsert(self.session, models.Parent, [
+            {'id':20, 'first_name':'Wilma', 'second_name':'Flintstone', 'parent_id':self.fred}])
+        self.session.commit()
+        self.assertEqual(models.Parent.get(self.session, 20).household_id, self.fred)
+        self.assertEqual(self.counts()[('parent', '')], 2)
+
+    def test_invalid_rows(self):
+        self.assertRaises(upsert.UpsertError, upsert.upsert, self.session, models.Skill,
+                          [{'name':'Cooking'}])
+        self.assertRaises(upsert.UpsertError, upsert.upsert, self.session, models.Skill,
+                          [{'id':1, 'parents':[]}])
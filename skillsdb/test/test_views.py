@@ -0,0 +1,76 @@
+"""
+Test views.py module
+"""
+import os
+import unittest
+
+from skillsdb import (views, manage, utils, config, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class BuildCriterion(unittest.TestCase):
+    """ Search terms are compiled to SQL criteria
+    """
+    def compile(self, terms):
+        criterion = views.build_criterion(models.Parent, terms)
+        return str(criterion.compile(compile_kwargs={'literal_binds':True}))
+
+    def term(self, key, value, cond):
+        return {key:(value, views.CONDITIONS[cond])}
+
+    def test_single_term(self):
+        self.assertEqual(self.compile([self.term('first_name', 'Fred', 'equals')]),
+                         "parent.first_name = 'Fred'")
+        self.assertEqual(self.compile([self.term('first_name', 'Fr', 'like')]),
+                         "parent.first_name LIKE '%Fr%'")
+
+    def test_joined_terms(self):
+        # Terms are listed last first: a AND b OR c
+        terms = [self.term('second_name', 'Rubble', 'equals'), views.CONDITIONS['OR'],
+                 self.term('second_name', 'Flintstone', 'equals'), views.CONDITIONS['AND'],
+                 self.term('first_name', 'Fred', 'not')]
+        self.assertEqual(self.compile(terms),
+                         "parent.first_name != 'Fred' AND (parent.second_name = 'Flintstone' "
+                         "OR parent.second_name = 'Rubble')")
+
+    def test_not(self):
+        terms = [self.term('second_name', 'Rubble', 'equals'), views.CONDITIONS['NOT'],
+                 self.term('first_name', 'Fred', 'equals')]
+        self.assertEqual(self.compile(terms),
+                         "parent.first_name = 'Fred' AND parent.second_name != 'Rubble'")
+
+    def test_invalid(self):
+        self.assertRaises(views.ViewError, views.build_criterion, models.Parent, [])
+        self.assertRaises(views.ViewError, views.build_criterion, models.Parent,
+                          [views.CONDITIONS['AND'], self.term('first_name', 'Fred', 'equals')])
+
+class SplitInput(unittest.TestCase):
+    """ --modify input is split into assignments and a search
+    """
+    def test_split(self):
+        assignments, search = views.split_input(
+            ['country=UK', 'postcode=CB,like', 'AND', 'city=Cambridge,equals', 'line01=1, High St'])
+        self.assertEqual(assignments, ['country=UK', 'line01=1, High St'])
+        self.assertEqual(search, ['postcode=CB,like', 'AND', 'city=Cambridge,equals'])
+
+class DeleteBySearch(ModelsTestSetup):
+    """ manage --delete with a search deletes every match
+    """
+    dbtype = 'sqlite'
+
+    def test_delete_by_search(self):
+        filename = os.path.join(self.path, config.FNAME)
+        session_config = config.Config(utils.Params(filename, load=True, force=True))
+        session = session_config.get_session()
+        fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        fred.children = [models.Child(first_name='Pebbles', second_name='Flintstone', year=6),
+                         models.Child(first_name='Bamm-Bamm', second_name='Rubble', year=5)]
+        session.add(fred)
+        session.commit()
+        session.close()
+
+        args = manage.parser.parse_args(['manage', '--delete', '--child', '--config', filename,
+                                         'year=6,equals'])
+        views.View(args)
+        session = session_config.get_session()
+        self.assertEqual([c.first_name for c in session.query(models.Child)], ['Bamm-Bamm'])
+        session.close()
@@ -0,0 +1,102 @@
+"""
+Test vocabulary.py module
+"""
+import unittest
+
+from skillsdb import (vocabulary, stats, views, bulk, models)
+from skillsdb.test.test_models import ModelsTestSetup
+
+class Vocabulary(ModelsTestSetup):
+    """ One skill record per normalised name or alias
+    """
+    def setUp(self):
+        ModelsTestSetup.setUp(self)
+        self.session = self.get_session()
+        self.fred = models.Parent(first_name='Fred', second_name='Flintstone')
+        self.barney = models.Parent(first_name='Barney', second_name='Rubble')
+        self.session.add_all([self.fred, self.barney])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        ModelsTestSetup.tearDown(self)
+
+    def counts(self):
+        return dict((key, count) for kind, key, count in stats.lookup(self.session, 'skill'))
+
+    def test_skill_key(self):
+        self.assertEqual(models.skill_key(' First-Aid '), 'first aid')
+        self.assertEqual(models.skill_key(None), '')
+
+    def test_link(self):
+        vocabulary.link(self.session, self.fred, 'First Aid')
+        vocabulary.link(self.session, self.barney, 'first-aid')
+        vocabulary.link(self.session, self.barney, 'FIRST AID')
+        self.session.commit()
+        self.assertEqual(self.session.query(models.Skill).count(), 1)
+        self.assertEqual(self.session.query(models.parent_skill).count(), 2)
+        self.assertEqual(self.counts(), {'first aid':2})
+        self.assertRaises(vocabulary.VocabularyError, vocabulary.canonical, self.session, ' - ')
+
+    def test_alias(self):
+        skill = vocabulary.link(self.session, self.fred, 'First Aid')
+        self.session.commit()
+        cpr = vocabulary.link(self.session, self.barney, 'CPR').id
+        self.session.commit()
+        vocabulary.add_alias(self.session, 'cpr', 'first aid')
+        self.assertEqual(vocabulary.resolve(self.session, ' CPR').id, skill.id)
+        self.assertEqual(models.Skill.get(self.session, cpr), None)
+        self.assertEqual(self.counts(), {'first aid':2})
+        self.assertRaises(vocabulary.VocabularyError, vocabulary.add_alias, self.session,
+                          'cpr', 'juggling')
+
+    def test_link_owned(self):
+        # A skill owned by Fred, as earlier versions added skills
+        skill = models.Skill(name='First Aid', parent_id=self.fred.id)
+        self.session.add(skill)
+        self.session.commit()
+        self.assertEqual(vocabulary.link(self.session, self.barney, 'first aid'), skill)
+        self.session.commit()
+        self.assertEqual(skill.parent_id, None)
+        self.assertEqual(sorted(p.first_name for p in skill.parents), ['Barney', 'Fred'])
+        self.assertEqual(self.counts(), {'first aid':2})
+
+        bulk.delete(self.session, models.Parent, models.Parent.id == self.fred.id)
+        self.session.commit()
+        barney = models.Parent.get(self.session, self.barney.id)
+        self.assertEqual([s.name for s in barney.skills], ['First Aid'])
+        self.assertEqual(self.counts(), {'first aid':1})
+
+    def test_search(self):
+        vocabulary.link(self.session, self.fred, 'First Aid')
+        vocabulary.link(self.session, self.barney, 'Woodwork')
+        self.session.commit()
+        vocabulary.add_alias(self.session, 'cpr', 'first aid')
+
+        def search(name, op='=='):
+            criterion = views.build_criterion(models.Skill, [{'name':(name, op)}], self.session)
+            return [skill.name for skill in self.session.query(models.Skill).filter(criterion)]
+        self.assertEqual(search('first aid'), ['First Aid'])
+        self.assertEqual(search(' FIRST-AID'), ['First Aid'])
+        self.assertEqual(search('cpr'), ['First Aid'])
+        self.assertEqual(search('cpr', '!='), ['Woodwork'])
+        self.assertEqual(search('juggling'), [])
+
+    def test_migrate(self):
+        # Skills as earlier versions added them, one record per parent
+        for parent, name in [(self.fred, 'First Aid'), (self.fred, 'first aid'),
+                             (self.barney, 'First-aid'), (self.barney, 'Woodwork')]:
+            skill = models.Skill(name=name, parent_id=parent.id)
+            skill.parents = [parent]
+            self.session.add(skill)
+        self.session.commit()
+        self.assertEqual(self.counts(), {'first aid':2, 'woodwork':1})
+
+        self.assertEqual(vocabulary.migrate(self.session), (2, 2))
+        skills = self.session.query(models.Skill).order_by(models.Skill.id).all()
+        self.assertEqual([(skill.name, skill.parent_id) for skill in skills],
+                         [('First Aid', None), ('Woodwork', None)])
+        self.assertEqual(sorted(p.first_name for p in skills[0].parents), ['Barney', 'Fred'])
+        self.assertEqual(self.session.query(models.parent_skill).count(), 3)
+        self.assertEqual(self.counts(), {'first aid':2, 'woodwork':1})
+        self.assertEqual(self.session.query(models.Tombstone).count(), 2)
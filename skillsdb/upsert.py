@@ -0,0 +1,164 @@
+"""
+Upserts
+=======
+Insert or update many records in one statement per batch.
+
+Rows are dicts of column values including the record ID. Rows whose ID
+already exists have the given columns updated, other rows are inserted.
+The database does the matching:
+
+    SQLite (3.24+)  INSERT ... ON CONFLICT (id) DO UPDATE SET ...
+    MySQL           INSERT ... ON DUPLICATE KEY UPDATE ...
+
+Other databases, and older SQLite libraries, fall back to an UPDATE per
+row followed by an INSERT of the rows that matched nothing.
+
+Upserts are Core statements, so flush events do not see them. The stored
+values that statistics depend on are read in one query per batch, and
+counts and households are adjusted from them. Normalised skill names are
+derived from the names written, and skill counts recounted. Addresses
+are located from the postcodes written.
+"""
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import Insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects import mysql
+
+import models
+import stats
+import formats
+import household
+import geo
+import logutils
+
+log = logutils.setup_log(__name__)
+
+# IDs read per query of stored values
+CHUNK = 500
+
+class UpsertError(Exception):pass
+
+class Upsert(Insert):
+    """ INSERT updating update_keys of rows whose primary key exists (SQLite)
+    """
+    def __init__(self, table, update_keys):
+        Insert.__init__(self, table)
+        self.update_keys = update_keys
+
+@compiles(Upsert, 'sqlite')
+def compile_sqlite_upsert(insert, compiler, **kw):
+    quote = compiler.preparer.quote
+    text = compiler.visit_insert(insert, **kw)
+    text += ' ON CONFLICT (%s)' % ', '.join(quote(col.name) for col in insert.table.primary_key)
+    if not insert.update_keys:
+        return text + ' DO NOTHING'
+    return text + ' DO UPDATE SET ' + ', '.join(
+        '%s = excluded.%s' % (quote(key), quote(key)) for key in insert.update_keys)
+
+def native(conn):
+    """ True if the database of conn has an upsert statement
+    """
+    if conn.dialect.name == 'sqlite':
+        return conn.dialect.dbapi.sqlite_version_info >= (3, 24, 0)
+    return conn.dialect.name == 'mysql'
+
+def execute(conn, table, rows):
+    """ Upsert rows of sa.Table table, all rows giving the same columns
+    """
+    if not rows:
+        return
+    keys = sorted(rows[0])
+    primary_key = [col.name for col in table.primary_key]
+    if any(key not in row for row in rows for key in primary_key):
+        raise UpsertError, "Upserted %s rows require %s" % (table.name, ', '.join(primary_key))
+    update_keys = [key for key in keys if key not in primary_key]
+
+    if conn.dialect.name == 'mysql':
+        statement = mysql.insert(table)
+        updates = update_keys or primary_key
+        conn.execute(statement.on_duplicate_key_update(
+            [(key, statement.inserted[key]) for key in updates]), rows)
+    elif native(conn):
+        conn.execute(Upsert(table, update_keys), rows)
+    else:
+        where = sa.and_(*[table.c[key] == sa.bindparam('_' + key) for key in primary_key])
+        missing = []
+        for row in rows:
+            result = conn.execute(table.update().where(where).values(
+                dict((key, row[key]) for key in update_keys) or
+                dict((key, row[key]) for key in primary_key)),
+                dict(('_' + key, row[key]) for key in primary_key))
+            if not result.rowcount:
+                missing.append(row)
+        if missing:
+            conn.execute(table.insert(), missing)
+
+def stored(conn, table, ids, keys):
+    """ Return stored values of keys of records with the given IDs, by ID
+    """
+    t = table.__table__
+    previous = {}
+    ids = list(ids)
+    for i in xrange(0, len(ids), CHUNK):
+        for row in conn.execute(sa.select([t.c.id] + [t.c[key] for key in keys]).where(
+                t.c.id.in_(ids[i:i + CHUNK]))):
+            previous[row[0]] = dict(zip(keys, row[1:]))
+    return previous
+
+def upsert(session, table, rows):
+    """ Insert or update rows of mapped class table in the session's
+        transaction, keeping statistics and households up to date
+
+        Returns the number of rows written
+    """
+    columns = set(formats.columns(table))
+    for row in rows:
+        if row.get('id') is None:
+            raise UpsertError, "Upserted %s rows require a record ID" % table.classname
+        unknown = set(row) - columns
+        if table == models.Skill and 'name_key' in row:
+            unknown.add('name_key')
+        if unknown:
+            raise UpsertError, "%s are not columns of table %s" % (
+                ', '.join(sorted(unknown)), table.classname)
+
+    # Updated rows are stamped, as the ORM would stamp them
+    now = datetime.datetime.now()
+    rows = [row if row.get('updated') else dict(row, updated=now) for row in rows]
+
+    conn = session.connection()
+    skill_keys = set()
+    if table == models.Skill:
+        named = [row for row in rows if 'name' in row]
+        skill_keys = stats.skill_keys(conn, skill_ids=[row['id'] for row in named])
+        skill_keys.update(stats.skill_key(row['name']) for row in named)
+        rows = [dict(row, **table.derived(row)) for row in rows]
+    keys = stats.COUNTED.get(table, [])
+    # Partner links of parents decide their households
+    read = keys + ['parent_id'] if table == models.Parent else keys
+    previous = stored(conn, table, set(row['id'] for row in rows), read)
+
+    # Rows setting the same columns share a statement
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for group in groups.itervalues():
+        execute(conn, table.__table__, group)
+
+    if table in stats.COUNTED:
+        stats.adjust(conn, stats.row_deltas(table, dict(previous), rows))
+    if skill_keys:
+        stats.recount_skills(conn, skill_keys)
+    if table == models.Address:
+        geo.geocode(conn, [row['id'] for row in rows if 'postcode' in row])
+    if table == models.Parent:
+        relabel = set()
+        for row in rows:
+            if 'parent_id' in row or row['id'] not in previous:
+                relabel.add(row['id'])
+                relabel.add(previous.get(row['id'], {}).get('parent_id'))
+        relabel.discard(None)
+        household.relabel(conn, relabel)
+    return len(rows)
@@ -1,5 +1,7 @@
 """ Provide anicillary objects and features
 """
+import os
+
 import config
 
 class Params(object):
@@ -9,8 +11,19 @@ class Params(object):
         self.user = 'skills'
         self.passwd = 'skills'
         self.host = ''
+        self.read_host = ''
         self.dbtype = 'sqlite'
         self.dbname = 'skillsdb.sqlite'
+        self.tenants = ''
+        self.tenant = None
+        self.journal_mode = 'wal'
+        self.synchronous = 'normal'
+        self.cache_size = '-16000'
+        self.mmap_size = '268435456'
+        self.busy_timeout = '5000'
+        self.temp_store = 'memory'
+        self.write_retries = '5'
+        self.write_backoff = '0.05'
         self.force = False
         self.set = False
         self.load = False
@@ -28,3 +41,11 @@ class Params(object):
         for key in config.DEFAULTS:
             msg += "\n%s=%s" % (key, self[key])
         return msg
+
+def load_config(config_file, tenant=None):
+    """ Load and authenticate a program session from a config file
+    """
+    if not os.path.exists(config_file):
+        raise config.ConfigException, "%s configuration file not found" % (
+            os.path.basename(config_file))
+    return config.Config(Params(config_file, load=True, tenant=tenant))
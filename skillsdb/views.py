@@ -4,14 +4,30 @@ Database views
 import sys
 import os
 import sqlalchemy as sql
-import datetime
 
 import utils
 import config
 import models
+import formats
+import schema
+import explain
+import coordinator
+import bulk
+import upsert
+import vocabulary
+import similar
+import geo
+import logutils
+
+log = logutils.setup_log(__name__)
+
+TABLES = {"parent":models.Parent, "child":models.Child,
+          "freetime":models.Freetime, "skill":models.Skill,
+          "address":models.Address}
 
 CONDITIONS = {'OR':sql.or_, 'AND':sql.and_, 'NOT':sql.not_,
-              'equals':'==', 'like':'.like(', 'not':'!='}
+              'equals':'==', 'like':'.like(', 'not':'!=', 'similar':'similar',
+              'near':'near'}
 
 class ViewOptions(object):
     """ Options to extend view methods
@@ -48,6 +64,8 @@ class View(object):
 
         """
         self.args = args
+        # Search terms selecting records of a bulk --modify
+        self.terms = None
 
         table = self.get_table_object()
         operation = self.get_operation()
@@ -75,9 +93,7 @@ class View(object):
         else:
             raise ViewError, "Table not found"
 
-        return {"parent":models.Parent, "child":models.Child,
-                "freetime":models.Freetime, "skill":models.Skill,
-                "address":models.Address}[table]
+        return TABLES[table]
 
     def get_operation(self):
         """
@@ -117,15 +133,32 @@ class View(object):
         if operation == self.retrieve_view:
             if self.args.pid or self.args.rid:
                 raise ViewError, "Parent and record IDs shouldn't be given when doing a lookup"
-        if operation == self.update_view or operation == self.delete_view:
+        if (operation == self.delete_view and input_dict) or self.terms is not None:
+            if self.args.pid or self.args.rid:
+                raise ViewError, "Parent and record IDs shouldn't be given with a search"
+            if self.args.upsert:
+                raise ViewError, "--upsert can not be combined with a search"
+        elif operation == self.update_view or operation == self.delete_view:
             if not (((table == models.Parent or table == models.Address) and self.args.pid) or self.args.rid):
                 raise ViewError, "Record ID (or parent ID for parents) required to update or delete records"
-        if operation == self.delete_view:
+        if operation == self.delete_view and not input_dict:
             if table == models.Parent and not self.args.pid:
                 raise ViewError, "Parent ID required to delete parent record"
             if table != models.Parent and self.args.pid:
                 raise ViewError, "Parent ID irrelevent for deletion of %s records" % table.classname
 
+        if self.args.explain and operation != self.retrieve_view:
+            raise ViewError, "--explain is only valid with --search"
+
+        if self.args.dry_run and not (self.terms is not None or (
+                operation == self.delete_view and input_dict)):
+            raise ViewError, "--dry-run is only valid with --modify or --delete by search"
+        elif self.args.upsert and self.terms is None:
+            if operation != self.update_view:
+                raise ViewError, "--upsert is only valid with --modify"
+            if table != models.Parent and not self.args.rid:
+                raise ViewError, "Record ID (--rid) required to upsert %s records" % table.classname
+
         if self.args.pid and self.args.rid:
             raise ValueError, "Inconsistent command line arguments. --pid and --rid jointly specified."
 
@@ -134,74 +167,61 @@ class View(object):
 
 
     def load_session(self, config_fname):
-        params = utils.Params(config_fname, load=True)
+        params = utils.Params(config_fname, load=True, tenant=self.args.tenant)
         return config.Config(params)
         
     def get_input(self, table, operation):
         """ Parse free text input.
             Context specific
         """
-        # Delete mode shouldn't have input string
-        if operation == self.delete_view:
-            if self.args.input:
-                raise ViewError, "Input is invalid for delete mode. use --rid to specify a record"
+        # Delete mode takes a record ID, or a search of records to delete
+        if operation == self.delete_view and not self.args.input:
             return {}
 
-        # Build list of valid key names
-        valid_keys = table().get_attrs()
+        # Keys and column types of the table
+        fields = schema.for_table(table)
 
-        print 'valid_keys'
-        print valid_keys
-        print 'input'
-        print self.args.input
+        log.debug('input: %s' % self.args.input)
         
         if not self.args.input:
             raise ViewError, "No input data to parse"
 
         # retrieve: key dict --> key=value,op COND
         # others: key dict --> key=value
-        if operation in [self.create_view, self.update_view]:
-            return self.get_input_general(self.args.input, valid_keys, table)
-        elif operation == self.retrieve_view:
-            return self.get_input_retrieve(self.args.input, valid_keys, table)
+        if operation == self.update_view:
+            assignments, search = split_input(self.args.input)
+            if search:
+                self.terms = self.get_input_retrieve(search, fields)
+            if not assignments:
+                raise ViewError, "No key=value data to set"
+            return self.get_input_general(assignments, fields)
+        if operation == self.create_view:
+            return self.get_input_general(self.args.input, fields)
+        elif operation in [self.retrieve_view, self.delete_view]:
+            return self.get_input_retrieve(self.args.input, fields)
         else:
             raise ViewError, 'Something gone wrong table:%s, operation:%, input:%s' % (
                 table, operation, self.args.input)
 
-    def get_input_general(self, txt, valid_keys, table):
+    def get_input_general(self, txt, fields):
         """ Parse input for add,update
         """
-        key_dict = {}
-
+        pairs = []
         for kvpair in txt:
-            if "=" not in kvpair:
+            key, sep, value = kvpair.partition('=')
+            if not sep:
                 raise ViewError, "Incorrect format:%s. Use key=value for data entry." % kvpair
-            sepcount = sum([1 for i in kvpair if i =='='])
-            if sepcount != 1:
+            if '=' in value:
                 raise ViewError, "Multiple separators:%s, can not resolve key value pair." % kvpair
+            pairs.append((key, value))
 
-            key, value = kvpair.split('=')
-            if key not in valid_keys:
-                raise ViewError, "'%s' is not a valid key for table '%s'" % (
-                    key, table.classname
-                )
-
-            if key == 'record':
-                try:
-                    value = int(value)
-                except ValueError:
-                    print "%s is not a valid record ID" % value
-
-            if key in ['am_start', 'am_end', 'pm_start', 'pm_end']:
-                value = format_time(value)
-                    
-            key_dict[key]=value
-
-        return key_dict
+        return parse_pairs(pairs, fields)
         
-    def get_input_retrieve(self, txt, valid_keys, table):
+    def get_input_retrieve(self, txt, fields):
         """ Parse input for query mode
+            Values compared for equality are converted to column types
         """
+        txt = list(txt)
         query_builder = []
         while txt:
             expr = txt.pop()
@@ -212,26 +232,23 @@ class View(object):
 
             if not ('=' in expr and ',' in expr):
                 raise ViewError, "%s is not a valid query expression" % expr
-            term_count = sum(1 for i in expr if i=="=")
-            cond_count = sum(1 for i in expr if i==',')
-
-            if not (term_count == 1 and cond_count == 1):
+            if not (expr.count('=') == 1 and expr.count(',') == 1):
                 raise ViewError, "%s is not a valid query expression. Specify key=term,operation." % expr
 
-            term_part,cond = expr.split(',')
-            key,value = term_part.split('=')
+            term_part, cond = expr.split(',')
+            key, value = term_part.split('=')
 
             if cond not in CONDITIONS:
-                raise ViewError, "%s is not a valid query expression. %s is not a recognized operator.  Choose from %" % (expr, cond, CONDITIONS)
+                raise ViewError, "%s is not a valid query expression. %s is not a recognized operator.  Choose from %s" % (expr, cond, ', '.join(sorted(CONDITIONS)))
+
+            try:
+                if CONDITIONS[cond] in ['==', '!=']:
+                    value = fields.coerce(key, value)
+                else:
+                    fields.check(key)
+            except schema.SchemaError, e:
+                raise ViewError, str(e)
 
-            if key not in valid_keys:
-                raise ViewError, "'%s' is not a valid key for table '%s'" % (
-                    key, table.classname
-                )     
-                
-            if key in ['am_start', 'am_end', 'pm_start', 'pm_end']:
-                value = format_time(value)
-                    
             query_builder.append({key:(value, CONDITIONS[cond])})
 
         return query_builder
@@ -240,27 +257,40 @@ class View(object):
         """ Create a new record
         """        
         session, table_object, params = self.parse_objects(**kwargs)
-        record = self.decorate_create_update('create', session, table_object, params)
 
-        session.add(record)
-        session.commit()
+        def create(session):
+            record = self.decorate_create_update('create', session, table_object, params)
+            session.add(record)
+            return record
+
+        record = self.commit(session, create)
+        self.write_records([record], table_object)
         session.close()
         
     def delete_view(self, **kwargs):
-        """ Delete a record by parent_id and record id
-        """        
+        """ Delete a record by parent_id and record id, or every record
+            matching a search, with the records they own
+        """
         session, table_object, params = self.parse_objects(**kwargs)
-        if not table_object == models.Parent:
-            q = session.query(table_object).filter(
-                table_object.id == params['record_id']).one()
-        else:
-            q = session.query(models.Parent).filter(
-                models.Parent.id == params['parent_id']).one()
-
-        session.delete(q)
-        session.commit()
+        if self.args.input:
+            self.refresh_similar(params)
+            criterion = build_criterion(table_object, params, session)
+            return self.bulk_view(session, table_object, criterion, 'deleted',
+                                  lambda: bulk.delete(session, table_object, criterion))
+
+        # --pid of a parent is also its record ID
+        def delete(session):
+            q = get_record(session, table_object, params['record_id'])
+            deleted = formats.record_to_dict(q)
+            bulk.delete(session, table_object, table_object.id == q.id)
+            return deleted
+
+        deleted = self.commit(session, delete)
         session.close()
-        
+        if self.args.format != 'text':
+            writer = formats.RecordWriter(self.args.format, [k for k, v in deleted])
+            writer.write(deleted)
+            writer.close()
 
     def retrieve_view(self, **kwargs):
         """ Perform a lookup
@@ -268,51 +298,105 @@ class View(object):
         results = None
         kwargs['_search_'] = True
         session, table_object, terms = self.parse_objects(**kwargs)
-        print terms
-        
-        table_object = "models." + table_object.classname.capitalize()
-        filter_units = []
-        qtxt = 'session.query(' + table_object + ').filter('
-        cond_units = [qtxt]
-        i = 0
-        while terms:
-            term = terms.pop()
-            if type(term) == type(sql.and_):
-                cond_units.append('sql.' + term.__name__ + '(' + filter_units[i -1])
-                i +=1
-                continue
-                
-            key, value_op = term.items()[0]
-            value,op = value_op
-            filter_units.append(fmt_term(table_object, key, value, op))
-
-        cond_units.append(filter_units[i])
-
-        xb = ''
-        if i:
-            xb = ')' * i
-        qtxt = cond_units[0]
-        if i > 0:
-            qtxt += ','.join(cond_units[1:])
-        else:
-            qtxt += ''.join(cond_units[1])
-        qtxt += xb + ').all()'
-
-        print qtxt
-        results = eval(qtxt)
-        if results:
+        log.debug('terms: %s' % terms)
+        self.refresh_similar(terms)
+        recorder = explain.Recorder(session.get_bind(), self.args.explain)
+        with recorder:
+            results = session.query(table_object).filter(
+                build_criterion(table_object, terms, session)).all()
+        if recorder.enabled:
+            try:
+                explain.write(session.connection(), recorder.statements)
+            except explain.ExplainError, e:
+                raise ViewError, str(e)
+        elif self.args.format != 'text':
+            formats.write_records(results, self.args.format, table_object)
+        elif results:
             for i, result in enumerate(results):
                 print "Result:%s\n\tRID:%s\n\t%s\n" % (1+i, result.id, result)
+        session.close()
         
     def update_view(self, **kwargs):
         """ Modify a record
         """
         session, table_object, params = self.parse_objects(**kwargs)
-        record = self.decorate_create_update('update', session, table_object, params)
+        if self.terms is not None:
+            self.refresh_similar(self.terms)
+            criterion = build_criterion(table_object, self.terms, session)
+            return self.bulk_view(session, table_object, criterion, 'updated',
+                                  lambda: self.bulk_update(session, table_object, criterion, params))
+        if self.args.upsert:
+            return self.upsert_view(session, table_object, params)
+        record = self.commit(session, lambda session: session.merge(
+            self.decorate_create_update('update', session, table_object, params)))
+        self.write_records([record], table_object)
+        session.close()
 
-        session.merge(record)
-        session.commit()
+    def refresh_similar(self, terms):
+        """ Bring the similar skills index up to date for searches using it
+        """
+        if any(isinstance(term, dict) and term.values()[0][1] == 'similar' for term in terms):
+            session = self.session_config.get_session()
+            similar.refresh(session)
+            session.close()
+
+    def commit(self, session, work):
+        """ Run work(session) and commit, running it again while the
+            database is busy. Returns the result of work
+        """
+        return coordinator.transaction(session, work, self.session_config.write_retries,
+                                       self.session_config.write_backoff)
+
+    def bulk_view(self, session, table_object, criterion, action, change):
+        """ Count records matching a search, and change them unless
+            this is a dry run. Writes matched and changed counts
+        """
+        matched = bulk.count(session, table_object, criterion)
+        changed = 0
+        if not self.args.dry_run and matched:
+            changed = self.commit(session, lambda session: change())
         session.close()
+        writer = formats.RecordWriter(self.args.format, ['table', 'matched', action])
+        writer.write([('table', table_object.classname), ('matched', matched), (action, changed)])
+        writer.close()
+
+    def bulk_update(self, session, table_object, criterion, params):
+        try:
+            return bulk.update(session, table_object, criterion, params)
+        except bulk.BulkError, e:
+            raise ViewError, str(e)
+
+    def upsert_view(self, session, table_object, params):
+        """ Modify record columns with a single upsert statement,
+            without loading the record
+        """
+        row = {'id':params['record_id']}
+        for key, value in params.iteritems():
+            if key in ['pid', 'record_id']:
+                continue
+            # Parents refer to their partner, other records' parents are links
+            if key == 'parent_id' and table_object != models.Parent:
+                raise ViewError, "Parents of %s records can not be changed by --upsert" % (
+                    table_object.classname)
+            row[key] = value
+        def write(session):
+            try:
+                upsert.upsert(session, table_object, [row])
+            except upsert.UpsertError, e:
+                raise ViewError, str(e)
+
+        self.commit(session, write)
+        if self.args.format != 'text':
+            self.write_records([table_object.get(session, row['id'])], table_object)
+        else:
+            print "%s record %s upserted" % (table_object.classname, row['id'])
+        session.close()
+
+    def write_records(self, records, table_object):
+        """ Write created or updated records in a machine readable format
+        """
+        if self.args.format != 'text':
+            formats.write_records(records, self.args.format, table_object)
 
     def decorate_create_update(self, operation, session, table_object, params):
         """ Attach parent and parent.partner to new
@@ -327,7 +411,7 @@ class View(object):
         parent = None
         if 'parent_id' in params:
             parent_id = params['parent_id']
-            parent = session.query(models.Parent).filter(models.Parent.id == parent_id).one()
+            parent = get_record(session, models.Parent, parent_id)
 
         if parent:
             if parent.partner:
@@ -335,23 +419,33 @@ class View(object):
             elif parent.other:
                 partner = parent.other
 
+        # Parents are linked to the vocabulary skill of that name
+        if operation == 'create' and table_object == models.Skill:
+            try:
+                record = vocabulary.link(session, parent, params.get('name'))
+            except vocabulary.VocabularyError, e:
+                raise ViewError, str(e)
+            if self.args.format == 'text':
+                print record
+            return record
+
         # Create new record
         if operation == 'create':
-            record = table_object(**params)
+            record = table_object(**dict((key, value) for key, value in params.iteritems()
+                                         if key not in ['pid', 'record_id']))
         else:
             # Process Update requests
             # All updates apart from Address use record_id for lookups
             # Note pid -> record_id 
             if table_object != models.Address:
-                record = session.query(table_object).filter(
-                    table_object.id==params['record_id']).one()
+                record = get_record(session, table_object, params['record_id'])
             else:
                 if parent:
-                    record = session.query(table_object).filter(
-                        table_object.parent_id==params['parent_id']).one()
+                    record = table_object.get_by_parent_id(session, params['parent_id'])
+                    if record is None:
+                        raise ViewError, "No address record of parent %s" % params['parent_id']
                 else:
-                    record = session.query(table_object).filter(
-                        table_object.id==params['record_id']).one()
+                    record = get_record(session, table_object, params['record_id'])
                     
         # Parent table => add partner if present            
         if table_object == models.Parent:
@@ -364,8 +458,6 @@ class View(object):
                 record.parents = [parent, partner]
             elif parent:
                 record.parents = [parent]
-            # debug
-            print record.parents
 
         # Skills and freetime, add owner
         elif table_object in [models.Skill, models.Freetime]:
@@ -382,7 +474,8 @@ class View(object):
                 continue
             setattr(record, key, value)
 
-        print record
+        if self.args.format == 'text':
+            print record
         return record
 
         
@@ -394,15 +487,19 @@ class View(object):
             if table is *NOT* parent, then parent_id == pid
 
             if updating a parent, user may specif --rid or --pid for parent
+
+            Searches are given a read only session
         """
-        session =  self.session_config.get_session()
         table_object = kwargs['table']
         params = kwargs['input_dict']
 
         if '_search_' in kwargs:
             del kwargs['_search_']
+            session = self.session_config.get_session(readonly=True)
             return (session, table_object, params)
 
+        session =  self.session_config.get_session()
+
         if self.args.pid:
             try:
                 pid = int(self.args.pid)
@@ -435,29 +532,105 @@ class View(object):
                 
         return (session, table_object, params)
         
-def fmt_term(table_object, key, value, op):
-    # equals / not equals
-    if op == '==' or op == '!=':
-        return table_object + '.' + key + op + '\'' + value + '\''
-    # like
+def parse_pairs(pairs, fields, keys=None):
+    """ Validate key value pairs for add and update against the schema
+        fields of a table. Return dictionary of values converted to
+        column types
+    """
+    try:
+        return fields.values(pairs, keys)
+    except schema.SchemaError, e:
+        raise ViewError, str(e)
+
+def split_input(txt):
+    """ Split --modify input into key=value assignments and the
+        key=value,operator terms and conditions of a search
+    """
+    assignments, search = [], []
+    for expr in txt:
+        if expr in CONDITIONS or (',' in expr and expr.rsplit(',', 1)[1] in CONDITIONS):
+            search.append(expr)
+        else:
+            assignments.append(expr)
+    return assignments, search
+
+def get_record(session, table, id):
+    """ Return the table record with ID id, or raise ViewError
+    """
+    record = table.get(session, id)
+    if record is None:
+        raise ViewError, "No %s record with ID %s" % (table.classname, id)
+    return record
+
+def term_criterion(table, term, session=None):
+    """ Return the criterion of a search term, {key:(value, operator)}
+        Distance (near) terms read postcode locations through session
+    """
+    key, (value, op) = term.items()[0]
+    column = getattr(table, key)
+    if table == models.Skill and key == 'name' and op in ('==', '!='):
+        # By normalised name or alias, as skills are added
+        criterion = vocabulary.name_criterion(session, value)
+        return criterion if op == '==' else sql.not_(criterion)
+    if op == '==':
+        return column == value
+    elif op == '!=':
+        return column != value
     elif op == '.like(':
-        return table_object + '.' + key + op + '\'%' + value + '%\')'
+        return column.like('%' + value + '%')
+    elif op == 'similar':
+        if table != models.Skill or key != 'name':
+            raise ViewError, "Only skill names can be searched for similar names"
+        try:
+            return similar.criterion(value)
+        except similar.SimilarError, e:
+            raise ViewError, str(e)
+    elif op == 'near':
+        if table != models.Address or key != 'postcode':
+            raise ViewError, "Only address postcodes can be searched by distance"
+        if session is None:
+            raise ViewError, "Distance searches need a database session"
+        try:
+            return geo.near_criterion(session.connection(), value)
+        except geo.GeoError, e:
+            raise ViewError, str(e)
     else:
         raise ViewError, "Unsupported query operator"
-                
-def format_time(timestr):
-    if ':' not in timestr or 4 < len(timestr) > 5:
-        raise ValueError, 'Input times must be hh:mm format'
 
-    #datetime.datetime.combine(datetime.datetime.today().date(), datetime.time(9,0))
-    today = datetime.datetime.today().date()
-    
-    h,m = timestr.split(':')
-    try:
-        return datetime.datetime.combine(today, datetime.time(int(h), int(m)))
-    except ValueError, e:
-        print "%s\n%s hours, %s mins incorrectly formatted" % (e, h, m)
-    
+def build_criterion(table, terms, session=None):
+    """ Return a SQL criterion of table from search terms parsed by
+        View.get_input_retrieve (last term first)
+
+        Terms are joined from the right: a AND b OR c is a AND (b OR c).
+        a NOT b is a AND NOT b, and a leading NOT negates the rest.
+    """
+    items = list(reversed(terms))
+    if not items:
+        raise ViewError, "No search terms given"
+
+    def criterion(items):
+        item = items.pop(0)
+        if item is sql.not_:
+            if not items:
+                raise ViewError, "NOT must be followed by a search term"
+            return sql.not_(criterion(items))
+        if not isinstance(item, dict):
+            raise ViewError, "Search terms must be joined by AND, OR or NOT"
+        left = term_criterion(table, item, session)
+        if not items:
+            return left
+        join = items.pop(0)
+        if isinstance(join, dict) or not items:
+            raise ViewError, "Search terms must be joined by AND, OR or NOT"
+        right = criterion(items)
+        if join is sql.not_:
+            return sql.and_(left, sql.not_(right))
+        return join(left, right)
+
+    return criterion(items)
+
+format_time = schema.parse_time
+
 def main(args):
     """
 Add, delete, modify or search skills database.
@@ -472,17 +645,67 @@ Add, delete, modify or search skills database.
 
   For addition and update operations, Input should be specified in the form of key=value.
   To define a relationship between two parents, use key=value of parent_id=`pid of partner`
-  Multiple inputs are parsed on whitespace.
+  Multiple inputs are parsed on whitespace.  Values are checked against their columns:
+  whole numbers, times as hh:mm, dates as YYYY-MM-DD, and text no longer than the column.
+
+  Adding a skill links the parent to the skill of that name, or alias, adding it
+  to the skill vocabulary if new (see skillsdb skills).
+
+  Deleting a parent deletes their freetimes and address.  Skills stay in the
+  vocabulary for the other parents linked to them.  --delete with a search
+  expression deletes every matching record.
+
+  --modify with a search expression sets key=value data on every matching record
+  in one statement.  --dry-run counts the records a search would change.
+
+  --modify --upsert sets columns with a single statement, without loading the
+  record, and creates the record if the ID is missing.  Parents of child, skill
+  and freetime records can not be changed this way.
 
   Search operations should be specified in key=value,operator=term, where terms may be one
   of equals, startswith, contains or like. Queries may be built using conditional operators:
-  AND, OR and NOT 
+  AND, OR and NOT, joined from the right (a AND b OR c is a AND (b OR c)).
+
+  Skill names searched with equals (or !=) match however the name is written,
+  and aliases of the skill (see skillsdb skills).  Skill names may also be
+  searched with similar, for the skills spelt most like the name given, or
+  sharing an alias spelt like it.  Address postcodes may be searched with
+  near, for addresses within miles of a postcode (postcode=CB21 4EE:2,near, 2 miles if
+  not given), once postcode locations are loaded (see skillsdb near).
 
   skillsdb manage --add --parent first_name=Ian second_name=Roberts
   skillsdb manage --modify --parent --pid 1 first_name=Bob
+  skillsdb manage --modify --upsert --skill --rid 4 name=Woodwork
   skillsdb manage --search --parent first_name=Ian,op=startswith AND second_name=Roberts,op=equals
   skillsdb manage --delete --parent --pid 1
+  skillsdb manage --delete --child year=6,equals
+  skillsdb manage --modify --dry-run --address country=UK postcode=CB,like
+
+  Select a tenant (school) with --tenant. Each tenant is kept in its own database.
+
+  Writes finding the database busy, locked by another writer, are retried (see
+  skillsdb writer).  --queue sends a command to the writer process, if one is
+  running, to be run in turn with other staff's changes.
+
+  skillsdb manage --add --queue --parent first_name=Fred second_name=Flintstone
+
+  Results may be written as json, jsonl, csv or table (--format) for use by other programs.
+  Machine readable output is serialised from column values only.
+
+  skillsdb manage --search --format csv --skill "name=first aid,like"
+  skillsdb manage --search --skill name=woodwork,similar
+  skillsdb manage --search --address "postcode=CB21 4EE:2,near"
+
+  --explain prints, instead of the results of a search, the SQL of each query it ran
+  with its parameters and the database's plan, flagging full scans of tables whose
+  searched columns have, or lack, an index.
+
+  skillsdb manage --search --explain --parent first_name=Fr,like
     """
+    if args.queue and not args.search:
+        status = coordinator.submit(sys.argv[1:], args.config)
+        if status is not None:
+            sys.exit(status)
     sys.exit(View(args))
 
 
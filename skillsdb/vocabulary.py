@@ -0,0 +1,277 @@
+"""
+Skill vocabulary
+================
+One skill record per skill, however it is written. Names are normalised
+to lower case words of letters and digits ('First-Aid ' -> 'first aid')
+in Skill.name_key, an indexed column, so finding a skill by name is an
+exact lookup. Other names of a skill (aliases, 'cpr' for 'first aid')
+are SkillAlias records. Parents are linked to skills through
+parent_skill, so each skill name is stored once however many parents
+have it.
+
+Earlier versions added a skill record, owned by the parent (parent_id),
+each time a parent's skill was added. --migrate merges skills of the
+same normalised name or alias into the one with the lowest ID, linking
+every parent that had any of them, and deletes the rest.
+"""
+import datetime
+import collections
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes
+
+import utils
+import models
+import stats
+import changes
+import formats
+import similar
+import household
+import logutils
+
+log = logutils.setup_log(__name__)
+
+KEYS = ['id', 'name', 'aliases', 'parents']
+SIMILAR_KEYS = ['id', 'name', 'similarity']
+
+class VocabularyError(Exception):pass
+
+def resolve(session, name):
+    """ Return the skill named name, or with name as an alias, or None
+    """
+    key = models.skill_key(name)
+    alias = session.query(models.SkillAlias).filter_by(name_key=key).one_or_none()
+    if alias is not None:
+        return alias.skill
+    return session.query(models.Skill).filter_by(name_key=key).order_by(
+        models.Skill.id).first()
+
+def name_criterion(session, name):
+    """ Return the criterion of skills named name, or with name as an
+        alias, an indexed lookup
+    """
+    key = models.skill_key(name)
+    skill = resolve(session, name) if session is not None else None
+    if skill is not None and skill.name_key != key:
+        return models.Skill.id == skill.id
+    return models.Skill.name_key == key
+
+def canonical(session, name, cache=None):
+    """ Return the skill named name, adding it to the vocabulary if new,
+        or taking it from the parent owning it
+        cache holds skills by normalised name, for many lookups
+    """
+    key = models.skill_key(name)
+    if not key:
+        raise VocabularyError, "%r is not a skill name" % name
+    if cache is not None and key in cache:
+        return cache[key]
+    skill = resolve(session, name)
+    if skill is None:
+        skill = models.Skill(name=name.strip())
+        session.add(skill)
+    elif skill.parent_id is not None:
+        # Owned by a parent, as earlier versions added skills. Shared, it
+        # must not be deleted with them, so they keep it as a link
+        owner = models.Parent.get(session, skill.parent_id)
+        if owner is not None and skill not in owner.skills:
+            owner.skills.append(skill)
+        skill.parent_id = None
+    if cache is not None:
+        cache[key] = skill
+    return skill
+
+def link(session, parent, name, cache=None):
+    """ Link a parent to the skill named name. Returns the skill
+    """
+    skill = canonical(session, name, cache)
+    if skill not in parent.skills:
+        parent.skills.append(skill)
+    return skill
+
+def touch(conn, parent_ids):
+    """ Stamp parents whose skill links changed, for the change feed
+    """
+    p = models.Parent.__table__
+    now = datetime.datetime.now()
+    for chunk in household.chunks(parent_ids):
+        conn.execute(p.update().where(p.c.id.in_(chunk)).values(updated=now))
+
+def merge(session, keep, drops):
+    """ Merge skills drops into skill keep: parents linked to, or owning,
+        any of them are linked to keep, and drops are deleted
+
+        Returns the IDs of parents linked to keep
+    """
+    conn = session.connection()
+    s = models.Skill.__table__
+    ps = models.parent_skill
+    a = models.SkillAlias.__table__
+    drops = [id for id in drops if id != keep]
+
+    linked = set(row[0] for row in conn.execute(
+        sa.select([ps.c.parent_id]).where(ps.c.skill_id == keep)))
+    wanted = set(row[0] for row in conn.execute(
+        sa.select([s.c.parent_id]).where(s.c.id == keep)))
+    keys = stats.skill_keys(conn, skill_ids=[keep] + drops)
+    for chunk in household.chunks(drops):
+        wanted.update(row[0] for row in conn.execute(
+            sa.select([ps.c.parent_id]).where(ps.c.skill_id.in_(chunk))))
+        wanted.update(row[0] for row in conn.execute(
+            sa.select([s.c.parent_id]).where(s.c.id.in_(chunk))))
+        conn.execute(a.update().where(a.c.skill_id.in_(chunk)).values(skill_id=keep))
+        conn.execute(ps.delete().where(ps.c.skill_id.in_(chunk)))
+        conn.execute(s.delete().where(s.c.id.in_(chunk)))
+        changes.record_deletes(conn, models.Skill, chunk)
+    wanted.discard(None)
+
+    added = sorted(wanted - linked)
+    if added:
+        conn.execute(ps.insert(), [{'parent_id':id, 'skill_id':keep} for id in added])
+    # Skills of the vocabulary belong to no one parent
+    conn.execute(s.update().where(s.c.id == keep).where(s.c.parent_id != None).values(
+        parent_id=None))
+    touch(conn, wanted)
+    stats.recount_skills(conn, keys)
+    return linked | wanted
+
+def add_alias(session, alias, name):
+    """ Make alias another name of the skill named name, merging skills
+        already named alias into it. Returns the skill
+    """
+    skill = resolve(session, name)
+    if skill is None:
+        raise VocabularyError, "No skill named %s" % name
+    key = models.skill_key(alias)
+    if not key:
+        raise VocabularyError, "%r is not a skill name" % alias
+    if key == skill.name_key:
+        raise VocabularyError, "%s is the name of skill %s" % (alias, skill.id)
+
+    record = session.query(models.SkillAlias).filter_by(name_key=key).one_or_none()
+    if record is None:
+        record = models.SkillAlias(name_key=key)
+        session.add(record)
+    record.skill = skill
+    session.flush()
+    merge(session, skill.id, [row[0] for row in session.query(models.Skill.id).filter(
+        models.Skill.name_key == key)])
+    session.commit()
+    return skill
+
+def migrate(session):
+    """ Merge skills of the same normalised name or alias into the lowest
+        ID of them. Returns (skills merged away, skills left)
+    """
+    conn = session.connection()
+    s = models.Skill.__table__
+    a = models.SkillAlias.__table__
+    keys = {}
+    owned = set()
+    for id, key, parent_id in conn.execute(sa.select([s.c.id, s.c.name_key, s.c.parent_id])):
+        keys[id] = key
+        if parent_id is not None:
+            owned.add(id)
+    aliases = dict((key, keys.get(skill_id)) for key, skill_id in conn.execute(
+        sa.select([a.c.name_key, a.c.skill_id])))
+
+    groups = collections.defaultdict(list)
+    for id, key in keys.iteritems():
+        # Skills without a name have nothing to merge on
+        if key:
+            groups[aliases.get(key) or key].append(id)
+    merged = 0
+    for key, ids in groups.iteritems():
+        ids.sort()
+        if len(ids) > 1 or owned.intersection(ids):
+            merge(session, ids[0], ids[1:])
+            merged += len(ids) - 1
+    session.commit()
+    log.info('Merged %s skills into %s' % (merged, len(groups)))
+    return merged, len(keys) - merged
+
+# Links of parents to skills and freetimes, by the class holding them
+LINKED = {models.Parent:['skills', 'freetimes'], models.Skill:['parents'],
+          models.Freetime:['parents']}
+
+def touch_linked_parents(session, flush_context, instances):
+    """ Stamp parents whose skills or freetimes change, as links are not
+        columns of the parent
+    """
+    now = datetime.datetime.now()
+    touched = set()
+    for obj in session.dirty:
+        for key in LINKED.get(type(obj), []):
+            history = attributes.get_history(obj, key,
+                                             passive=attributes.PASSIVE_NO_INITIALIZE)
+            if type(obj) == models.Parent:
+                if history.added or history.deleted:
+                    touched.add(obj)
+            else:
+                touched.update(list(history.added or []) + list(history.deleted or []))
+    for parent in touched:
+        if not sa.inspect(parent).pending and parent not in session.deleted:
+            parent.updated = now
+
+sa.event.listen(sa.orm.Session, 'before_flush', touch_linked_parents)
+
+def main(args):
+    """
+List the skill vocabulary, add aliases, merge duplicates and find similar skills.
+
+  Skills are found by normalised name (lower case words of letters and
+  digits) or alias, so "First Aid", "first-aid" and "CPR", once an alias, are
+  one skill.  --alias ALIAS NAME makes ALIAS another name of skill NAME, merging
+  skills already named ALIAS into it.
+
+  --migrate merges skills of databases created by earlier versions, which hold
+  a skill record per parent, into one record per skill, linking each parent to
+  it.  Back up the database first.
+
+  --similar NAME lists the skills spelt most like NAME, or with an alias spelt
+  like it, most similar first.  The index of skill names it uses is updated for
+  changed skills as it is searched.  --reindex rebuilds it.
+
+  skillsdb skills
+  skillsdb skills --alias cpr "first aid"
+  skillsdb skills --migrate
+  skillsdb skills --similar woodwork
+    """
+    session_config = utils.load_config(args.config, args.tenant)
+    if args.similar or args.reindex:
+        session = session_config.get_session()
+        log.info('Indexed %s skills' % similar.refresh(session, args.reindex))
+        if args.similar:
+            writer = formats.RecordWriter(args.format, SIMILAR_KEYS)
+            for skill, score in similar.search(session, args.similar, args.top):
+                writer.write(zip(SIMILAR_KEYS, [skill.id, skill.name, round(score, 3)]))
+            writer.close()
+        session.close()
+        return 0
+
+    if args.alias or args.migrate:
+        session = session_config.get_session()
+        for alias, name in args.alias or []:
+            skill = add_alias(session, alias, name)
+            log.info('%s is an alias of skill %s (%s)' % (alias, skill.id, skill.name))
+        if args.migrate:
+            merged, left = migrate(session)
+            log.info('Merged %s skills, %s left' % (merged, left))
+        session.close()
+        return 0
+
+    session = session_config.get_session(readonly=True)
+    aliases = collections.defaultdict(list)
+    for key, skill_id in session.query(models.SkillAlias.name_key, models.SkillAlias.skill_id):
+        aliases[skill_id].append(key)
+    ps = models.parent_skill
+    parents = dict(session.query(ps.c.skill_id, sa.func.count(ps.c.parent_id)).group_by(
+        ps.c.skill_id))
+
+    writer = formats.RecordWriter(args.format, KEYS)
+    for id, name in session.query(models.Skill.id, models.Skill.name).order_by(
+            models.Skill.name_key, models.Skill.id):
+        writer.write(zip(KEYS, [id, name, '; '.join(sorted(aliases[id])), parents.get(id, 0)]))
+    writer.close()
+    session.close()
+    return 0